@@ -0,0 +1,207 @@
+import os
+import time
+import uuid
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# States of an analysis job
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Progress queue of the current pool worker, set by _init_worker
+_progress_queue = None
+
+
+def _init_worker(progress_queue):
+    global _progress_queue
+    _progress_queue = progress_queue
+
+
+def _run_analysis_job(job_id, recording_path, output_dir, delete_input):
+    """
+    Runs eeg_analysis.run_anlaysis in a pool worker, reporting its progress to
+    the parent through the progress queue.
+
+    Returns:
+    - figures (list): Names of the files written to output_dir.
+    """
+    # Imported here so only the pool workers load MNE and matplotlib
+    from eeg.eeg_analysis import run_anlaysis
+    from eeg.eeg_recording import remove_recording
+
+    def progress(step, total, stage):
+        _progress_queue.put((job_id, step, total, stage))
+
+    _progress_queue.put((job_id, 0, None, "started"))
+    os.makedirs(output_dir, exist_ok=True)
+    try:
+        run_anlaysis(recording_path, output_dir=output_dir, progress=progress)
+    finally:
+        if delete_input:
+            remove_recording(recording_path)
+    return sorted(name for name in os.listdir(output_dir) if name.endswith(".png"))
+
+
+class AnalysisJob:
+    """
+    State of one analysis submitted to an AnalysisJobQueue.
+    """
+
+    def __init__(self, job_id, recording_path, output_dir, room=None, session=None, patient=None):
+        self.job_id = job_id
+        self.recording_path = recording_path
+        self.output_dir = output_dir
+        self.room = room
+        self.session = session
+        self.patient = patient
+
+        self.state = QUEUED
+        self.step = 0
+        self.total = None
+        self.stage = None
+        self.figures = []
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "session": self.session,
+            "patient": self.patient,
+            "state": self.state,
+            "step": self.step,
+            "total": self.total,
+            "stage": self.stage,
+            "figures": self.figures,
+            "error": self.error,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class AnalysisJobQueue:
+    """
+    Runs end-of-session analyses in a pool of worker processes.
+
+    `submit` returns at once with a job id, so a session can close without
+    waiting for MNE, and several analyses run in parallel on separate cores.
+    Progress reported by the workers and job completion are forwarded to
+    `on_event(event, job)` from a listener thread, with event being
+    'analysis_progress' or 'analysis_done'.
+    """
+
+    def __init__(self, max_workers=None, on_event=None, keep_finished=256):
+        """
+        Parameters:
+        - max_workers (int, optional): Number of worker processes, defaults to the
+          number of CPUs capped at 4.
+        - on_event (callable, optional): on_event(event, job).
+        - keep_finished (int): Number of finished jobs kept for status queries.
+        """
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.on_event = on_event
+        self.keep_finished = keep_finished
+
+        # Spawn fresh interpreters, forking the threaded server is not safe
+        context = multiprocessing.get_context("spawn")
+        self._progress = context.Queue()
+        self._executor = ProcessPoolExecutor(self.max_workers, mp_context=context,
+                                             initializer=_init_worker, initargs=(self._progress,))
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._listener = threading.Thread(target=self._listen, name="analysis-progress", daemon=True)
+        self._listener.start()
+
+    def submit(self, recording_path, output_dir, room=None, session=None, patient=None, delete_input=False):
+        """
+        Queues the analysis of a recording.
+
+        Parameters:
+        - recording_path (str): Recording (binary or CSV) to analyse.
+        - output_dir (str): Directory the figures are written to.
+        - room (str, optional): Socket.IO room the job's events are meant for.
+        - session, patient (str, optional): Session and patient the recording belongs to.
+        - delete_input (bool): Remove the recording once it has been analysed.
+
+        Returns:
+        - job (AnalysisJob): The queued job.
+        """
+        job = AnalysisJob(uuid.uuid4().hex, recording_path, output_dir, room, session, patient)
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._forget_finished()
+        job.future = self._executor.submit(_run_analysis_job, job.job_id, recording_path,
+                                           output_dir, delete_input)
+        job.future.add_done_callback(lambda future: self._finished(job, future))
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _forget_finished(self):
+        # Drop the oldest finished jobs beyond keep_finished
+        finished = [job for job in self._jobs.values() if job.state in (DONE, FAILED)]
+        for job in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job.job_id]
+
+    def _listen(self):
+        while True:
+            message = self._progress.get()
+            if message is None:
+                break
+            job_id, step, total, stage = message
+            job = self.get(job_id)
+            # Progress and results travel on separate pipes, ignore progress arriving late
+            if job is None or job.state in (DONE, FAILED):
+                continue
+            if job.started_at is None:
+                job.started_at = time.time()
+            if job.state == QUEUED:
+                job.state = RUNNING
+            job.step, job.total, job.stage = step, total, stage
+            self._notify('analysis_progress', job)
+
+    def _finished(self, job, future):
+        job.finished_at = time.time()
+        try:
+            job.figures = future.result()
+            job.state = DONE
+        except Exception as e:
+            job.error = str(e)
+            job.state = FAILED
+            logger.error("Analysis job %s failed: %s", job.job_id, e)
+        self._notify('analysis_done', job)
+
+    def _notify(self, event, job):
+        if self.on_event is not None:
+            try:
+                self.on_event(event, job)
+            except Exception as e:
+                logger.exception("Failed to report %s of job %s: %s", event, job.job_id, e)
+
+    def stats(self):
+        jobs = self.jobs()
+        return {
+            "workers": self.max_workers,
+            **{state: sum(job.state == state for job in jobs) for state in (QUEUED, RUNNING, DONE, FAILED)},
+        }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+        self._progress.put(None)
+        self._listener.join(5.0)
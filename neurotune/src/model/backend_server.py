@@ -1,4 +1,4 @@
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify, request, send_from_directory
 from flask_socketio import SocketIO
 from flask_cors import CORS
 import time
@@ -6,27 +6,67 @@ import threading
 import subprocess
 import json
 import os
+import logging
 
-from eeg.eeg import EEG
-from eeg.eeg_analysis import run_anlaysis
-from eeg.eeg_filter import apply_bandpass_filter
-from ml.main import inference
+from eeg.eeg_payload import parse_eeg_format
+from eeg.eeg_bandpower import parse_band_power_rate, BAND_POWER_RATE
+from ml.modelInference import get_predictor
+from pipeline import INFERENCE_THREAD
+from session import Session, SessionRegistry, safe_name, publish_figures
+from analysis_jobs import AnalysisJobQueue, DONE
+from metrics import REGISTRY, CONTENT_TYPE, ACTIVE_SESSIONS
+
+logger = logging.getLogger(__name__)
 
 class BackendServer:
-    def __init__(self):
+    def __init__(self, board="ganglion", serial_port="COM6", artifact_root="sessions", publish_figures=True,
+                 inference_mode=INFERENCE_THREAD, analysis_workers=None):
+        """
+        Parameters:
+        - board (str): Board new sessions record from ("ganglion" or "synthetic").
+        - serial_port (str): Default serial port of the board, clients may pass ?serial_port=.
+        - artifact_root (str): Directory holding the per-session artifact directories.
+        - publish_figures (bool): Copy the figures of the last finished session to the working
+          directory, where the frontend picks them up.
+        - inference_mode (str): "thread", or "process" to run features and predictions of
+          every session in a worker process.
+        - analysis_workers (int, optional): Processes running end-of-session analyses,
+          0 to run them on the session's thread.
+        """
         self.app = Flask(__name__)
         CORS(self.app)
         self.socketio = SocketIO(self.app, cors_allowed_origins="*")
-        self.stop = False
-        self.is_done = False
-        self.client_connected = False
-        self.eeg_thread = None  # Track the EEG data thread
+        self.sessions = SessionRegistry()  # Live sessions keyed by socket session id
+        ACTIVE_SESSIONS.set_function(lambda: len(self.sessions))
+        self.board = board
+        self.serial_port = serial_port
+        self.artifact_root = artifact_root
+        self.publish_figures = publish_figures
+        self.inference_mode = inference_mode
+        # End-of-session analyses run in a process pool, sessions close without waiting
+        self.analysis_jobs = None
+        if analysis_workers != 0:
+            self.analysis_jobs = AnalysisJobQueue(analysis_workers, on_event=self.analysis_event)
+        self.chunk_seconds = 0.5  # Length of the chunks sent to the EEG graph
+        self.window_seconds = 3.0  # Length of the window the model sees
+        self.hop_seconds = 0.5  # Time between two predictions
+        self.band_power_rate = BAND_POWER_RATE  # band_power events per second
         # Add routes
         self.app.route("/")(self.hello_world)
+        self.app.route("/model/stats")(self.model_stats)
+        self.app.route("/metrics")(self.metrics)
+        self.app.route("/sessions")(self.list_sessions)
+        self.app.route("/sessions/<sid>/stats")(self.session_stats)
+        self.app.route("/sessions/<patient>/<sid>/<name>")(self.session_artifact)
+        self.app.route("/analysis")(self.list_analysis_jobs)
+        self.app.route("/analysis/<job_id>")(self.analysis_status)
 
         # Listen for stop_eeg event from frontend
         self.socketio.on_event('stop_eeg', self.stop_eeg_data)
 
+        # Listen for the eeg_data payload version requested by the frontend
+        self.socketio.on_event('eeg_format', self.set_eeg_format)
+
         # Listen for client connection and disconnection
         self.socketio.on_event('connect', self.client_connected_event)
         self.socketio.on_event('disconnect', self.client_disconnected_event)
@@ -35,77 +75,119 @@ class BackendServer:
     def hello_world(self):
         return jsonify({'sample_data': 'Hello, World!'})
 
-    # Method to stop EEG data collection
+    # Load/hit counters of the cached inference model
+    def model_stats(self):
+        return jsonify(get_predictor().stats())
+
+    # Counters, gauges and latency histograms in the Prometheus text format
+    def metrics(self):
+        return Response(REGISTRY.expose(), content_type=CONTENT_TYPE)
+
+    # Patient, state and artifact directory of every live session
+    def list_sessions(self):
+        return jsonify(list(self.sessions.stats(pipeline=False).values()))
+
+    # Queue depths and stage timings of one session's pipeline
+    def session_stats(self, sid):
+        session = self.sessions.get(sid)
+        if session is None:
+            return jsonify({'error': 'unknown session'}), 404
+        return jsonify(session.stats())
+
+    # Figures and recordings of a session, also after it ended
+    def session_artifact(self, patient, sid, name):
+        directory = os.path.join(self.artifact_root, safe_name(patient), safe_name(sid))
+        return send_from_directory(os.path.abspath(directory), name)
+
+    # State of the queued, running and recently finished analyses
+    def list_analysis_jobs(self):
+        if self.analysis_jobs is None:
+            return jsonify([])
+        return jsonify([job.to_dict() for job in self.analysis_jobs.jobs()])
+
+    # Progress of an analysis, and its figures once done
+    def analysis_status(self, job_id):
+        job = self.analysis_jobs.get(job_id) if self.analysis_jobs is not None else None
+        if job is None:
+            return jsonify({'error': 'unknown job'}), 404
+        status = job.to_dict()
+        status['urls'] = [f"/sessions/{job.patient}/{job.session}/{name}" for name in job.figures]
+        return jsonify(status)
+
+    # Forward analysis progress and completion to the room of the session
+    def analysis_event(self, event, job):
+        self.socketio.emit(event, job.to_dict(), to=job.room)
+        if event == 'analysis_done' and job.state == DONE and self.publish_figures:
+            publish_figures(job.output_dir, os.getcwd())
+
+    # Method to stop EEG data collection of the calling client
     def stop_eeg_data(self):
-        self.stop = True  # Set stop flag to True to exit the loop in get_EEG_data
-        self.is_done = True  # Mark the result as ready
-        print("EEG collection stopped.")
+        session = self.sessions.get(request.sid)
+        if session is not None:
+            session.stop()  # Exit the recording loop, the analysis then runs
+            logger.info("EEG collection stopped for session %s.", session.sid)
 
-    # Method to start EEG data collection when the client is connected
-    def client_connected_event(self):
-        self.client_connected = True  # Set client connection flag to True
-        self.stop = False  # Reset stop flag in case it's been set
-        print("Client connected, starting EEG data collection.")
+    # Method to negotiate the eeg_data payload version, e.g. {"version": 2}
+    def set_eeg_format(self, message):
+        eeg_format = parse_eeg_format(message)
+        session = self.sessions.get(request.sid)
+        if session is not None:
+            session.set_eeg_format(eeg_format)
+        self.socketio.emit('eeg_format', {'version': eeg_format}, to=request.sid)
 
-        # Start a new EEG data collection thread if not already running
-        if not self.eeg_thread or not self.eeg_thread.is_alive():
-            self.eeg_thread = threading.Thread(target=self.get_EEG_data)
-            self.eeg_thread.daemon = True  # Set as daemon to exit when the main program exits
-            self.eeg_thread.start()
+    # Method to start a session when a client connects, e.g. ?patient=42&eeg_format=2&band_power_rate=4
+    def client_connected_event(self):
+        session = Session(request.sid, request.args.get('patient'), self.socketio.emit,
+                          artifact_root=self.artifact_root, board=self.board,
+                          serial_port=request.args.get('serial_port', self.serial_port),
+                          # Clients may also ask for a payload version with ?eeg_format=2
+                          eeg_format=parse_eeg_format(request.args.get('eeg_format')),
+                          chunk_seconds=self.chunk_seconds,
+                          window_seconds=self.window_seconds,
+                          hop_seconds=self.hop_seconds,
+                          inference_mode=self.inference_mode,
+                          analysis_jobs=self.analysis_jobs,
+                          on_finished=self.session_finished,
+                          # Live band powers per second, 0 turns them off
+                          band_power_rate=parse_band_power_rate(request.args.get('band_power_rate'),
+                                                                self.band_power_rate))
+        self.sessions.add(session)
+        logger.info("Client connected, starting session %s for patient %s (%d live).",
+                    session.sid, session.patient, len(self.sessions))
+        session.start()
 
     # Method to handle client disconnection
     def client_disconnected_event(self):
-        self.client_connected = False  # Reset client connection flag
-        self.stop = True  # Stop EEG data collection
-        print("Client disconnected, stopping EEG data collection.")
-
-    # Method to collect EEG data and emit it via SocketIO
-    def get_EEG_data(self):
-        if not self.client_connected:
-            print("Client not connected, not starting EEG data collection.")
-            return
-
-        eeg_object = EEG()
-        eeg_object.init_params()
-        eeg_object.init_board()
-        eeg_object.init_stream()
-        togle = True
-        while not self.stop:
-            data = eeg_object.start_streaming(3)  
-            if(data != None):
-                data = apply_bandpass_filter(data)
-            # file_path = f"{"User"}_{"temp"}_{1}.csv"
-            self.socketio.emit('eeg_data', data)
-            self.get_output_data()
-            time.sleep(0.5)
-
-            '''
-            // [{"ch1 - AF7":325.9210614385,"ch2 - AF8":422.8817076897,"ch3 - TP9":35.1251403838,"ch4 - TP10":197.6649323581,"timestamp":1731732867.2994301319},
-            '''
-        eeg_object.stop_board()
-        final_file_path = f"{"User"}_{"final"}_{1}.csv"
-        run_anlaysis(final_file_path)
-        final_file_path
-        if os.path.exists(final_file_path):
-            os.remove(final_file_path)
-        self.socketio.emit('disconnected', "done")
-        
+        session = self.sessions.get(request.sid)
+        if session is not None:
+            session.stop()  # Stop EEG data collection, the session unregisters once analysed
+            logger.info("Client disconnected, stopping session %s.", session.sid)
+
+    # Called on the session's thread once its recording and analysis are over
+    def session_finished(self, session):
+        self.sessions.remove(session.sid)
+        # Figures of queued analyses are published when their job is done
+        if self.publish_figures and session.is_done and session.analysis_job is None:
+            publish_figures(session.artifact_dir, os.getcwd())
+        logger.info("Session %s finished (%d live).", session.sid, len(self.sessions))
+
     def run(self):
+        # Load the model before the first client connects
+        get_predictor().warm_up()
         # Run the Flask server with SocketIO
-        self.socketio.run(self.app, port=5000)
-
-    def get_output_data(self):
-        # make json file that contains ML output from csv file
-        print("getting output data...")
-        inference('input_file.csv')
-        # read json file
-        with open('input_file_predictions.json') as f:
-            data = json.load(f)
-        # emit data to frontend
-        self.socketio.emit('output_data', data)
-        time.sleep(0.5)
-            
+        try:
+            self.socketio.run(self.app, port=5000)
+        finally:
+            if self.analysis_jobs is not None:
+                self.analysis_jobs.shutdown()
+
 
 if __name__ == '__main__':
-    backend_server = BackendServer()
+    # NEUROTUNE_LOG_LEVEL=DEBUG also logs every chunk and window
+    logging.basicConfig(level=os.environ.get("NEUROTUNE_LOG_LEVEL", "INFO").upper(),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    # NEUROTUNE_BOARD=synthetic runs the server without a headset
+    # NEUROTUNE_INFERENCE=process moves features and predictions to a worker process
+    backend_server = BackendServer(board=os.environ.get("NEUROTUNE_BOARD", "ganglion"),
+                                   inference_mode=os.environ.get("NEUROTUNE_INFERENCE", INFERENCE_THREAD))
     backend_server.run()
@@ -0,0 +1,483 @@
+"""
+Microbenchmarks for the signal processing and ML hot paths.
+
+Every benchmark runs on synthetic multi-channel EEG of configurable length and
+sample rate, and reports per-call latency percentiles and the memory allocated
+per call (measured with tracemalloc in a separate pass). Results can be saved as
+a JSON baseline and compared against a later run.
+
+Usage (from src/model):
+    python benchmark.py --seconds 3 --rate 200 --save baseline.json
+    python benchmark.py --compare baseline.json
+    python benchmark.py --only "feature_" --repeat 200
+    python benchmark.py --check
+"""
+import os
+import io
+import re
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import contextlib
+import numpy as np
+import pandas as pd
+
+from eeg.eeg_filter import apply_bandpass_filter
+from eeg.eeg_recording import RecordingWriter, RECORDING_SUFFIX
+from eeg.eeg_clock import MERGED_SAMPLE_RATE
+from ml.processCSV import process_csv, process_samples
+from ml import preprocessData
+from ml.preprocessData import extract_features_from_df, calc_feature_vector
+from ml.modelInference import model_inference, get_predictor
+from ml.runningStats import RunningWindowStats
+from eeg.eeg_stft import RollingSTFT
+
+COL_NAMES = ["ch1 - AF7", "ch2 - AF8", "ch3 - TP9", "ch4 - TP10", "timestamp"]
+
+
+def synthetic_eeg(seconds=3.0, rate=200, channels=4, seed=0, start=1731841666.0):
+    """
+    Generates EEG-like data: electrode DC offsets, theta/alpha/beta oscillations,
+    random-walk drift, white noise and 50 Hz mains, with timestamps shared by pairs of samples
+    like the Ganglion board produces.
+
+    Returns:
+    - samples (np.ndarray): (channels x samples) array.
+    - timestamps (np.ndarray): One timestamp per sample.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * rate)
+    t = np.arange(n) / rate
+    offsets = rng.uniform(-16000, 9000, size=(channels, 1))
+    samples = offsets.copy().repeat(n, axis=1)
+    for freq, amplitude in ((6.0, 30.0), (10.0, 50.0), (20.0, 15.0), (50.0, 10.0)):
+        phases = rng.uniform(0, 2 * np.pi, size=(channels, 1))
+        samples += amplitude * np.sin(2 * np.pi * freq * t + phases)
+    samples += np.cumsum(rng.normal(0, 2.0, size=(channels, n)), axis=1)
+    samples += rng.normal(0, 5.0, size=(channels, n))
+
+    timestamps = start + t
+    timestamps[1::2] = timestamps[0::2][:len(timestamps[1::2])]
+    return samples, timestamps
+
+
+def to_dataframe(samples, timestamps):
+    return pd.DataFrame(np.column_stack((samples.T, timestamps)), columns=COL_NAMES)
+
+
+def measure(fn, repeat, warmup=2):
+    """
+    Calls fn repeatedly and returns latency percentiles (ms) and allocations per call.
+    """
+    for _ in range(warmup):
+        fn()
+
+    durations = np.empty(repeat)
+    for i in range(repeat):
+        start_time = time.perf_counter()
+        fn()
+        durations[i] = time.perf_counter() - start_time
+
+    # Allocations are measured in their own pass since tracemalloc slows every call down
+    alloc_calls = max(1, min(repeat, 10))
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    allocated = 0
+    peak = 0
+    for _ in range(alloc_calls):
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        fn()
+        current, call_peak = tracemalloc.get_traced_memory()
+        peak = max(peak, call_peak - before)
+        allocated += max(0, current - before)
+    tracemalloc.stop()
+
+    ms = durations * 1e3
+    return {
+        "calls": repeat,
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+        "peak_alloc_kb": peak / 1024,
+        "retained_kb_per_call": allocated / alloc_calls / 1024,
+    }
+
+
+def build_cases(samples, timestamps, workdir, analysis_seconds=30.0, rate=200):
+    """
+    Returns the list of (name, callable, repeat factor) benchmark cases.
+    """
+    df = to_dataframe(samples, timestamps)
+    records = df.to_dict(orient='records')
+
+    csv_path = os.path.join(workdir, "input_file.csv")
+    df.to_csv(csv_path, index=True)
+    df_processed = process_csv(csv_path)
+
+    recording_path = os.path.join(workdir, "input_file" + RECORDING_SUFFIX)
+    with RecordingWriter(recording_path, COL_NAMES[:-1], rate) as writer:
+        writer.append(samples, timestamps)
+
+    # The feature functions work on the window resampled to 100 samples
+    channels = df_processed[COL_NAMES[:-1]].values
+    window = preprocessData.resample_windows(channels, 100)
+    covM = np.cov(window.T)
+    feature_vector, feature_names = extract_features_from_df(df_processed.copy(), 3.0)
+    features_df = pd.DataFrame([feature_vector], columns=feature_names)
+
+    cases = [
+        ("apply_bandpass_filter", lambda: apply_bandpass_filter(records), 1.0),
+        ("process_csv", lambda: process_csv(csv_path), 1.0),
+        ("process_recording", lambda: process_csv(recording_path), 1.0),
+        ("extract_features_from_df", lambda: extract_features_from_df(df_processed.copy(), 3.0), 1.0),
+        ("calc_feature_vector", lambda: calc_feature_vector(window), 1.0),
+        # FFT resampling of one window against the cached resampling matrix
+        ("resample_fft", lambda: preprocessData.scipy.signal.resample(channels, 100, axis=0), 4.0),
+        ("resample_operator", lambda: preprocessData.resample_windows(channels, 100), 4.0),
+    ]
+    for name in ("feature_mean", "feature_mean_d", "feature_mean_q", "feature_stddev",
+                 "feature_stddev_d", "feature_moments", "feature_max", "feature_max_d",
+                 "feature_max_q", "feature_min", "feature_min_d", "feature_min_q",
+                 "feature_covariance_matrix", "feature_fft"):
+        cases.append((name, (lambda fn: lambda: fn(window))(getattr(preprocessData, name)), 4.0))
+    cases.append(("feature_eigenvalues", lambda: preprocessData.feature_eigenvalues(covM), 4.0))
+    cases.append(("feature_logcov", lambda: preprocessData.feature_logcov(covM), 4.0))
+    cases.append(("model_inference", lambda: model_inference(features_df), 1.0))
+    # One live window: scaler + predict_proba against the in-place row predictor
+    feature_row = features_df.values[0]
+    cases.append(("predict_proba_row", lambda: get_predictor().predict(feature_row.reshape(1, -1)), 4.0))
+    cases.append(("predict_row", lambda: get_predictor().predict_row(feature_row), 4.0))
+
+    # Statistics of the last 3 s of raw samples after a 0.5 s hop: recomputed from
+    # the window against updated by the running statistics
+    raw_rows = samples.T
+    stats_window, hop = int(3 * rate), int(0.5 * rate)
+    running_stats = RunningWindowStats(raw_rows.shape[1], stats_window)
+    running_stats.update(raw_rows[:stats_window])
+    hop_rows = raw_rows[:hop]
+
+    def window_stats_batch():
+        window_rows = raw_rows[-stats_window:]
+        for fn in (preprocessData.feature_mean, preprocessData.feature_stddev, preprocessData.feature_moments,
+                   preprocessData.feature_max, preprocessData.feature_min, preprocessData.feature_covariance_matrix):
+            fn(window_rows)
+
+    def window_stats_running():
+        running_stats.update(hop_rows)
+        running_stats.mean(), running_stats.std(), running_stats.moments()
+        running_stats.max(), running_stats.min(), running_stats.cov()
+    cases.append(("window_stats_batch", window_stats_batch, 4.0))
+    cases.append(("window_stats_running", window_stats_running, 4.0))
+    # Spectra of a 0.5 s chunk of the live stream
+    stft = RollingSTFT(samples.shape[0], rate)
+    stft.process(samples)
+    cases.append(("rolling_stft", lambda: stft.process(samples[:, :hop]), 4.0))
+
+    # The analysis needs a longer recording (Welch with n_fft=2048, 20 s figures)
+    session_path = os.path.join(workdir, "session.csv")
+    to_dataframe(*synthetic_eeg(analysis_seconds, rate, samples.shape[0], seed=1)).to_csv(session_path, index=True)
+
+    from eeg.eeg_analysis import run_anlaysis
+    from eeg.eeg_cache import SpectralCache
+    spectral_cache = SpectralCache(os.path.join(workdir, "spectral_cache"))
+
+    def analysis(cache, streaming=False):
+        # run_anlaysis writes its figures to the working directory
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            run_anlaysis(session_path, cache=cache, streaming=streaming)
+        finally:
+            os.chdir(cwd)
+    cases.append(("run_anlaysis", lambda: analysis(False), 0.0))
+    # Repeated analysis of the same recording, spectra come from the cache
+    analysis(spectral_cache)
+    cases.append(("run_anlaysis_cached", lambda: analysis(spectral_cache), 0.0))
+    # Block-by-block analysis used for long recordings
+    cases.append(("run_anlaysis_streaming", lambda: analysis(False, streaming=True), 0.0))
+    return cases
+
+
+def check_resample_parity(n_windows=60, rate=200, rtol=1e-6, atol=1e-9, csv_path=None):
+    """
+    Checks that the features of resample_windows match those of the FFT
+    resampling the model was trained with, scipy.signal.resample(..., t=...),
+    and that the predictions are the same: on synthetic windows of 2.5 to 3.5 s,
+    on windows with a constant (railed) channel, and on the processed
+    `csv_path` recording if it exists (the input_file.csv next to this script
+    by default).
+
+    Returns:
+    - failures (list): Description of every mismatch, empty if all match.
+    """
+    failures = []
+    schema = preprocessData.get_feature_schema(4, 100)
+    predictor = get_predictor()
+    worst = 0.0
+
+    def compare(name, signal, unique_timestamps, seconds):
+        nonlocal worst
+        features, _ = preprocessData.extract_features_from_array(signal, seconds, unique_timestamps)
+        resampled, _ = preprocessData.scipy.signal.resample(signal, 100, t=unique_timestamps - unique_timestamps[0],
+                                                            axis=0)
+        reference = schema.select(schema.compute(resampled))
+        worst = max(worst, float(np.max(np.abs(features - reference) / (np.abs(reference) + atol))))
+        if not np.allclose(features, reference, rtol=rtol, atol=atol):
+            failures.append(f"{name}: features differ by up to {np.max(np.abs(features - reference)):.3g}")
+        label, probabilities = predictor.predict_row(features)
+        reference_label, reference_probabilities = predictor.predict_row(reference)
+        if label != reference_label or not np.allclose(probabilities, reference_probabilities, atol=1e-6):
+            failures.append(f"{name}: prediction {label} {probabilities} "
+                            f"instead of {reference_label} {reference_probabilities}")
+
+    for seed in range(n_windows):
+        seconds = 2.5 + (seed % 3) * 0.5
+        compare(f"window {seed}", *process_samples(*synthetic_eeg(seconds, rate, seed=seed)), seconds)
+
+    # A railed electrode reads one constant value, its spectrum must stay zero
+    railed = 4
+    for channel in range(railed):
+        signal, unique_timestamps = process_samples(*synthetic_eeg(3.0, rate, seed=channel))
+        signal[:, channel] = -15686.27734375
+        compare(f"railed channel {channel}", signal, unique_timestamps, 3.0)
+
+    recorded = 0
+    if csv_path is None:
+        csv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "input_file.csv")
+    if os.path.isfile(csv_path):
+        df = process_csv(csv_path)
+        compare(csv_path, df[preprocessData.CHANNEL_COLUMNS].values, df['timestamp'].values, 3.0)
+        recorded += 1
+
+    # Batch path, windows of equal length
+    windows = np.stack([synthetic_eeg(3.0, MERGED_SAMPLE_RATE, seed=seed)[0].T for seed in range(16)])
+    windows[0, :, 2] = -15686.27734375
+    batch, _ = preprocessData.extract_features_batch(windows)
+    resampled = preprocessData.scipy.signal.resample(windows, 100, axis=1)
+    reference = schema.select(schema.compute_batch(resampled))
+    if not np.allclose(batch, reference, rtol=rtol, atol=atol):
+        failures.append(f"batch: features differ by up to {np.max(np.abs(batch - reference)):.3g}")
+
+    print(f"resample parity: {n_windows} windows, {railed} with a railed channel, {recorded} recording "
+          f"and a batch of {len(windows)}, largest relative feature difference {worst:.3g}")
+    return failures
+
+
+def check_running_stats(seconds=60.0, rate=200, window_seconds=3.0, rtol=1e-7, atol=1e-9):
+    """
+    Checks that RunningWindowStats, fed a stream in chunks of random sizes with
+    a few NaN rows and a railed channel, matches the batch functions of
+    preprocessData on the same finite rows after every chunk.
+
+    Returns:
+    - failures (list): Description of every mismatch, empty if all match.
+    """
+    failures = []
+    samples, _ = synthetic_eeg(seconds, rate, seed=7)
+    rows = samples.T.copy()
+    rows[:, 2] = -15686.27734375
+    rng = np.random.default_rng(7)
+    rows[rng.choice(len(rows), 5, replace=False), 1] = np.nan
+    window = int(window_seconds * rate)
+    running = RunningWindowStats(rows.shape[1], window)
+    finite = rows[np.isfinite(rows).all(axis=1)]
+    seen, start, chunks = 0, 0, 0
+    while start < len(rows):
+        chunk = rows[start:start + int(rng.integers(1, rate))]
+        start += len(chunk)
+        running.update(chunk)
+        seen += int(np.isfinite(chunk).all(axis=1).sum())
+        window_rows = finite[max(0, seen - window):seen]
+        if len(window_rows) < 4:
+            continue
+        chunks += 1
+        skew, kurt = running.moments()
+        pairs = {
+            "mean": (running.mean(), preprocessData.feature_mean(window_rows)[0]),
+            "std": (running.std(), preprocessData.feature_stddev(window_rows)[0]),
+            "moments": (np.append(skew, kurt), preprocessData.feature_moments(window_rows)[0]),
+            "max": (running.max(), preprocessData.feature_max(window_rows)[0]),
+            "min": (running.min(), preprocessData.feature_min(window_rows)[0]),
+            "cov": (running.cov(), preprocessData.feature_covariance_matrix(window_rows)[2]),
+        }
+        for name, (value, reference) in pairs.items():
+            if not np.allclose(value, reference, rtol=rtol, atol=atol):
+                failures.append(f"running {name} after {seen} rows: differs by up to "
+                                f"{np.max(np.abs(value - reference)):.3g}")
+    print(f"running stats: {chunks} chunks of a {seconds:g} s stream with NaN rows and a railed channel")
+    return failures
+
+
+_SAMPLE_LINE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{(?:[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*",?)*\})? (\S+)$')
+
+
+def check_metrics_exposition():
+    """
+    Fetches /metrics from a BackendServer after some metrics were observed and
+    parses it as the Prometheus text format 0.0.4: every sample must belong to
+    a family declared by # TYPE before it (counters and gauges by the same
+    name, histograms through _bucket, _sum and _count), every value must be a
+    number, and histogram buckets must be cumulative up to le="+Inf" = _count.
+
+    Returns:
+    - failures (list): Description of every problem, empty if the output is valid.
+    """
+    from backend_server import BackendServer
+    from pipeline import BoundedQueue, DROP_OLDEST
+    from metrics import CONTENT_TYPE
+    from ml.main import features_from_array
+
+    # Give the counters, gauges and histograms some samples
+    queue = BoundedQueue("check", 1, DROP_OLDEST)
+    queue.put(1)
+    queue.put(2)
+    get_predictor().predict_row(features_from_array(*synthetic_eeg()))
+
+    response = BackendServer(board="synthetic", analysis_workers=0).app.test_client().get("/metrics")
+    failures = []
+    if response.content_type != CONTENT_TYPE:
+        failures.append(f"/metrics content type is {response.content_type}")
+
+    types = {}
+    histograms = {}
+    samples = 0
+    for line in response.get_data(as_text=True).splitlines():
+        if not line:
+            continue
+        if line.startswith("# "):
+            parts = line.split(" ", 3)
+            if parts[1] == "TYPE":
+                if parts[2] in types:
+                    failures.append(f"{parts[2]}: declared twice")
+                types[parts[2]] = parts[3]
+            continue
+        match = _SAMPLE_LINE.match(line)
+        if match is None:
+            failures.append(f"unparsable line: {line}")
+            continue
+        name, labels, value = match.groups()
+        samples += 1
+        try:
+            value = float(value)
+        except ValueError:
+            failures.append(f"{name}: value {value} is not a number")
+            continue
+        family = name
+        if types.get(name) is None:
+            for suffix in ("_bucket", "_sum", "_count"):
+                if name.endswith(suffix) and types.get(name[:-len(suffix)]) == "histogram":
+                    family = name[:-len(suffix)]
+        if family not in types:
+            failures.append(f"{name}: sample without a # TYPE line for its family")
+        elif types[family] == "histogram":
+            series_labels = re.sub(r',?le="[^"]*"', "", labels or "").replace("{}", "")
+            series = histograms.setdefault((family, series_labels), {"buckets": []})
+            if name.endswith("_bucket"):
+                series["buckets"].append(value)
+            elif name.endswith("_count"):
+                series["count"] = value
+
+    for (family, labels), series in histograms.items():
+        buckets = series["buckets"]
+        if any(later < earlier for earlier, later in zip(buckets, buckets[1:])):
+            failures.append(f"{family}{labels}: buckets are not cumulative")
+        if not buckets or buckets[-1] != series.get("count"):
+            failures.append(f"{family}{labels}: +Inf bucket differs from _count")
+
+    print(f"metrics exposition: {len(types)} families, {samples} samples")
+    return failures
+
+
+def compare(results, baseline):
+    """ Prints the p50 ratio of every benchmark against a saved baseline """
+    print(f"\n{'benchmark':<28}{'base p50':>12}{'p50':>12}{'ratio':>9}")
+    for name, result in results["benchmarks"].items():
+        base = baseline.get("benchmarks", {}).get(name)
+        if base is None:
+            print(f"{name:<28}{'-':>12}{result['p50_ms']:>12.3f}{'new':>9}")
+            continue
+        ratio = result["p50_ms"] / base["p50_ms"] if base["p50_ms"] else float('nan')
+        print(f"{name:<28}{base['p50_ms']:>12.3f}{result['p50_ms']:>12.3f}{ratio:>8.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the EEG signal and ML hot paths.")
+    parser.add_argument("--seconds", type=float, default=3.0, help="Length of the synthetic recording.")
+    parser.add_argument("--rate", type=int, default=200, help="Sample rate of the synthetic recording.")
+    parser.add_argument("--channels", type=int, default=4, help="Number of channels (the model expects 4).")
+    parser.add_argument("--repeat", type=int, default=50, help="Timed calls per benchmark.")
+    parser.add_argument("--analysis-seconds", type=float, default=30.0, help="Length of the recording analysed by run_anlaysis.")
+    parser.add_argument("--analysis-repeat", type=int, default=1, help="Timed calls of run_anlaysis.")
+    parser.add_argument("--only", default=None, help="Regular expression selecting benchmarks.")
+    parser.add_argument("--save", default=None, help="Save the results as a JSON baseline.")
+    parser.add_argument("--compare", default=None, help="Compare against a JSON baseline.")
+    parser.add_argument("--check", action="store_true",
+                        help="Run the parity checks instead of the benchmarks, exit with 1 on a mismatch.")
+    args = parser.parse_args()
+
+    if args.check:
+        failures = check_resample_parity(rate=args.rate) + check_running_stats(rate=args.rate) \
+            + check_metrics_exposition()
+        for failure in failures:
+            print(f"FAILED {failure}")
+        print("All checks passed." if not failures else f"{len(failures)} check(s) failed.")
+        raise SystemExit(1 if failures else 0)
+
+    samples, timestamps = synthetic_eeg(args.seconds, args.rate, args.channels)
+    get_predictor().warm_up()
+
+    results = {
+        "config": {
+            "seconds": args.seconds,
+            "analysis_seconds": args.analysis_seconds,
+            "rate": args.rate,
+            "channels": args.channels,
+            "repeat": args.repeat,
+        },
+        "machine": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpus": os.cpu_count(),
+        },
+        "benchmarks": {},
+    }
+
+    workdir = tempfile.mkdtemp(prefix="neurotune-bench-")
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            cases = build_cases(samples, timestamps, workdir, args.analysis_seconds, args.rate)
+
+        for name, fn, factor in cases:
+            if args.only and not re.search(args.only, name):
+                continue
+            repeat = args.analysis_repeat if factor == 0.0 else max(1, int(args.repeat * factor))
+            # The code under test prints progress, keep the report readable
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = measure(fn, repeat, warmup=0 if factor == 0.0 else 2)
+            results["benchmarks"][name] = result
+            print(f"{name:<28} p50 {result['p50_ms']:9.3f} ms  p90 {result['p90_ms']:9.3f} ms  "
+                  f"p99 {result['p99_ms']:9.3f} ms  peak {result['peak_alloc_kb']:9.1f} KiB")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,19 @@
 import time
 import os
+import logging
 import numpy as np
 import pandas as pd
 from brainflow.board_shim import BoardShim, BrainFlowInputParams, BoardIds
 from brainflow.exit_codes import BrainFlowError
 
+from eeg.eeg_buffer import EEGRingBuffer, SharedEEGRingBuffer
+from eeg.eeg_payload import encode_records_frame
+from eeg.eeg_recording import RecordingWriter, RECORDING_SUFFIX
+from eeg.eeg_clock import SampleClock
+from metrics import POLL_INTERVAL, SAMPLES_PER_POLL
+
+logger = logging.getLogger(__name__)
+
 class EEG:
     def __init__(self):
         self.params = None
@@ -12,20 +21,46 @@ class EEG:
         self.board = None
         self.eeg_channels = None
         self.timestamp = None
+        self.sampling_rate = None
+
+        # Fit of the board's timestamps against the sample count
+        self.clock = None
+        # perf_counter() of the last read of the board's data
+        self.last_poll = None
+
+        # Preallocated ring buffer the acquisition loop writes into
+        self.buffer = None
+        self.buffer_seconds = 60
+        # Allocate the buffer in shared memory, for an inference worker process
+        self.shared_buffer = False
+
+        # Last chunk collected by start_streaming, as (channels x samples) and timestamps
+        self.last_samples = None
+        self.last_timestamps = None
 
         # For collecting training data
         self.name = "User"
         self.number = 1
         self.flavor = "final"
 
+        # Directory the recordings are written to
+        self.output_dir = "."
+
+        # The session is recorded in the binary format ("binary"), or appended to a CSV ("csv")
+        self.recording_format = "binary"
+        self.recorder = None
+
         # Set the recording duration to 3 minutes (180 seconds)
         self.duration = 180
         self.col_names = ["ch1 - AF7", "ch2 - AF8", "ch3 - TP9", "ch4 - TP10", "timestamp"]
 
-    def init_params(self, serial_port="COM6"):
-        """ Initialize parameters for the board connection """
+        # Live inference reads the arrays directly, the temporary CSV is optional
+        self.write_temp_csv = False
+
+    def init_params(self, serial_port="COM6", board_id=BoardIds.GANGLION_BOARD.value):
+        """ Initialize parameters for the board connection (the Ganglion unless another board id is given) """
         self.params = BrainFlowInputParams()
-        self.board_id = BoardIds.GANGLION_BOARD.value
+        self.board_id = board_id
         self.params.serial_port = serial_port
 
     def init_board(self):
@@ -34,8 +69,15 @@ class EEG:
             raise ValueError("Parameters are not initialized. Call `init_params` first.")
         
         self.board = BoardShim(self.board_id, self.params)
-        self.eeg_channels = BoardShim.get_eeg_channels(self.board_id)
+        # Keep the channels named in col_names (all four on the Ganglion)
+        self.eeg_channels = BoardShim.get_eeg_channels(self.board_id)[:len(self.col_names) - 1]
         self.timestamp = BoardShim.get_timestamp_channel(self.board_id)
+        self.sampling_rate = BoardShim.get_sampling_rate(self.board_id)
+        self.clock = SampleClock(self.sampling_rate)
+        buffer_class = SharedEEGRingBuffer.create if self.shared_buffer else EEGRingBuffer
+        self.buffer = buffer_class(len(self.eeg_channels),
+                                   self.buffer_seconds * self.sampling_rate,
+                                   sample_rate=self.sampling_rate)
         
     def init_stream(self):
         self.board.prepare_session()
@@ -46,51 +88,88 @@ class EEG:
         if self.board is None:
             raise ValueError("Board is not initialized. Call `init_board` first.")
         
-        all_data = []
         try:
             # Prepare and start the session
-            print("Streaming started successfully.")
+            logger.debug("Streaming started successfully.")
 
             start_time = time.time()
+            start_count = self.buffer.total_written
 
             # Loop to collect data for the specified duration
             while time.time() - start_time < duration:
-                # Wait until there are at least 200 data points available (about 1 second of data)
+                # Wait until there are at least 50 data points available
                 while self.board.get_board_data_count() < 50:
                     time.sleep(0.005)
 
                 data = self.board.get_board_data()  # Retrieve data
-
-                # Process and store data
-                eegdf = pd.DataFrame(np.transpose(data[self.eeg_channels]))
-                timedf = pd.DataFrame(np.transpose(data[self.timestamp]))
-
-                newdata = pd.concat([eegdf, timedf], axis=1)
-                all_data.append(newdata)
-
-            # Concatenate all collected data once
-            if all_data:
-                result_df = pd.concat(all_data, ignore_index=True)
-                result_df.columns = self.col_names
-                self.save_to_csv(result_df)
-                return result_df.to_json(orient='records')
+                now = time.perf_counter()
+                if self.last_poll is not None:
+                    POLL_INTERVAL.observe(now - self.last_poll)
+                self.last_poll = now
+                SAMPLES_PER_POLL.observe(data.shape[1])
+
+                # Store the data in place in the ring buffer
+                self.buffer.write(data[self.eeg_channels], data[self.timestamp])
+                self.clock.update(data[self.timestamp])
+
+            # Hand out views of the chunk collected by this call
+            collected = self.buffer.total_written - start_count
+            if collected:
+                samples, timestamps = self.buffer.latest(collected)
+                self.last_samples = samples
+                self.last_timestamps = timestamps
+                self.save_chunk(samples, timestamps)
+                return samples, timestamps
             else:
-                print("No data collected during the session.")
+                logger.debug("No data collected during the session.")
                 return None
 
         except BrainFlowError as e:
-            print(f"BrainFlow error occurred: {e}")
+            logger.error("BrainFlow error occurred: %s", e)
+
+    def latest(self, seconds):
+        """ Return zero-copy views of the last `seconds` of samples and timestamps """
+        return self.buffer.latest_seconds(seconds)
+
+    def chunk_to_records(self, samples, timestamps):
+        """ Convert a chunk to a list of per-sample dicts keyed by the column names """
+        return encode_records_frame(samples, timestamps, self.col_names)
+
+    def save_chunk(self, samples, timestamps):
+        """ Append the collected data to the session recording """
+        if self.recording_format == "csv":
+            self.save_to_csv(samples, timestamps)
+            return
+
+        if self.write_temp_csv:
+            self.save_to_csv(samples, timestamps, temp_only=True)
 
+        # Raw arrays are appended to the binary recording, no text formatting
+        final_file = self.final_file_path()
+        if self.recorder is None:
+            self.recorder = RecordingWriter(final_file, self.col_names[:-1], self.sampling_rate, self.board_id)
+        self.recorder.append(samples, timestamps)
+        logger.debug("Data saved to %s.", final_file)
 
-    def save_to_csv(self, data_frame):
+    def save_to_csv(self, samples, timestamps, temp_only=False):
         """ Save the collected data to CSV """
-        temp_file = f"input_file.csv"
-        data_frame.to_csv(temp_file, index=True)
+        data_frame = pd.DataFrame(np.column_stack((samples.T, timestamps)), columns=self.col_names)
 
-        final_file = f"{self.name}_{self.flavor}_{self.number}.csv"
+        if self.write_temp_csv:
+            temp_file = os.path.join(self.output_dir, "input_file.csv")
+            data_frame.to_csv(temp_file, index=True)
+        if temp_only:
+            return
+
+        final_file = self.final_file_path()
         file_exists = os.path.isfile(final_file)
         data_frame.to_csv(final_file, mode='a', header=not file_exists, index=True)
-        print(f"Data saved to {final_file}.")
+        logger.debug("Data saved to %s.", final_file)
+
+    def final_file_path(self):
+        """ Path of the recording (or CSV) the whole session is appended to """
+        extension = ".csv" if self.recording_format == "csv" else RECORDING_SUFFIX
+        return os.path.join(self.output_dir, f"{self.name}_{self.flavor}_{self.number}{extension}")
 
     def stop_board(self):
         """ Stop streaming and release resources """
@@ -98,9 +177,18 @@ class EEG:
             if self.board is not None:
                 self.board.stop_stream()
                 self.board.release_session()
-                print("Streaming stopped successfully.")
+                logger.info("Streaming stopped successfully.")
         except BrainFlowError as e:
-            print(f"Error while stopping or releasing the session: {e}")
+            logger.error("Error while stopping or releasing the session: %s", e)
+
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+        # Free the shared memory block, nothing reads the buffer once the board is stopped
+        if isinstance(self.buffer, SharedEEGRingBuffer):
+            self.last_samples = self.last_timestamps = None
+            self.buffer.close()
 
 if __name__ == "__main__":
     eeg = EEG()
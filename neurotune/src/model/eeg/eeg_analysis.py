@@ -1,8 +1,14 @@
+import os
 import mne
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from mne.time_frequency import tfr_multitaper
+from mne.time_frequency import tfr_multitaper, RawTFRArray, SpectrumArray
+
+from eeg.eeg_cache import get_spectral_cache, recording_hash
+from eeg.eeg_recording import Recording, is_recording
+from eeg.eeg_clock import SAMPLE_RATE
+from eeg.eeg_bandpower import BANDS
 
 
 
@@ -13,19 +19,20 @@ def input_csv(dataframe):
     # Clean CSV accordingly 
     dataframe =  dataframe.drop(dataframe.columns[[0,5]], axis=1)
 
+    dataframe = dataframe.transpose()
+
+    return input_array(dataframe)
 
+#Take a (channels x samples) array as input
+def input_array(data, sfreq=SAMPLE_RATE):
     # Specify the channels to keep
     ch_names = ['AF7', 'AF8', 'TP9', 'TP10']
     ch_types = ['eeg'] * 4
 
-    # Measured in Hz
-    sampling_freq = 200
-    # Create info
-    info = mne.create_info(ch_names=ch_names, ch_types=ch_types, sfreq=sampling_freq)
-
-    dataframe = dataframe.transpose()
+    # Create info, sfreq in Hz
+    info = mne.create_info(ch_names=ch_names, ch_types=ch_types, sfreq=sfreq)
 
-    raw = mne.io.RawArray(dataframe,info,verbose=True)
+    raw = mne.io.RawArray(data,info,verbose=True)
 
     # Display information on the raw file
     print(raw)
@@ -63,44 +70,146 @@ def process_raw(raw):
 
     return raw
 
-# 1st Visualization: Time-Frequency Analysis on EEG data
-def time_frequency(raw, min, max, max_time):
+# Recordings longer than this are analysed by streaming them, in seconds
+STREAMING_MIN_SECONDS = 15 * 60
 
-    # Adding features to view the TFR for entire timeline or partial 
-    # Adding features to view the TFR for entire frequency range or partial
+# Time range shown by the TFR figures, in seconds
+TFR_TMIN = 0.
+TFR_TMAX = 20.
+# Welch segment length of Raw.compute_psd()
+WELCH_N_FFT = 2048
 
-    # Apply filter to select the common frequency bands
-    raw.filter(0.1,99,fir_design='firwin')
-    
-    freqs = np.logspace(np.log10(min), np.log10(max), 10)
+# Frequencies of the band figures (every Hz of each band, edges included) and the number of cycles used for each band
+BAND_FREQS = {band: np.arange(fmin, fmax + 1, 1) for band, (fmin, fmax) in BANDS.items()}
+BAND_CYCLES = {'Delta': 4, 'Theta': 6, 'Alpha': 8, 'Beta': 10, 'Gamma': 12}
 
+def overview_grid(min, max):
+    """ Frequencies and cycles of the first visualization """
+    freqs = np.logspace(np.log10(min), np.log10(max), 10)
     n_cycles = freqs / 2  # Number of cycles for each frequency
+    return freqs, n_cycles
+
+def band_grids():
+    """ Frequencies and cycles of each band of the third visualization """
+    return {band: (freqs, np.full(len(freqs), float(BAND_CYCLES[band]))) for band, freqs in BAND_FREQS.items()}
+
+def compute_shared_tfr(raw, grids, tmax=TFR_TMAX, picks=(0,), cache=None):
+    """
+    Computes one multitaper TFR over the union of several frequency grids and
+    returns the TFR of each grid, sliced from it and cropped to [TFR_TMIN, tmax].
+
+    Every (frequency, cycles) pair is computed once even if several grids use
+    it. Only the channels in `picks` (the figures show the first channel) and the
+    samples up to tmax plus the longest wavelet are transformed: the values up
+    to tmax do not depend on anything later.
+
+    Parameters:
+    - raw (mne.io.Raw): Filtered recording.
+    - grids (dict): name -> (freqs, n_cycles) with one cycle count per frequency.
+    - cache (SpectralCache, optional): Cache of the TFR, keyed by the transformed
+      samples, frequencies, cycles and time bandwidth.
+
+    Returns:
+    dict: name -> RawTFRArray.
+    """
+    freqs = np.concatenate([np.asarray(f, dtype=float) for f, _ in grids.values()])
+    n_cycles = np.concatenate([np.asarray(c, dtype=float) for _, c in grids.values()])
+    pairs, inverse = np.unique(np.column_stack((freqs, n_cycles)), axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+
+    # A wavelet lasts n_cycles / freq seconds
+    margin = np.max(pairs[:, 1] / pairs[:, 0])
+    raw_tfr = raw.copy().pick(list(picks))
+    raw_tfr.crop(tmin=0, tmax=min(raw_tfr.times[-1], tmax + margin))
+
+    def compute():
+        tfr = tfr_multitaper(raw_tfr, freqs=pairs[:, 0], n_cycles=pairs[:, 1], time_bandwidth=3.0, return_itc=False)
+        return {"data": tfr.get_data(), "times": tfr.times}
+
+    if cache is None:
+        arrays = compute()
+    else:
+        key = cache.key("tfr", recording_hash(raw_tfr.get_data(), raw_tfr.info['sfreq'], raw_tfr.ch_names),
+                        freqs=pairs[:, 0], n_cycles=pairs[:, 1], time_bandwidth=3.0, method="multitaper")
+        arrays = cache.get_or_compute(key, compute)
+    data, times = arrays["data"], arrays["times"]
+
+    tfrs = {}
+    offset = 0
+    for name, (grid_freqs, _) in grids.items():
+        indices = inverse[offset:offset + len(grid_freqs)]
+        offset += len(grid_freqs)
+        grid_tfr = RawTFRArray(raw_tfr.info, data[:, indices], times, pairs[indices, 0], method="multitaper")
+        tfrs[name] = grid_tfr.crop(tmin=TFR_TMIN, tmax=tmax)
+    return tfrs
+
+def compute_psd(raw, fmin=0., fmax=np.inf, cache=None, n_fft=WELCH_N_FFT, n_overlap=0, n_per_seg=None):
+    """
+    Returns the Welch PSD of the EEG channels between fmin and fmax.
+
+    The spectrum is computed over all frequencies and then restricted to
+    [fmin, fmax], which is exactly what Raw.compute_psd does, so one cached
+    spectrum serves every frequency range. The defaults are MNE's, which
+    shortens the segments of recordings shorter than n_fft.
+
+    Parameters:
+    - raw (mne.io.Raw): Filtered recording.
+    - cache (SpectralCache, optional): Cache of the full spectrum, keyed by the
+      samples and the Welch parameters.
+    - n_fft, n_overlap, n_per_seg (int): Welch parameters of Raw.compute_psd.
+
+    Returns:
+    SpectrumArray: The PSD.
+    """
+    picks = mne.pick_types(raw.info, eeg=True)
+    n_fft = min(n_fft, raw.n_times)
+
+    def compute():
+        spectrum = raw.compute_psd(method="welch", picks=picks, n_fft=n_fft, n_overlap=n_overlap,
+                                   n_per_seg=n_per_seg)
+        return {"data": spectrum.get_data(), "freqs": spectrum.freqs}
+
+    if cache is None:
+        arrays = compute()
+    else:
+        key = cache.key("psd", recording_hash(raw.get_data(picks=picks), raw.info['sfreq'],
+                                              [raw.ch_names[i] for i in picks]),
+                        method="welch", n_fft=n_fft, n_overlap=n_overlap, n_per_seg=n_per_seg)
+        arrays = cache.get_or_compute(key, compute)
 
-    # Compute TFR using multitaper
-    tfr = tfr_multitaper(raw, freqs=freqs, n_cycles=n_cycles, time_bandwidth=3.0, return_itc=False)
+    return restrict_spectrum(SpectrumArray(arrays["data"], mne.pick_info(raw.info, picks), arrays["freqs"]), fmin, fmax)
 
-    # Plot the TFR
-    # Specify the time range to view
-    tmin = float(0)
-    tmax = 20
-    tfr_show = tfr.copy().crop(tmin=tmin, tmax=tmax)
+def restrict_spectrum(spectrum, fmin, fmax):
+    """ Returns the part of a spectrum between fmin and fmax, like Raw.compute_psd(fmin, fmax) """
+    mask = (spectrum.freqs >= fmin) & (spectrum.freqs <= fmax)
+    if mask.all():
+        return spectrum
+    return SpectrumArray(spectrum.get_data()[:, mask], spectrum.info, spectrum.freqs[mask])
 
+# 1st Visualization: Time-Frequency Analysis on EEG data
+def time_frequency(raw, min, max, max_time, output_dir=".", tfr_show=None):
+
+    # Adding features to view the TFR for entire timeline or partial 
+    # Adding features to view the TFR for entire frequency range or partial
+
+    # Compute TFR using multitaper, unless run_anlaysis shares its TFR (of the filtered raw)
+    if tfr_show is None:
+        # Apply filter to select the common frequency bands, on a copy so the caller's raw is untouched
+        filtered = raw.copy().filter(0.1,99,fir_design='firwin')
+        tfr_show = compute_shared_tfr(filtered, {'overview': overview_grid(min, max)})['overview']
+
+    # Plot the TFR
     # Make sure to change the baseline mode to stay consistent with the time range
-    tfr_fig = tfr_show.plot([0], baseline=(-0.5, tmin+0.1), mode= 'logratio', title= "Time-Frequency Representation (TFR)", show=False)
-    tfr_fig[0].savefig("tfr_fig.png")
+    tfr_fig = tfr_show.plot([0], baseline=(-0.5, TFR_TMIN+0.1), mode= 'logratio', title= "Time-Frequency Representation (TFR)", show=False)
+    tfr_fig[0].savefig(os.path.join(output_dir, "tfr_fig.png"))
     plt.close(tfr_fig[0])
 
 # 2nd Visualization: Average Power Spectral Density for EEG data
-def average_psd(raw, min, max):
+def average_psd(raw, min, max, output_dir=".", cache=None, spectrum=None):
+    # spectrum, if given, is the full-range PSD of the recording and raw is not used
 
     # Adding features to view the average PSD for entire frequency range or partial
-    freq_bands = {
-        'Delta': (1, 4),       # Delta: 1-4 Hz
-        'Theta': (4, 8),       # Theta: 4-8 Hz
-        'Alpha': (8, 13),      # Alpha: 8-13 Hz
-        'Beta': (13, 30),      # Beta: 13-30 Hz
-        'Gamma': (30, 100)      # Gamma: 30-100 Hz
-    }
+    freq_bands = BANDS
 
     # Color code each frequency band 
     freq_colors = {
@@ -112,8 +221,8 @@ def average_psd(raw, min, max):
     }
 
     if (min==0.1 and max==99):
-        raw.compute_psd(n_fft=2048, picks='eeg', average='mean')
-        avgpsd_fig = raw.compute_psd().plot(picks='eeg', average=True, show=False)
+        psd = compute_psd(raw, cache=cache) if spectrum is None else spectrum
+        avgpsd_fig = psd.plot(picks='eeg', average=True, show=False)
 
         ax = avgpsd_fig.axes[0]
 
@@ -123,12 +232,12 @@ def average_psd(raw, min, max):
 
         ax.legend(loc='upper right')
 
-        avgpsd_fig.savefig("avgpsd.png")
+        avgpsd_fig.savefig(os.path.join(output_dir, "avgpsd.png"))
         plt.close(avgpsd_fig)
     
     else:
-        raw.compute_psd(fmin=min, fmax=max, n_fft=2048, picks='eeg', average='mean')
-        avgpsd_fig = raw.compute_psd(fmin=min, fmax=max).plot(picks='eeg', average=True, show=False)
+        psd = compute_psd(raw, fmin=min, fmax=max, cache=cache) if spectrum is None else restrict_spectrum(spectrum, min, max)
+        avgpsd_fig = psd.plot(picks='eeg', average=True, show=False)
 
         ax = avgpsd_fig.axes[0]
 
@@ -138,68 +247,93 @@ def average_psd(raw, min, max):
 
         ax.legend(loc='upper right')
 
-        avgpsd_fig.savefig("avgpsd.png")
+        avgpsd_fig.savefig(os.path.join(output_dir, "avgpsd.png"))
         plt.close(avgpsd_fig)
 
 # 3rd Visualization: Delta, Theta, Alpha, Beta, Gamma in Time-Frequency Analysis
-def freq_bands(raw, max_time):
-
-    freq_bands = {
-        'Delta': np.arange(1, 5, 1),    # Delta (1-4 Hz)
-        'Theta': np.arange(4, 9, 1),    # Theta (4-8 Hz)
-        'Alpha': np.arange(8, 14, 1),   # Alpha (8-13 Hz)
-        'Beta': np.arange(13, 31, 1),   # Beta (13-30 Hz)
-        'Gamma': np.arange(30, 101,1)   # Gamma: 30-100 Hz
-    }
-
-    # Specify the time range to view
-    tmin = 0
-    tmax = 20
+def freq_bands(raw, max_time, output_dir=".", band_tfrs=None):
 
     print("max: " ,  max_time)
-    # The number of cycles will vary depending on which frequency band to use 
-    n_cycles = {'Delta': 4, 'Theta': 6, 'Alpha': 8, 'Beta': 10, 'Gamma': 12}
+    # The number of cycles varies depending on which frequency band to use,
+    # the TFR of every band is sliced from one shared TFR
+    if band_tfrs is None:
+        band_tfrs = compute_shared_tfr(raw, band_grids())
 
-    fig, axes = plt.subplots(len(freq_bands), 1, figsize=(10, 15))
+    fig, axes = plt.subplots(len(BAND_FREQS), 1, figsize=(10, 15))
 
-    for ax, (band, freqs) in zip(axes, freq_bands.items()):
-
-        # Computing TFR for each frequency band range
-        tfr = tfr_multitaper(raw, freqs=freqs, n_cycles=n_cycles[band], time_bandwidth=3.0, return_itc=False)
-        tfr_show = tfr.copy().crop(tmin=tmin, tmax=tmax)
+    for ax, band in zip(axes, BAND_FREQS):
 
         # Plot the TFR
         # Make sure to change the baseline mode to stay consistent with the time range
-        freqtfr_fig = tfr_show.plot([0], baseline=(-0.5, tmin+0.1), mode= 'logratio', title= "", axes= ax, show=False)
+        freqtfr_fig = band_tfrs[band].plot([0], baseline=(-0.5, TFR_TMIN+0.1), mode= 'logratio', title= "", axes= ax, show=False)
 
         ax.set_title(f"{band} Frequency Band")
     
     plt.tight_layout()
 
-    freqtfr_fig[0].savefig("analysis.png")
+    freqtfr_fig[0].savefig(os.path.join(output_dir, "analysis.png"))
     plt.close(freqtfr_fig[0])
     
 
-def run_anlaysis(csv):
-    # Bring CSV as input
-    dataframe = pd.read_csv(csv)
-    max_time = dataframe['timestamp'].iloc[-1] - dataframe['timestamp'].iloc[0]
-    raw = input_csv(dataframe)
+def run_anlaysis(csv, output_dir=".", progress=None, cache=None, streaming=None):
+    # The figures are written to output_dir (the working directory by default)
+    # progress(step, total, stage), if given, is called as every step finishes
+    # Spectra are cached in the shared spectral cache unless another one, or False, is given
+    if cache is None:
+        cache = get_spectral_cache()
+    elif cache is False:
+        cache = None
+
+    # Long binary recordings are analysed block by block with bounded memory,
+    # streaming=True forces it for any recording and False disables it
+    if streaming is None:
+        streaming = is_recording(csv) and Recording(csv).duration > STREAMING_MIN_SECONDS
+    if streaming:
+        from eeg.eeg_streaming_analysis import run_streaming_analysis
+        run_streaming_analysis(csv, output_dir, progress=progress, cache=cache)
+        return
+
+    def report(step, stage):
+        if progress is not None:
+            progress(step, 4, stage)
+
+    if is_recording(csv):
+        # Binary recording, the samples are read through a memory map
+        recording = Recording(csv)
+        max_time = recording.duration
+        raw = input_array(np.asarray(recording.samples, dtype=float).T, recording.sample_rate or SAMPLE_RATE)
+    else:
+        # Bring CSV as input
+        dataframe = pd.read_csv(csv)
+        max_time = dataframe['timestamp'].iloc[-1] - dataframe['timestamp'].iloc[0]
+        raw = input_csv(dataframe)
     
     # Process the raw file accordingly for MNE
     raw = process_raw(raw)
+    report(1, "preprocessing")
 
     fmin = float(0.1)
     fmax = float(99)
 
+    # Apply filter to select the common frequency bands
+    raw.filter(0.1,99,fir_design='firwin')
+
+    # One TFR over the frequencies of the first and third visualizations
+    grids = band_grids()
+    grids['overview'] = overview_grid(fmin, fmax)
+    tfrs = compute_shared_tfr(raw, grids, cache=cache)
+
     # First visualization
-    time_frequency(raw, fmin, fmax, max_time)
+    time_frequency(raw, fmin, fmax, max_time, output_dir, tfr_show=tfrs.pop('overview'))
+    report(2, "tfr_fig.png")
 
     # Second visualization
-    average_psd(raw, fmin, fmax)
+    average_psd(raw, fmin, fmax, output_dir, cache=cache)
+    report(3, "avgpsd.png")
 
     # Third visualization
-    freq_bands(raw,max_time)
+    freq_bands(raw, max_time, output_dir, band_tfrs=tfrs)
+    report(4, "analysis.png")
     print("done")
 
 if __name__ == "__main__":
@@ -0,0 +1,89 @@
+import numpy as np
+
+# Frequency bands of the analysis figures and of the live band power, in Hz
+BANDS = {
+    'Delta': (1, 4),       # Delta: 1-4 Hz
+    'Theta': (4, 8),       # Theta: 4-8 Hz
+    'Alpha': (8, 13),      # Alpha: 8-13 Hz
+    'Beta': (13, 30),      # Beta: 13-30 Hz
+    'Gamma': (30, 100)     # Gamma: 30-100 Hz
+}
+
+# band_power events per second, and the most a client may ask for
+BAND_POWER_RATE = 2.0
+MAX_BAND_POWER_RATE = 10.0
+# Length of the signal the Welch PSD of one event is averaged over, in seconds
+BAND_POWER_SECONDS = 4.0
+
+
+def parse_band_power_rate(value, default=BAND_POWER_RATE):
+    """
+    Returns the band_power rate requested by a client, clipped to
+    [0, MAX_BAND_POWER_RATE], or the default if it is not a number. 0 turns the
+    events off.
+    """
+    try:
+        rate = float(value)
+    except (TypeError, ValueError):
+        return default
+    if not np.isfinite(rate):
+        return default
+    return min(max(rate, 0.0), MAX_BAND_POWER_RATE)
+
+
+def band_weights(freqs, bands=BANDS):
+    """
+    Returns the (bands x freqs) matrix integrating a PSD over every band with
+    the rectangle rule: frequency bins in [fmin, fmax) weighted by the bin width.
+    """
+    freqs = np.asarray(freqs, dtype=float)
+    df = freqs[1] - freqs[0] if len(freqs) > 1 else 1.0
+    return np.array([((freqs >= fmin) & (freqs < fmax)) * df for fmin, fmax in bands.values()])
+
+
+def band_powers(psd, freqs, bands=BANDS):
+    """
+    Returns the (channels x bands) power of a (channels x freqs) PSD in every band.
+    """
+    return np.asarray(psd) @ band_weights(freqs, bands).T
+
+
+class BandPowerStream:
+    """
+    Per-channel band powers of a live stream, read from a RollingSTFT.
+
+    Every `1 / rate` seconds of signal, the Welch PSD of the newest STFT frames
+    covering `seconds` of signal is integrated over the bands. The spectra are
+    the ones the STFT already computed, so an update is a mean over a few
+    frames and one small matrix product. There is at most one update per
+    chunk fed to the STFT, so the rate is also capped by the chunk rate.
+    """
+
+    def __init__(self, stft, rate=BAND_POWER_RATE, seconds=BAND_POWER_SECONDS, bands=BANDS):
+        """
+        Parameters:
+        - stft (RollingSTFT): STFT fed with the stream.
+        - rate (float): Updates per second of signal, 0 for none.
+        - seconds (float): Length of the Welch average.
+        - bands (dict): Band name -> (fmin, fmax) in Hz.
+        """
+        self.stft = stft
+        self.rate = rate
+        self.bands = list(bands)
+        self.weights = band_weights(stft.freqs, bands)
+        self.n_frames = max(1, int(round((seconds * stft.sampling_rate - stft.n_fft) / stft.hop)) + 1)
+        self.interval = int(round(stft.sampling_rate / rate)) if rate > 0 else None
+        self._next = self.interval
+        self.updates = 0
+
+    def update(self):
+        """
+        Returns the (channels x bands) band powers if an update is due after the
+        samples the STFT has seen, otherwise None.
+        """
+        if self.interval is None or self.stft.samples_seen < self._next or self.stft.frames_total == 0:
+            return None
+        # One update per call, a late one does not trigger a burst of identical ones
+        self._next = (self.stft.samples_seen // self.interval + 1) * self.interval
+        self.updates += 1
+        return self.stft.psd(self.n_frames) @ self.weights.T
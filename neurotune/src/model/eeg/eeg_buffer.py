@@ -0,0 +1,206 @@
+import time
+import threading
+from multiprocessing import shared_memory
+import numpy as np
+
+# Positions in the state array of a buffer
+_HEAD = 0  # Next write position in [0, capacity)
+_TOTAL = 1  # Number of samples written since creation
+_SEQ = 2  # Incremented before and after every write, odd while a write is in progress
+
+class EEGRingBuffer:
+    """
+    Fixed-capacity (channels x samples) ring buffer with a timestamp lane.
+
+    The arrays are allocated once and the acquisition loop writes into them in
+    place. Every sample is stored twice, at position i and i + capacity, so the
+    most recent n <= capacity samples are always one contiguous slice and can be
+    handed out as views without copying.
+
+    Views returned by `latest` are only valid until the writer wraps around;
+    consumers running on other threads should use `snapshot` instead.
+    """
+
+    def __init__(self, n_channels, capacity, sample_rate=None, dtype=np.float64,
+                 samples=None, timestamps=None, state=None):
+        """
+        Parameters:
+        - n_channels (int): Number of channels.
+        - capacity (int): Number of samples kept.
+        - sample_rate (float, optional): Nominal sample rate, used by latest_seconds.
+        - samples, timestamps, state (np.ndarray, optional): Existing arrays to use as
+          storage, e.g. in shared memory. Newly allocated if not given.
+        """
+        self.n_channels = n_channels
+        self.capacity = int(capacity)
+        self.sample_rate = sample_rate
+        self.samples = np.zeros((n_channels, 2 * self.capacity), dtype=dtype) if samples is None else samples
+        self.timestamps = np.zeros(2 * self.capacity) if timestamps is None else timestamps
+        # Head, total written and write sequence live in one array so they can be shared too
+        self.state = np.zeros(3, dtype=np.int64) if state is None else state
+        self.lock = threading.Lock()
+
+    @property
+    def head(self):
+        return int(self.state[_HEAD])
+
+    @head.setter
+    def head(self, value):
+        self.state[_HEAD] = value
+
+    @property
+    def total_written(self):
+        return int(self.state[_TOTAL])
+
+    @total_written.setter
+    def total_written(self, value):
+        self.state[_TOTAL] = value
+
+    def __len__(self):
+        return min(self.total_written, self.capacity)
+
+    def _store(self, start, samples, timestamps):
+        # Write a block that does not wrap, along with its mirror copy
+        stop = start + samples.shape[1]
+        self.samples[:, start:stop] = samples
+        self.samples[:, start + self.capacity:stop + self.capacity] = samples
+        self.timestamps[start:stop] = timestamps
+        self.timestamps[start + self.capacity:stop + self.capacity] = timestamps
+
+    def write(self, samples, timestamps):
+        """
+        Appends a (channels x n) block of samples and its n timestamps.
+
+        Returns:
+            int: Number of samples written.
+        """
+        n = samples.shape[1]
+        if n == 0:
+            return 0
+
+        with self.lock:
+            self.state[_SEQ] += 1
+            # Only the last `capacity` samples of an oversized block can be kept
+            if n > self.capacity:
+                self.head = (self.head + n - self.capacity) % self.capacity
+                self.total_written += n - self.capacity
+                samples = samples[:, -self.capacity:]
+                timestamps = timestamps[-self.capacity:]
+
+            m = samples.shape[1]
+            first = min(m, self.capacity - self.head)
+            self._store(self.head, samples[:, :first], timestamps[:first])
+            if first < m:
+                self._store(0, samples[:, first:], timestamps[first:])
+
+            self.head = (self.head + m) % self.capacity
+            self.total_written += m
+            self.state[_SEQ] += 1
+        return n
+
+    def latest(self, n):
+        """
+        Returns zero-copy views of the most recent n samples and their timestamps.
+        """
+        n = min(int(n), len(self))
+        end = self.head + self.capacity
+        return self.samples[:, end - n:end], self.timestamps[end - n:end]
+
+    def latest_seconds(self, seconds):
+        """
+        Returns zero-copy views of the most recent `seconds` of data.
+        """
+        if self.sample_rate is None:
+            raise ValueError("Sample rate is not set on the buffer.")
+        return self.latest(round(seconds * self.sample_rate))
+
+    def _copy(self, n, end=None):
+        # Copies of the n samples written before the `end`-th sample (the newest by default)
+        lag = 0 if end is None else max(0, self.total_written - int(end))
+        n = max(0, min(int(n), len(self) - lag))
+        stop = self.head + self.capacity - lag
+        return self.samples[:, stop - n:stop].copy(), self.timestamps[stop - n:stop].copy()
+
+    def snapshot(self, n, end=None):
+        """
+        Returns copies of the most recent n samples, taken under the write lock.
+
+        Parameters:
+        - end (int, optional): Absolute sample count the copy ends at, to read an
+          older window that is still in the buffer. Defaults to total_written.
+        """
+        with self.lock:
+            return self._copy(n, end)
+
+    def clear(self):
+        with self.lock:
+            self.state[_SEQ] += 1
+            self.head = 0
+            self.total_written = 0
+            self.state[_SEQ] += 1
+
+
+class SharedEEGRingBuffer(EEGRingBuffer):
+    """
+    EEGRingBuffer stored in a multiprocessing.shared_memory block, so another
+    process can map the same samples without any copy through a pipe.
+
+    One process creates the buffer and writes into it; other processes attach
+    to it by name and read it with `snapshot`. Since the write lock cannot be
+    shared, readers use the write sequence counter in the state array instead:
+    a copy is retried if a write was in progress or happened while copying.
+    """
+
+    def __init__(self, shm, n_channels, capacity, sample_rate=None, owner=False):
+        self.shm = shm
+        self.owner = owner
+        capacity = int(capacity)
+        state = np.ndarray((3,), dtype=np.int64, buffer=shm.buf)
+        timestamps = np.ndarray((2 * capacity,), dtype=np.float64, buffer=shm.buf, offset=state.nbytes)
+        samples = np.ndarray((n_channels, 2 * capacity), dtype=np.float64, buffer=shm.buf,
+                             offset=state.nbytes + timestamps.nbytes)
+        super().__init__(n_channels, capacity, sample_rate, samples=samples,
+                         timestamps=timestamps, state=state)
+
+    @classmethod
+    def create(cls, n_channels, capacity, sample_rate=None):
+        """ Allocates a new zeroed shared buffer, owned by the calling process """
+        capacity = int(capacity)
+        size = 8 * (3 + 2 * capacity + n_channels * 2 * capacity)
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        shm.buf[:size] = bytes(size)
+        return cls(shm, n_channels, capacity, sample_rate, owner=True)
+
+    @classmethod
+    def attach(cls, name, n_channels, capacity, sample_rate=None):
+        """ Maps a buffer created by another process """
+        return cls(shared_memory.SharedMemory(name=name), n_channels, capacity, sample_rate)
+
+    def spec(self):
+        """ Arguments of `attach`, small enough to be sent to another process """
+        return {"name": self.shm.name, "n_channels": self.n_channels,
+                "capacity": self.capacity, "sample_rate": self.sample_rate}
+
+    def snapshot(self, n, end=None):
+        while True:
+            seq = int(self.state[_SEQ])
+            if seq % 2 == 0:
+                samples, timestamps = self._copy(n, end)
+                if int(self.state[_SEQ]) == seq:
+                    return samples, timestamps
+            time.sleep(0.0005)
+
+    def close(self):
+        """
+        Unmaps the buffer in this process, and frees it if this process created it.
+        Views of the buffer must not be used afterwards.
+        """
+        self.samples = self.timestamps = self.state = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # Views handed out by `latest` are still referenced, the mapping goes with them
+            pass
+        if self.owner:
+            self.shm.unlink()
+            self.owner = False
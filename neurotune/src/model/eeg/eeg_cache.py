@@ -0,0 +1,151 @@
+import os
+import json
+import hashlib
+import tempfile
+import functools
+import threading
+import numpy as np
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SPECTRAL_CACHE_DIR = os.environ.get("NEUROTUNE_SPECTRAL_CACHE",
+                                    os.path.join(SCRIPT_DIR, "..", ".spectral_cache"))
+SPECTRAL_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+def recording_hash(data, sfreq, ch_names):
+    """
+    Returns a digest of a recording's samples, sample rate and channel names.
+
+    Parameters:
+    - data (np.ndarray): (channels x samples) array.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([float(sfreq), list(ch_names), list(data.shape)]).encode())
+    digest.update(np.ascontiguousarray(data, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def _jsonable(value):
+    # Parameters as plain JSON values, arrays included
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (np.floating, np.integer)):
+        return value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return str(value)
+    return value
+
+
+class SpectralCache:
+    """
+    Disk cache of spectral results (PSD and TFR arrays) as .npz files.
+
+    Entries are keyed by the content hash of the recording they were computed
+    from and the parameters of the computation, so a repeated analysis of the
+    same recording loads them instead of recomputing. Files are touched when
+    read, and the least recently used ones are deleted once the cache grows
+    beyond `max_bytes`. Several processes may share the same directory: files
+    are written to a temporary name and renamed into place.
+    """
+
+    def __init__(self, cache_dir=SPECTRAL_CACHE_DIR, max_bytes=SPECTRAL_CACHE_MAX_BYTES):
+        """
+        Parameters:
+        - cache_dir (str): Directory holding the .npz files.
+        - max_bytes (int): Size above which the least recently used entries are deleted.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def key(self, kind, content_hash, **params):
+        """ Returns the key of a result of `kind` computed from a recording with `params` """
+        description = json.dumps({"kind": kind, "recording": content_hash,
+                                  "params": {name: _jsonable(value) for name, value in sorted(params.items())}},
+                                 sort_keys=True)
+        return f"{kind}-{hashlib.sha256(description.encode()).hexdigest()[:32]}"
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def load(self, key):
+        """
+        Returns the arrays stored under `key` as a dict, or None if not cached.
+        """
+        path = self.path(key)
+        try:
+            with np.load(path, allow_pickle=False) as stored:
+                arrays = {name: stored[name] for name in stored.files}
+            os.utime(path)  # Mark as recently used
+        except (OSError, ValueError):
+            # Missing, evicted by another process meanwhile, or unreadable
+            self.misses += 1
+            return None
+        self.hits += 1
+        return arrays
+
+    def save(self, key, **arrays):
+        """ Stores arrays under `key` and evicts old entries if the cache is full """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, self.path(key))
+        except OSError as e:
+            print(f"Could not write the spectral cache entry {key}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns the cached arrays of `key`, or computes them with `compute()`
+        (which returns a dict of arrays) and caches them.
+        """
+        arrays = self.load(key)
+        if arrays is None:
+            arrays = compute()
+            self.save(key, **arrays)
+        return arrays
+
+    def evict(self):
+        """ Deletes the least recently used entries until the cache fits in max_bytes """
+        with self._lock:
+            try:
+                entries = []
+                for name in os.listdir(self.cache_dir):
+                    if name.endswith(".npz"):
+                        stat = os.stat(os.path.join(self.cache_dir, name))
+                        entries.append((stat.st_mtime, stat.st_size, name))
+            except OSError:
+                return
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+                total -= size
+
+    def clear(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npz"):
+                os.remove(os.path.join(self.cache_dir, name))
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "cache_dir": self.cache_dir,
+                "max_bytes": self.max_bytes}
+
+
+@functools.lru_cache(maxsize=1)
+def get_spectral_cache():
+    """ Process-wide cache in SPECTRAL_CACHE_DIR """
+    return SpectralCache()
@@ -0,0 +1,131 @@
+import numpy as np
+
+# Sample rate of the Ganglion, the board NeuroTune records from, in Hz.
+# Modules that are not handed the rate of a connected board
+# (BoardShim.get_sampling_rate) or of a recording use this one.
+SAMPLE_RATE = 200
+# BrainFlow gives the Ganglion's samples one timestamp per pair
+SAMPLES_PER_TIMESTAMP = 2
+# Rate of the rows left once samples sharing a timestamp are merged
+MERGED_SAMPLE_RATE = SAMPLE_RATE / SAMPLES_PER_TIMESTAMP
+# Timestamps equal to this many decimals are the same timestamp
+TIMESTAMP_DECIMALS = 7
+
+
+def collapse_duplicates(samples, timestamps, decimals=TIMESTAMP_DECIMALS):
+    """
+    Averages the samples sharing a timestamp.
+
+    Timestamps are rounded to `decimals` decimals and the samples are reduced
+    over runs of equal timestamps with np.add.reduceat. Timestamps from the
+    board are already in order, so sorting only happens if they are not.
+
+    Parameters:
+    - samples (np.ndarray): (channels x samples) array, e.g. from the acquisition buffer.
+    - timestamps (np.ndarray): One timestamp per sample, all finite.
+
+    Returns:
+    - signal (np.ndarray): (unique timestamps x channels) array of averaged samples.
+    - unique_timestamps (np.ndarray): Sorted unique rounded timestamps.
+    """
+    samples = np.asarray(samples, dtype=float)
+    rounded = np.round(np.asarray(timestamps, dtype=float), decimals)
+    if len(rounded) == 0:
+        return np.empty((0, samples.shape[0])), rounded
+
+    rows = samples.T
+    if np.any(rounded[1:] < rounded[:-1]):
+        order = np.argsort(rounded, kind='stable')
+        rounded = rounded[order]
+        rows = rows[order]
+
+    # Start of every run of equal timestamps
+    starts = np.flatnonzero(np.concatenate(([True], rounded[1:] != rounded[:-1])))
+    counts = np.diff(np.append(starts, len(rounded)))
+    signal = np.add.reduceat(rows, starts, axis=0)
+    signal /= counts[:, None]
+    return signal, rounded[starts]
+
+
+class SampleClock:
+    """
+    Maps sample indices to wall-clock time.
+
+    BrainFlow timestamps samples when their packet arrives, so several samples
+    share a timestamp and the timestamps jitter with the radio link. The clock
+    fits time = t0 + index / rate by least squares over all the timestamps seen
+    so far. The fit is updated chunk by chunk, in constant memory, by merging
+    the means and co-moments of each chunk into the running ones.
+    """
+
+    def __init__(self, nominal_rate=SAMPLE_RATE):
+        """
+        Parameters:
+        - nominal_rate (float): Rate of the board, used until the fit is possible.
+        """
+        self.nominal_rate = nominal_rate
+        self.samples_seen = 0
+        self._origin = None  # First timestamp, keeps the fitted values small
+        self._n = 0
+        self._mean_i = 0.0
+        self._mean_t = 0.0
+        self._m2_i = 0.0
+        self._c_it = 0.0
+
+    def update(self, timestamps):
+        """
+        Adds the timestamps of the next consecutive samples and returns the clock.
+        Samples without a finite timestamp still count, but are not fitted.
+        """
+        timestamps = np.asarray(timestamps, dtype=float)
+        index = self.samples_seen + np.arange(len(timestamps), dtype=float)
+        self.samples_seen += len(timestamps)
+
+        valid = np.isfinite(timestamps)
+        if not valid.all():
+            index, timestamps = index[valid], timestamps[valid]
+        m = len(timestamps)
+        if m == 0:
+            return self
+        if self._origin is None:
+            self._origin = timestamps[0]
+        t = timestamps - self._origin
+
+        # Means and co-moments of the chunk, merged into the running ones
+        mean_i, mean_t = index.mean(), t.mean()
+        m2_i = np.sum((index - mean_i) ** 2)
+        c_it = np.sum((index - mean_i) * (t - mean_t))
+        n = self._n + m
+        delta_i, delta_t = mean_i - self._mean_i, mean_t - self._mean_t
+        self._m2_i += m2_i + delta_i * delta_i * self._n * m / n
+        self._c_it += c_it + delta_i * delta_t * self._n * m / n
+        self._mean_i += delta_i * m / n
+        self._mean_t += delta_t * m / n
+        self._n = n
+        return self
+
+    @property
+    def period(self):
+        """ Fitted seconds per sample, or the nominal one until the fit is possible """
+        if self._m2_i > 0 and self._c_it > 0:
+            return self._c_it / self._m2_i
+        return 1.0 / self.nominal_rate
+
+    @property
+    def rate(self):
+        """ Fitted number of samples per second """
+        return 1.0 / self.period
+
+    def time_of(self, index):
+        """ Returns the fitted wall-clock time of sample `index` (int or array) """
+        if self._origin is None:
+            raise ValueError("The clock has not seen any timestamp yet.")
+        return self._origin + self._mean_t + (np.asarray(index, dtype=float) - self._mean_i) * self.period
+
+    def times(self, start, stop):
+        """ Returns the fitted times of samples [start, stop) """
+        return self.time_of(np.arange(start, stop))
+
+    def stats(self):
+        return {"nominal_rate": self.nominal_rate, "rate": float(self.rate), "samples": self.samples_seen,
+                "drift_ppm": float((self.rate / self.nominal_rate - 1) * 1e6)}
@@ -1,8 +1,67 @@
 import json
+import functools
 import numpy as np
 from scipy import signal
 
-def apply_bandpass_filter(data, sampling_rate=250, lowcut=0.5, highcut=40.0, order=4):
+from eeg.eeg_clock import SAMPLE_RATE
+
+
+@functools.lru_cache(maxsize=32)
+def design_bandpass(sampling_rate, lowcut, highcut, order, output='ba'):
+    """
+    Design a Butterworth bandpass filter, cached per (rate, band, order, output).
+
+    Returns:
+    tuple or np.ndarray: (b, a) coefficients for output='ba', second-order
+        sections for output='sos'. The arrays are shared and must not be modified.
+    """
+    # Calculate Nyquist frequency and normalize frequencies
+    nyquist = sampling_rate / 2.0
+    low = lowcut / nyquist
+    high = highcut / nyquist
+
+    return signal.butter(order, [low, high], btype='band', output=output)
+
+
+class StreamingBandpass:
+    """
+    Causal bandpass filter that carries its state across chunks.
+
+    Chunks are (channels x samples) arrays and all channels are filtered in a
+    single vectorized call. Because the filter state (zi) is kept between calls,
+    consecutive chunks are filtered as one continuous signal without transients
+    at the chunk boundaries.
+    """
+
+    def __init__(self, n_channels, sampling_rate=SAMPLE_RATE, lowcut=0.5, highcut=40.0, order=4):
+        self.n_channels = n_channels
+        self.sampling_rate = sampling_rate
+        self.sos = design_bandpass(sampling_rate, lowcut, highcut, order, output='sos')
+        self.zi = None
+
+    def reset(self):
+        """ Forget the filter state, e.g. after a gap in the stream """
+        self.zi = None
+
+    def process(self, samples):
+        """
+        Filter the next (channels x samples) chunk and return the filtered array.
+        """
+        samples = np.asarray(samples, dtype=float)
+        if samples.shape[-1] == 0:
+            return samples.copy()
+
+        if self.zi is None:
+            # Start in steady state for each channel's first sample to avoid the
+            # step response to the DC offset of the electrodes
+            zi = signal.sosfilt_zi(self.sos)
+            self.zi = zi[:, None, :] * samples[:, 0][None, :, None]
+
+        filtered, self.zi = signal.sosfilt(self.sos, samples, axis=-1, zi=self.zi)
+        return filtered
+
+
+def apply_bandpass_filter(data, sampling_rate=SAMPLE_RATE, lowcut=0.5, highcut=40.0, order=4):
     """
     Apply bandpass filter to EEG data in JSON format
     
@@ -10,13 +69,14 @@ def apply_bandpass_filter(data, sampling_rate=250, lowcut=0.5, highcut=40.0, ord
     data (str or list): JSON string or List of dictionaries containing EEG data
         Format: [{"ch1 - AF7": float, "ch2 - AF8": float, "ch3 - TP9": float, 
                  "ch4 - TP10": float, "timestamp": float}, ...]
-    sampling_rate (float): Sampling rate in Hz, default 200 Hz
+    sampling_rate (float): Sampling rate in Hz, default SAMPLE_RATE of eeg_clock
     lowcut (float): Lower frequency bound in Hz, default 0.5 Hz
     highcut (float): Upper frequency bound in Hz, default 40 Hz
     order (int): Filter order, default 4
     
     Returns:
-    dict: Dictionary containing filtered data for each channel and timestamps
+    list: One dictionary per sample with the timestamp and the filtered value
+        of every channel, in the input format
     """
     # If data is a JSON string, parse it
     if isinstance(data, str):
@@ -33,26 +93,18 @@ def apply_bandpass_filter(data, sampling_rate=250, lowcut=0.5, highcut=40.0, ord
         "timestamps": timestamps.tolist()
     }
     
-    # Calculate Nyquist frequency
-    nyquist = sampling_rate / 2.0
+    # Create Butterworth bandpass filter coefficients
+    b, a = design_bandpass(sampling_rate, lowcut, highcut, order)
     
-    # Normalize frequencies
-    low = lowcut / nyquist
-    high = highcut / nyquist
+    # Extract raw channel data as a (samples x channels) matrix
+    raw_channels = np.array([[sample[channel] for channel in channel_names] for sample in data])
     
-    # Create Butterworth bandpass filter coefficients
-    b, a = signal.butter(order, [low, high], btype='band')
+    # Apply zero-phase bandpass filter to all channels at once
+    filtered_channels = signal.filtfilt(b, a, raw_channels, axis=0)
     
-    # Process each channel
-    for channel in channel_names:
-        # Extract raw channel data
-        raw_channel = np.array([sample[channel] for sample in data])
-        
-        # Apply zero-phase bandpass filter
-        filtered_channel = signal.filtfilt(b, a, raw_channel)
-        
-        # Store filtered data
-        filtered_data[channel] = filtered_channel.tolist()
+    # Store filtered data
+    for index, channel in enumerate(channel_names):
+        filtered_data[channel] = filtered_channels[:, index].tolist()
     
     # Convert to list of dictionaries format if needed
     filtered_json = []
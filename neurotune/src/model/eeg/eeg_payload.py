@@ -0,0 +1,105 @@
+import json
+import numpy as np
+
+# Versions of the `eeg_data` socket payload a client can ask for
+EEG_FORMAT_RECORDS = 1  # List of per-sample dicts keyed by column name (default)
+EEG_FORMAT_COMPACT = 2  # Channel-major float32 block sent as a binary attachment
+SUPPORTED_EEG_FORMATS = (EEG_FORMAT_RECORDS, EEG_FORMAT_COMPACT)
+
+
+def parse_eeg_format(value, default=EEG_FORMAT_RECORDS):
+    """
+    Returns the requested payload version if it is supported, otherwise the default.
+
+    Parameters:
+    - value: Version requested by the client (int, numeric string or dict with a "version" key).
+    """
+    if isinstance(value, dict):
+        value = value.get("version")
+    try:
+        version = int(value)
+    except (TypeError, ValueError):
+        return default
+    return version if version in SUPPORTED_EEG_FORMATS else default
+
+
+def encode_records_frame(samples, timestamps, col_names):
+    """
+    Encodes a (channels x samples) chunk as a list of per-sample dicts (format 1).
+    """
+    rows = np.column_stack((samples.T, timestamps)).tolist()
+    return [dict(zip(col_names, row)) for row in rows]
+
+
+def encode_compact_frame(samples, timestamps, sample_rate, channel_names):
+    """
+    Encodes a (channels x samples) chunk as a compact columnar frame (format 2).
+
+    The samples are sent as one channel-major little-endian float32 block, which
+    Socket.IO transmits as a binary attachment. Sample i of channel c is at
+    data[c * n + i] and was taken at t0 + i / fs.
+
+    Returns:
+    dict: {"v", "channels", "fs", "t0", "n", "dtype", "data"}
+    """
+    n = samples.shape[1]
+    data = np.ascontiguousarray(samples, dtype='<f4')
+    return {
+        "v": EEG_FORMAT_COMPACT,
+        "channels": list(channel_names),
+        "fs": sample_rate,
+        "t0": float(timestamps[0]) if n else None,
+        "n": n,
+        "dtype": "float32",
+        "data": data.tobytes(),
+    }
+
+
+def encode_eeg_frame(version, samples, timestamps, sample_rate, col_names):
+    """
+    Encodes a chunk in the given payload version.
+
+    Parameters:
+    - col_names (list): Channel names followed by "timestamp", as in EEG.col_names.
+    """
+    if version == EEG_FORMAT_COMPACT:
+        return encode_compact_frame(samples, timestamps, sample_rate, col_names[:-1])
+    return encode_records_frame(samples, timestamps, col_names)
+
+
+def encode_band_power(powers, timestamp, bands, channel_names):
+    """
+    Encodes the (channels x bands) band powers of the `band_power` event.
+    Powers are in uV^2 with four significant digits, which keeps the event a
+    few hundred bytes.
+
+    Returns:
+    dict: {"t", "bands", "channels", "power"}, power[c][b] being band b of channel c.
+    """
+    return {
+        "t": float(timestamp),
+        "bands": list(bands),
+        "channels": list(channel_names),
+        "power": [[float(f"{value:.4g}") for value in row] for row in np.asarray(powers).tolist()],
+    }
+
+
+def payload_size(payload):
+    """
+    Returns the approximate size in bytes of a payload once emitted: the length
+    of binary attachments plus the length of the JSON text of everything else.
+    The records of a format 1 frame share one layout, so only the first is measured.
+    """
+    if isinstance(payload, (bytes, bytearray)):
+        return len(payload)
+    if isinstance(payload, str):
+        return len(payload) + 2
+    if isinstance(payload, dict):
+        return 2 + sum(len(str(key)) + 4 + payload_size(value) for key, value in payload.items())
+    if isinstance(payload, (list, tuple)):
+        if not payload:
+            return 2
+        if isinstance(payload[0], dict):
+            return 1 + len(payload) * (payload_size(payload[0]) + 1)
+        return 1 + sum(payload_size(value) + 1 for value in payload)
+    return len(json.dumps(payload))
@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import shutil
+import numpy as np
+import pandas as pd
+
+# A recording is a directory with this suffix holding:
+#   header.json     channel names, sample rate, board id and sample dtype
+#   samples.bin     append-only (samples x channels) array, little-endian
+#   timestamps.bin  append-only float64 timestamps, one per sample
+RECORDING_SUFFIX = ".eegrec"
+RECORDING_VERSION = 1
+HEADER_FILE = "header.json"
+SAMPLES_FILE = "samples.bin"
+TIMESTAMPS_FILE = "timestamps.bin"
+
+
+def is_recording(path):
+    """ Returns True if path is a binary recording rather than a CSV file """
+    return os.path.isdir(path) and os.path.isfile(os.path.join(path, HEADER_FILE))
+
+
+def remove_recording(path):
+    """ Deletes a binary recording or a CSV file """
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+class RecordingWriter:
+    """
+    Appends chunks of samples to a binary recording.
+
+    Every chunk is written as raw bytes at the end of the samples and
+    timestamps files, so appending costs no formatting and no re-reading.
+    The files are opened once and kept open until `close`.
+    """
+
+    def __init__(self, path, channel_names, sample_rate, board_id=None, dtype=np.float32):
+        """
+        Parameters:
+        - path (str): Directory of the recording, created if needed. An existing
+          recording with the same channels is appended to.
+        - channel_names (list): Name of every channel.
+        - sample_rate (float): Nominal sample rate of the board.
+        - board_id (int, optional): BrainFlow board id.
+        - dtype: float32 (default, half the size) or float64 for the samples.
+        """
+        self.path = path
+        self.channel_names = list(channel_names)
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+
+        os.makedirs(path, exist_ok=True)
+        header_path = os.path.join(path, HEADER_FILE)
+        if os.path.isfile(header_path):
+            with open(header_path) as f:
+                header = json.load(f)
+            if header["channels"] != self.channel_names:
+                raise ValueError(f"The recording '{path}' has other channels: {header['channels']}.")
+            self.dtype = np.dtype(header["dtype"])
+        else:
+            header = {
+                "version": RECORDING_VERSION,
+                "channels": self.channel_names,
+                "sample_rate": sample_rate,
+                "board_id": board_id,
+                "dtype": self.dtype.str,
+                "created_at": time.time(),
+            }
+            with open(header_path, 'w') as f:
+                json.dump(header, f, indent=2)
+
+        self._samples = open(os.path.join(path, SAMPLES_FILE), 'ab')
+        self._timestamps = open(os.path.join(path, TIMESTAMPS_FILE), 'ab')
+        self.samples_written = 0
+
+    def append(self, samples, timestamps):
+        """
+        Appends a (channels x n) chunk and its n timestamps.
+        """
+        # Stored sample-major, so every chunk is one contiguous block
+        self._samples.write(np.ascontiguousarray(np.asarray(samples).T, dtype=self.dtype).tobytes())
+        self._timestamps.write(np.ascontiguousarray(timestamps, dtype='<f8').tobytes())
+        self.samples_written += len(timestamps)
+
+    def flush(self):
+        self._samples.flush()
+        self._timestamps.flush()
+
+    def close(self):
+        if not self._samples.closed:
+            self._samples.close()
+            self._timestamps.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Recording:
+    """
+    Read access to a binary recording through memory maps: nothing is loaded
+    until it is sliced, and slices of long sessions are read straight from disk.
+    """
+
+    def __init__(self, path):
+        if not is_recording(path):
+            raise FileNotFoundError(f"'{path}' is not a binary recording.")
+        self.path = path
+        with open(os.path.join(path, HEADER_FILE)) as f:
+            self.header = json.load(f)
+        self.channel_names = self.header["channels"]
+        self.sample_rate = self.header["sample_rate"]
+        self.board_id = self.header.get("board_id")
+        self.dtype = np.dtype(self.header["dtype"])
+
+        n_channels = len(self.channel_names)
+        samples_path = os.path.join(path, SAMPLES_FILE)
+        timestamps_path = os.path.join(path, TIMESTAMPS_FILE)
+        # A chunk interrupted by a crash leaves a partial row, ignore it
+        n = min(os.path.getsize(samples_path) // (self.dtype.itemsize * n_channels),
+                os.path.getsize(timestamps_path) // 8)
+        self.n_samples = n
+
+        if n:
+            self.samples = np.memmap(samples_path, dtype=self.dtype, mode='r', shape=(n, n_channels))
+            self.timestamps = np.memmap(timestamps_path, dtype='<f8', mode='r', shape=(n,))
+        else:
+            self.samples = np.empty((0, n_channels), dtype=self.dtype)
+            self.timestamps = np.empty(0)
+
+    def __len__(self):
+        return self.n_samples
+
+    def read(self, start, stop):
+        """
+        Returns samples [start, stop) as a (samples x channels) array read from
+        the file, without mapping it: memory stays bounded when a long
+        recording is read block by block.
+        """
+        start, stop = max(0, start), min(self.n_samples, stop)
+        n_channels = len(self.channel_names)
+        if stop <= start:
+            return np.empty((0, n_channels), dtype=self.dtype)
+        with open(os.path.join(self.path, SAMPLES_FILE), 'rb') as f:
+            f.seek(start * n_channels * self.dtype.itemsize)
+            data = np.fromfile(f, dtype=self.dtype, count=(stop - start) * n_channels)
+        return data.reshape(stop - start, n_channels)
+
+    @property
+    def duration(self):
+        """ Time between the first and last timestamp, in seconds """
+        return float(self.timestamps[-1] - self.timestamps[0]) if self.n_samples else 0.0
+
+    def to_dataframe(self):
+        """
+        Returns the recording as a DataFrame laid out like the recording CSVs:
+        the channel columns followed by 'timestamp'.
+        """
+        data_frame = pd.DataFrame(np.asarray(self.samples, dtype=float), columns=self.channel_names)
+        data_frame['timestamp'] = np.asarray(self.timestamps)
+        return data_frame
+
+
+def import_csv(csv_path, path=None, sample_rate=None, board_id=None, dtype=np.float32, chunksize=100000):
+    """
+    Converts a recording CSV (index column, channel columns, 'timestamp') to a
+    binary recording, reading it in chunks.
+
+    Parameters:
+    - csv_path (str): CSV written by EEG.save_to_csv.
+    - path (str, optional): Recording directory, defaults to the CSV name with RECORDING_SUFFIX.
+
+    Returns:
+    - recording (Recording): The imported recording.
+    """
+    if path is None:
+        path = os.path.splitext(csv_path)[0] + RECORDING_SUFFIX
+    if os.path.exists(path):
+        raise FileExistsError(f"The recording '{path}' already exists.")
+
+    writer = None
+    try:
+        for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+            # Drop the index column, keep the channels and the timestamps
+            chunk = chunk.drop(columns=[chunk.columns[0]])
+            channels = [column for column in chunk.columns if column != 'timestamp']
+            if writer is None:
+                writer = RecordingWriter(path, channels, sample_rate, board_id, dtype)
+            writer.append(chunk[channels].to_numpy(dtype=float).T, chunk['timestamp'].to_numpy(dtype=float))
+    finally:
+        if writer is not None:
+            writer.close()
+    return Recording(path)
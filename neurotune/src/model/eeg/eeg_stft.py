@@ -0,0 +1,138 @@
+import functools
+import numpy as np
+import scipy.fft
+import scipy.signal
+
+from eeg.eeg_clock import SAMPLE_RATE
+
+# Length of the STFT frames, 1.28 s at the Ganglion's rate
+STFT_N_FFT = 256
+# Frames kept for readers, ~10 s with the default 50% overlap
+STFT_HISTORY = 80
+# Threads of one FFT call; the frames of a chunk are transformed in a single call
+STFT_WORKERS = 2
+
+
+@functools.lru_cache(maxsize=16)
+def stft_window(name, n_fft):
+    """
+    Returns the periodic window `name` of n_fft samples, cached per (name, n_fft).
+    The array is shared and read-only.
+    """
+    window = scipy.signal.get_window(name, n_fft)
+    window.flags.writeable = False
+    return window
+
+
+class RollingSTFT:
+    """
+    Short-time Fourier transform of a live (channels x samples) stream.
+
+    Chunks are appended as they arrive; every `hop` samples a frame of the last
+    `n_fft` samples is detrended (mean removed), windowed and transformed. All
+    the frames completed by a chunk go through one multi-threaded rfft call, and
+    since every call has the same length scipy.fft reuses its cached plan. The
+    last `history` magnitude frames are kept in a ring for the live spectral
+    consumers, which read them instead of transforming the signal again.
+
+    The frames are the same as scipy.signal.stft / welch segments with
+    nperseg=n_fft, noverlap=n_fft-hop and detrend='constant'.
+    """
+
+    def __init__(self, n_channels, sampling_rate=SAMPLE_RATE, n_fft=STFT_N_FFT, hop=None,
+                 window='hann', history=STFT_HISTORY, workers=STFT_WORKERS):
+        """
+        Parameters:
+        - n_channels (int): Number of channels.
+        - sampling_rate (float): Rate of the stream in Hz.
+        - n_fft (int): Frame length in samples.
+        - hop (int, optional): Samples between two frames, defaults to n_fft // 2.
+        - window (str): Window name for scipy.signal.get_window.
+        - history (int): Number of frames kept.
+        - workers (int): Threads used by scipy.fft.
+        """
+        self.n_channels = n_channels
+        self.sampling_rate = sampling_rate
+        self.n_fft = int(n_fft)
+        self.hop = self.n_fft // 2 if hop is None else int(hop)
+        self.window = stft_window(window, self.n_fft)
+        self.workers = workers
+        self.freqs = scipy.fft.rfftfreq(self.n_fft, 1.0 / sampling_rate)
+        # One-sided PSD scaling of |X|^2, like scipy.signal.welch(scaling='density')
+        self.psd_scale = np.full(len(self.freqs), 2.0 / (sampling_rate * np.sum(self.window ** 2)))
+        self.psd_scale[0] /= 2
+        if self.n_fft % 2 == 0:
+            self.psd_scale[-1] /= 2
+
+        self.history = int(history)
+        self._frames = np.zeros((self.history, n_channels, len(self.freqs)))
+        self._frame_ends = np.zeros(self.history, dtype=np.int64)
+        self.frames_total = 0
+        self.samples_seen = 0
+        self._pending = np.empty((n_channels, 0))  # Samples of the next frames
+        self._pending_start = 0  # Sample index of the first pending sample
+
+    def reset(self):
+        """ Forget the frames and pending samples, e.g. after a gap in the stream """
+        self.frames_total = 0
+        self.samples_seen = 0
+        self._pending = np.empty((self.n_channels, 0))
+        self._pending_start = 0
+
+    def process(self, samples):
+        """
+        Adds the next (channels x samples) chunk.
+
+        Returns:
+        - frames (np.ndarray): [frames, channels, freqs] magnitudes of the frames
+          completed by the chunk, possibly none.
+        """
+        samples = np.asarray(samples, dtype=float)
+        self.samples_seen += samples.shape[1]
+        buffer = np.concatenate((self._pending, samples), axis=1) if self._pending.shape[1] else samples
+        count = (buffer.shape[1] - self.n_fft) // self.hop + 1 if buffer.shape[1] >= self.n_fft else 0
+        if count <= 0:
+            self._pending = buffer
+            return np.empty((0, self.n_channels, len(self.freqs)))
+
+        # [channels, frames, n_fft] views of the frames, without copying the samples
+        segments = np.lib.stride_tricks.sliding_window_view(buffer, self.n_fft, axis=1)[:, :count * self.hop:self.hop]
+        segments = segments - segments.mean(axis=-1, keepdims=True)
+        segments *= self.window
+        frames = np.abs(scipy.fft.rfft(segments, axis=-1, workers=self.workers)).transpose(1, 0, 2)
+
+        ends = self._pending_start + self.n_fft + self.hop * np.arange(count)
+        slots = (self.frames_total + np.arange(count)) % self.history
+        self._frames[slots[-self.history:]] = frames[-self.history:]
+        self._frame_ends[slots[-self.history:]] = ends[-self.history:]
+        self.frames_total += count
+
+        self._pending = buffer[:, count * self.hop:]
+        self._pending_start += count * self.hop
+        return frames
+
+    def latest(self, n=1):
+        """
+        Returns copies of the newest n frames, oldest first.
+
+        Returns:
+        - frames (np.ndarray): [n, channels, freqs] magnitudes.
+        - ends (np.ndarray): Index of the sample following each frame.
+        """
+        n = min(int(n), self.frames_total, self.history)
+        slots = (self.frames_total - n + np.arange(n)) % self.history
+        return self._frames[slots], self._frame_ends[slots]
+
+    def psd(self, n_frames):
+        """
+        Welch PSD of the newest n_frames frames, the same as scipy.signal.welch
+        over the samples they cover.
+
+        Returns:
+        - psd (np.ndarray): (channels x freqs) power spectral density, or None
+          before the first frame.
+        """
+        frames, _ = self.latest(n_frames)
+        if len(frames) == 0:
+            return None
+        return np.mean(frames ** 2, axis=0) * self.psd_scale
@@ -0,0 +1,265 @@
+import os
+import math
+import shutil
+import tempfile
+import numpy as np
+import matplotlib.pyplot as plt
+import mne
+from mne.time_frequency import psd_array_welch, tfr_array_multitaper, SpectrumArray
+
+from eeg.eeg_recording import Recording, is_recording, import_csv
+from eeg.eeg_clock import SAMPLE_RATE
+from eeg.eeg_analysis import (input_array, process_raw, compute_shared_tfr, overview_grid, band_grids,
+                              time_frequency, average_psd, freq_bands, TFR_TMAX, WELCH_N_FFT)
+
+# Length of the blocks the recording is read in, in seconds
+STREAM_BLOCK_SECONDS = 5 * 60.
+# Time between two frames of the session-long TFR, in seconds
+SESSION_TFR_FRAME_SECONDS = 0.5
+
+
+def iter_filtered_blocks(recording, sfreq, l_freq=0.1, h_freq=99, block_samples=None):
+    """
+    Band-pass filters a recording block by block, with the same FIR filter as
+    Raw.filter(l_freq, h_freq, fir_design='firwin').
+
+    Every block is read with one filter length of extra samples on each side
+    and only its core is kept, so the result does not depend on the block
+    boundaries: it is the same as filtering the whole recording at once.
+
+    Parameters:
+    - recording (Recording): Recording to filter.
+    - block_samples (int, optional): Length of the cores, defaults to STREAM_BLOCK_SECONDS.
+
+    Yields:
+    - start (int): Index of the first sample of the block.
+    - block (np.ndarray): (channels x n) filtered samples.
+    """
+    n_samples = len(recording)
+    h = mne.filter.create_filter(None, sfreq, l_freq, h_freq, fir_design='firwin', verbose=False)
+    pad = len(h)
+    if block_samples is None:
+        block_samples = int(STREAM_BLOCK_SECONDS * sfreq)
+    # Blocks shorter than the filter would be padded differently than the whole array
+    block_samples = max(int(block_samples), 2 * pad)
+
+    for start in range(0, n_samples, block_samples):
+        stop = min(n_samples, start + block_samples)
+        first, last = max(0, start - pad), min(n_samples, stop + pad)
+        data = recording.read(first, last).astype(float).T
+        filtered = mne.filter.filter_data(data, sfreq, l_freq, h_freq, fir_design='firwin', verbose=False)
+        yield start, filtered[:, start - first:stop - first]
+
+
+class StreamingWelch:
+    """
+    Welch PSD accumulated over consecutive blocks, equal to
+    Raw.compute_psd() (Hamming window, n_fft-sample segments without overlap,
+    DC removed, mean over segments) of the whole signal.
+    """
+
+    def __init__(self, sfreq, n_fft=WELCH_N_FFT):
+        self.sfreq = sfreq
+        self.n_fft = n_fft
+        self.freqs = None
+        self.psd_sum = None
+        self.n_segments = 0
+        self._carry = None  # Samples of an incomplete segment
+
+    def update(self, block):
+        """ Adds a (channels x n) block following the previous one """
+        if self._carry is not None:
+            block = np.concatenate((self._carry, block), axis=1)
+        n_full = (block.shape[1] // self.n_fft) * self.n_fft
+        self._carry = block[:, n_full:]
+        if n_full == 0:
+            return
+        # One PSD per segment, summed here and averaged in result()
+        psds, freqs = psd_array_welch(block[:, :n_full], self.sfreq, n_fft=self.n_fft,
+                                      average=None, verbose=False)
+        segment_sum = psds.sum(axis=-1)
+        self.psd_sum = segment_sum if self.psd_sum is None else self.psd_sum + segment_sum
+        self.freqs = freqs
+        self.n_segments += psds.shape[-1]
+
+    def result(self):
+        """
+        Returns:
+        - freqs (np.ndarray): Frequencies of the PSD.
+        - psd (np.ndarray): (channels x freqs) mean PSD.
+        """
+        if self.n_segments == 0:
+            raise ValueError("The recording is shorter than one Welch segment.")
+        return self.freqs, self.psd_sum / self.n_segments
+
+
+class StreamingTFR:
+    """
+    Decimated multitaper TFR accumulated over consecutive blocks.
+
+    A frame is computed every `decim` samples once the samples within half a
+    wavelet of it are available, from a working buffer that only keeps those
+    samples. The frames are the same as tfr_array_multitaper(..., decim=decim)
+    of the whole signal, while memory only grows with the number of frames.
+    """
+
+    def __init__(self, sfreq, freqs, n_cycles, decim, time_bandwidth=3.0):
+        self.sfreq = sfreq
+        self.freqs = np.asarray(freqs, dtype=float)
+        self.n_cycles = np.asarray(n_cycles, dtype=float)
+        self.decim = int(decim)
+        self.time_bandwidth = time_bandwidth
+
+        # Samples needed on each side of a frame, rounded up to whole frames
+        half_wavelet = math.ceil(np.max(self.n_cycles / self.freqs) * sfreq / 2) + 1
+        self.margin = math.ceil(half_wavelet / self.decim) * self.decim
+
+        self._buffer = None  # (channels x n) filtered samples starting at _buffer_start
+        self._buffer_start = 0
+        self._next_frame = 0  # Sample index of the next frame to compute
+        self.frames = []
+
+    def _compute(self, last_frame, end_of_signal=False):
+        # Frames from _next_frame to last_frame (inclusive), both multiples of decim
+        if last_frame < self._next_frame:
+            return
+        first = max(self._buffer_start, self._next_frame - self.margin)
+        stop = self._buffer_start + self._buffer.shape[1]
+        if not end_of_signal:
+            stop = min(stop, last_frame + self.margin + 1)
+        data = self._buffer[:, first - self._buffer_start:stop - self._buffer_start]
+        power = tfr_array_multitaper(data[np.newaxis], self.sfreq, self.freqs, n_cycles=self.n_cycles,
+                                     time_bandwidth=self.time_bandwidth, output='power',
+                                     decim=self.decim, verbose=False)[0]
+        # Frames of this call sit at first, first + decim, ...
+        offset = (self._next_frame - first) // self.decim
+        count = (last_frame - self._next_frame) // self.decim + 1
+        self.frames.append(power[:, :, offset:offset + count])
+        self._next_frame = last_frame + self.decim
+
+    def update(self, block):
+        """ Adds a (channels x n) block following the previous one """
+        self._buffer = block if self._buffer is None else np.concatenate((self._buffer, block), axis=1)
+        end = self._buffer_start + self._buffer.shape[1]
+
+        # Every frame with a full margin of samples after it can be computed
+        last_frame = ((end - 1 - self.margin) // self.decim) * self.decim
+        self._compute(last_frame)
+
+        # Keep only the samples the next frames still need
+        keep_from = max(self._buffer_start, self._next_frame - self.margin)
+        self._buffer = self._buffer[:, keep_from - self._buffer_start:]
+        self._buffer_start = keep_from
+
+    def finish(self):
+        """
+        Computes the frames up to the end of the signal.
+
+        Returns:
+        - times (np.ndarray): Time of every frame in seconds.
+        - power (np.ndarray): (channels x freqs x frames) power.
+        """
+        if self._buffer is not None:
+            end = self._buffer_start + self._buffer.shape[1]
+            self._compute(((end - 1) // self.decim) * self.decim, end_of_signal=True)
+            self._buffer = None
+        power = np.concatenate(self.frames, axis=-1) if self.frames else np.empty((0, len(self.freqs), 0))
+        times = np.arange(power.shape[-1]) * self.decim / self.sfreq
+        return times, power
+
+
+def plot_session_tfr(times, freqs, power, output_dir):
+    """ Saves the session-long TFR of the first channel to session_tfr.png """
+    fig, ax = plt.subplots(figsize=(12, 4))
+    mesh = ax.pcolormesh(times / 60, freqs, 10 * np.log10(np.maximum(power[0], np.finfo(float).tiny)),
+                         shading='auto', cmap='RdBu_r')
+    ax.set_yscale('log')
+    ax.set_xlabel("Time (min)")
+    ax.set_ylabel("Frequency (Hz)")
+    ax.set_title("Session Time-Frequency Representation (dB)")
+    fig.colorbar(mesh, ax=ax)
+    fig.tight_layout()
+    fig.savefig(os.path.join(output_dir, "session_tfr.png"))
+    plt.close(fig)
+
+
+def run_streaming_analysis(path, output_dir=".", progress=None, cache=None, block_seconds=STREAM_BLOCK_SECONDS):
+    """
+    Bounded-memory counterpart of run_anlaysis for long recordings.
+
+    The recording is read and filtered block by block through its memory map:
+    the Welch PSD and a decimated TFR of the whole session are accumulated as
+    the blocks go by, and the 0-20 s TFR figures are computed from the first
+    block. Peak memory depends on the block length, not on the recording length.
+    Writes the same figures as run_anlaysis plus session_tfr.png.
+
+    Parameters:
+    - path (str): Binary recording, or a CSV which is first imported chunk by chunk.
+    - progress (callable, optional): progress(step, total, stage).
+    - cache (SpectralCache, optional): Cache of the 0-20 s TFR.
+    """
+    def report(step, stage):
+        if progress is not None:
+            progress(step, 5, stage)
+
+    temp_dir = None
+    if not is_recording(path):
+        temp_dir = tempfile.mkdtemp(prefix="neurotune-recording-")
+        path = import_csv(path, os.path.join(temp_dir, "recording.eegrec")).path
+
+    try:
+        recording = Recording(path)
+        # Same channels and montage as run_anlaysis
+        info = process_raw(input_array(np.zeros((len(recording.channel_names), 1)),
+                                       recording.sample_rate or SAMPLE_RATE)).info
+        sfreq = info['sfreq']
+        fmin = float(0.1)
+        fmax = float(99)
+        # Record the band-pass like Raw.filter does, the PSD plot shades what it removed
+        with info._unlock():
+            info['highpass'] = fmin
+            info['lowpass'] = fmax
+        max_time = recording.duration
+
+        grids = band_grids()
+        grids['overview'] = overview_grid(fmin, fmax)
+        overview_freqs, overview_cycles = grids['overview']
+        head_samples = int(math.ceil((TFR_TMAX + np.max(overview_cycles / overview_freqs)
+                                      + max(np.max(c / f) for f, c in grids.values())) * sfreq))
+
+        # Raw.compute_psd() shortens the segments of recordings shorter than one
+        welch = StreamingWelch(sfreq, n_fft=min(WELCH_N_FFT, len(recording)))
+        session_tfr = StreamingTFR(sfreq, overview_freqs, overview_cycles,
+                                   decim=max(1, int(round(SESSION_TFR_FRAME_SECONDS * sfreq))))
+        head = []
+        head_length = 0
+        for start, block in iter_filtered_blocks(recording, sfreq, fmin, fmax,
+                                                 block_samples=int(block_seconds * sfreq)):
+            welch.update(block)
+            # The session TFR is of the first channel, like the figures
+            session_tfr.update(block[:1])
+            if head_length < head_samples:
+                head.append(block[:, :head_samples - head_length])
+                head_length += head[-1].shape[1]
+        report(1, "preprocessing")
+
+        # First and third visualizations only show the first 20 s
+        raw_head = mne.io.RawArray(np.concatenate(head, axis=1), info, verbose=False)
+        tfrs = compute_shared_tfr(raw_head, grids, cache=cache)
+        time_frequency(raw_head, fmin, fmax, max_time, output_dir, tfr_show=tfrs.pop('overview'))
+        report(2, "tfr_fig.png")
+
+        freqs, psd = welch.result()
+        average_psd(None, fmin, fmax, output_dir, spectrum=SpectrumArray(psd, info, freqs))
+        report(3, "avgpsd.png")
+
+        freq_bands(raw_head, max_time, output_dir, band_tfrs=tfrs)
+        report(4, "analysis.png")
+
+        times, power = session_tfr.finish()
+        plot_session_tfr(times, overview_freqs, power, output_dir)
+        report(5, "session_tfr.png")
+        print("done")
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
@@ -0,0 +1,93 @@
+import time
+import threading
+import numpy as np
+
+
+def read_window(buffer, window_seconds, end=None):
+    """
+    Returns copies of the samples and timestamps of the last `window_seconds`
+    before the `end`-th sample of the buffer (the newest by default), or None if
+    the buffer does not hold a full window.
+    """
+    # Take a little more than the nominal window and trim it by timestamp,
+    # so boards with duplicated timestamps still yield `window_seconds` of data
+    n = int(2 * window_seconds * buffer.sample_rate)
+    samples, timestamps = buffer.snapshot(n, end)
+    if len(timestamps) == 0 or timestamps[-1] - timestamps[0] < window_seconds:
+        return None
+    start = np.searchsorted(timestamps, timestamps[-1] - window_seconds)
+    return samples[:, start:], timestamps[start:]
+
+
+class InferenceScheduler:
+    """
+    Schedules inference over the latest window of an EEGRingBuffer every
+    `hop_seconds`, independently of the acquisition loop.
+
+    A ticker thread snapshots the last `window_seconds` of samples every hop and
+    puts the window in `outbox`, normally a BoundedQueue of size one with the
+    drop-oldest policy. The consumer then always works on the newest window; if
+    it is slower than the hop, windows that were never started are dropped
+    instead of piling up and getting stale.
+
+    With `marks_only`, the scheduler puts the buffer's sample count instead of a
+    copy of the window, for consumers that read the window themselves, e.g. a
+    worker process mapping a SharedEEGRingBuffer.
+    """
+
+    def __init__(self, buffer, outbox, window_seconds=3.0, hop_seconds=0.5, marks_only=False):
+        """
+        Parameters:
+        - buffer (EEGRingBuffer): Buffer the acquisition loop writes into.
+        - outbox (BoundedQueue): Queue receiving (samples, timestamps) windows.
+        - window_seconds (float): Length of the window the model sees.
+        - hop_seconds (float): Time between two consecutive windows.
+        - marks_only (bool): Put the sample count the window ends at instead of the window.
+        """
+        self.buffer = buffer
+        self.outbox = outbox
+        self.window_seconds = window_seconds
+        self.hop_seconds = hop_seconds
+        self.marks_only = marks_only
+
+        self._stop = threading.Event()
+        self._thread = None
+        self.submitted = 0
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._tick_loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def latest_window(self):
+        """
+        Returns copies of the samples and timestamps of the last `window_seconds`,
+        or None if the buffer does not hold a full window yet.
+        """
+        return read_window(self.buffer, self.window_seconds)
+
+    def _tick_loop(self):
+        last_count = -1
+        next_tick = time.perf_counter()
+        while not self._stop.is_set():
+            next_tick += self.hop_seconds
+            # Only schedule a window when new samples arrived since the last one
+            count = self.buffer.total_written
+            if count != last_count:
+                if self.marks_only:
+                    # The consumer reads the window, only wait for roughly a window of samples
+                    full = len(self.buffer) >= self.window_seconds * self.buffer.sample_rate
+                    item = count if full else None
+                else:
+                    item = self.latest_window()
+                if item is not None:
+                    last_count = count
+                    self.outbox.put(item)
+                    self.submitted += 1
+            self._stop.wait(max(0.0, next_tick - time.perf_counter()))
@@ -0,0 +1,147 @@
+import time
+import queue
+import itertools
+import logging
+import multiprocessing
+
+from eeg.eeg_buffer import SharedEEGRingBuffer
+from inference_scheduler import read_window
+
+logger = logging.getLogger(__name__)
+
+
+def _worker_main(buffer_spec, window_seconds, requests, results):
+    """
+    Entry point of the worker process: maps the shared ring buffer, loads the
+    model once and answers window requests until it receives None.
+    """
+    # Imported here so the parent does not need the model stack to start a worker
+    from ml.main import inference_from_array
+    from ml.modelInference import get_predictor
+
+    buffer = SharedEEGRingBuffer.attach(**buffer_spec)
+    get_predictor().warm_up()
+    results.put(("ready", None, 0.0))
+
+    try:
+        while True:
+            request = requests.get()
+            if request is None:
+                break
+            request_id, end = request
+
+            start_time = time.perf_counter()
+            try:
+                window = read_window(buffer, window_seconds, end)
+                prediction = None if window is None else inference_from_array(*window, window_seconds)
+            except Exception as e:
+                logger.exception("Inference worker failed on request %s: %s", request_id, e)
+                prediction = None
+            results.put((request_id, prediction, time.perf_counter() - start_time))
+    finally:
+        buffer.close()
+
+
+class InferenceWorker:
+    """
+    Persistent process running feature extraction and model inference on the
+    windows of a SharedEEGRingBuffer.
+
+    The worker maps the session's ring buffer, so a request is only the sample
+    count the window ends at, and the reply is the prediction dict. Features
+    and XGBoost then never hold the GIL of the server process, which keeps the
+    BrainFlow polling loop and socket emits on time.
+    """
+
+    def __init__(self, buffer, window_seconds=3.0, start_timeout=120.0):
+        """
+        Parameters:
+        - buffer (SharedEEGRingBuffer): Buffer the acquisition loop writes into.
+        - window_seconds (float): Length of the window the model sees.
+        - start_timeout (float): Seconds to wait for the worker to load the model.
+        """
+        self.buffer = buffer
+        self.window_seconds = window_seconds
+        self.start_timeout = start_timeout
+
+        # Spawn a fresh interpreter, forking the threaded server is not safe
+        self._context = multiprocessing.get_context("spawn")
+        self._requests = self._context.Queue()
+        self._results = self._context.Queue()
+        self._ids = itertools.count()
+        self.process = None
+
+        self.requests = 0
+        self.failures = 0
+        self.compute_time = 0.0
+        self.round_trip_time = 0.0
+
+    def start(self):
+        """ Starts the worker process and waits until its model is loaded """
+        self.process = self._context.Process(
+            target=_worker_main, name="inference-worker", daemon=True,
+            args=(self.buffer.spec(), self.window_seconds, self._requests, self._results))
+        self.process.start()
+        try:
+            self._results.get(timeout=self.start_timeout)
+        except queue.Empty:
+            self.stop()
+            raise RuntimeError("The inference worker did not start in time.")
+        return self
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def predict(self, end, timeout=10.0):
+        """
+        Scores the window ending at the `end`-th sample of the buffer.
+
+        Returns:
+        - prediction (dict): Same as predict_window, or None if the window was
+          incomplete, failed or timed out.
+        """
+        if not self.is_alive():
+            raise RuntimeError("The inference worker is not running.")
+        request_id = next(self._ids)
+        start_time = time.perf_counter()
+        self._requests.put((request_id, end))
+        self.requests += 1
+
+        deadline = start_time + timeout
+        while True:
+            try:
+                reply_id, prediction, compute_time = self._results.get(
+                    timeout=max(0.0, deadline - time.perf_counter()))
+            except queue.Empty:
+                self.failures += 1
+                return None
+            # Replies to requests that timed out earlier are discarded
+            if reply_id == request_id:
+                break
+
+        self.compute_time += compute_time
+        self.round_trip_time += time.perf_counter() - start_time
+        if prediction is None:
+            self.failures += 1
+        return prediction
+
+    def stop(self, timeout=5.0):
+        if self.process is None:
+            return
+        if self.process.is_alive():
+            self._requests.put(None)
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join(timeout)
+        self.process = None
+
+    def stats(self):
+        answered = max(1, self.requests - self.failures)
+        return {
+            "alive": self.is_alive(),
+            "requests": self.requests,
+            "failures": self.failures,
+            "mean_compute_time": self.compute_time / answered,
+            "mean_round_trip_time": self.round_trip_time / answered,
+        }
@@ -0,0 +1,278 @@
+import math
+import time
+import bisect
+import threading
+
+# Upper bounds of the latency histograms, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Upper bounds of the size histograms, in bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+# Upper bounds of the samples-per-poll histogram
+COUNT_BUCKETS = (1, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_value(value):
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    return repr(float(value))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+               for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class _Timer:
+    """ Context manager observing the time spent in its block """
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.duration = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.duration = time.perf_counter() - self.start
+        self.histogram.observe(self.duration)
+
+
+class _CounterValue:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        if amount < 0:
+            raise ValueError("Counters can only be incremented.")
+        with self._lock:
+            self.value += amount
+
+
+class _GaugeValue:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0.0
+        self._function = None
+
+    def set(self, value):
+        with self._lock:
+            self._value = float(value)
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set_function(self, function):
+        """ Reads the value from function() every time the metric is exposed """
+        self._function = function
+
+    @property
+    def value(self):
+        return float(self._function()) if self._function is not None else self._value
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        """ Returns a context manager observing the duration of its block in seconds """
+        return _Timer(self)
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum
+
+
+class _Metric:
+    """
+    Base of the metric types. A metric declared with label names holds one
+    value per combination of label values, returned by `labels`; a metric
+    without labels is used directly.
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        self._value = None if self.labelnames else self.labels()
+        (REGISTRY if registry is None else registry).register(self)
+
+    def _new_value(self):
+        raise NotImplementedError
+
+    def labels(self, **labels):
+        """ Returns the value of the given label values, created on first use """
+        values = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_value())
+        return child
+
+    def _samples(self, values, child):
+        raise NotImplementedError
+
+    def expose(self):
+        """ Returns the metric in the text exposition format """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            children = sorted(self._children.items())
+        for values, child in children:
+            lines.extend(self._samples(values, child))
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """
+    Value that only goes up, e.g. a number of events. Its name ends with
+    _total, which is added if missing, so the samples are named like the family.
+    """
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        if not name.endswith("_total"):
+            name += "_total"
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_value(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        self._value.inc(amount)
+
+    def _samples(self, values, child):
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+
+class Gauge(_Metric):
+    """ Value that goes up and down, or is read from a function when exposed """
+    kind = "gauge"
+
+    def _new_value(self):
+        return _GaugeValue()
+
+    def set(self, value):
+        self._value.set(value)
+
+    def inc(self, amount=1):
+        self._value.inc(amount)
+
+    def dec(self, amount=1):
+        self._value.dec(amount)
+
+    def set_function(self, function):
+        self._value.set_function(function)
+
+    def _samples(self, values, child):
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values over fixed buckets, e.g. latencies.
+    Observing is a bisection and two additions under a lock.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_value(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._value.observe(value)
+
+    def time(self):
+        return self._value.time()
+
+    def _samples(self, values, child):
+        lines = []
+        cumulative = 0
+        counts, total = child.snapshot()
+        for bound, count in zip(list(self.buckets) + [math.inf], counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, values, [("le", _format_value(bound))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """
+    Set of metrics exposed together. Metrics are registered once by name;
+    declaring a metric under a name that is already taken raises.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"A metric named '{metric.name}' is already registered.")
+            self._metrics[metric.name] = metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def expose(self):
+        """ Returns every metric in the text exposition format """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.expose() for metric in metrics) + "\n"
+
+
+# Process-wide registry, exposed by the backend at /metrics
+REGISTRY = Registry()
+
+# Metrics of the acquisition and inference hot paths, shared by all sessions
+POLL_INTERVAL = Histogram("neurotune_acquisition_poll_interval_seconds",
+                          "Time between two reads of the board's data in EEG.start_streaming.")
+SAMPLES_PER_POLL = Histogram("neurotune_acquisition_samples_per_poll",
+                             "Samples returned by one read of the board's data.", buckets=COUNT_BUCKETS)
+STAGE_SECONDS = Histogram("neurotune_stage_seconds",
+                          "Time spent in a processing stage: filter, stft, process_csv, features, predict "
+                          "or remote_inference (features and prediction in the worker process).",
+                          labelnames=("stage",))
+EMIT_BYTES = Histogram("neurotune_emit_bytes", "Approximate size of an emitted Socket.IO payload.",
+                       labelnames=("event",), buckets=SIZE_BUCKETS)
+EMIT_SECONDS = Histogram("neurotune_emit_seconds", "Time spent emitting a Socket.IO event.",
+                         labelnames=("event",))
+ACTIVE_SESSIONS = Gauge("neurotune_active_sessions", "Live EEG sessions.")
+QUEUE_DROPPED = Counter("neurotune_queue_dropped_total", "Items dropped by a full pipeline queue, windows included.",
+                        labelnames=("queue",))
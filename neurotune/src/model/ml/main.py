@@ -1,11 +1,23 @@
 # main.py
 
 import os
+import json
 import time
+import logging
+import numpy as np
 import pandas as pd
-from ml.processCSV import process_csv
-from ml.preprocessData import extract_features_from_df
-from ml.modelInference import model_inference
+from ml.processCSV import process_csv, process_samples
+from eeg.eeg_recording import is_recording
+from eeg.eeg_clock import SampleClock, MERGED_SAMPLE_RATE
+from ml.preprocessData import extract_features_from_df, extract_features_from_array, extract_features_batch
+from ml.modelInference import model_inference, predict_window, predict_batch, get_predictor
+from metrics import STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Stage timers, the predict stage is timed by the ModelPredictor
+PROCESS_CSV_SECONDS = STAGE_SECONDS.labels(stage="process_csv")
+FEATURES_SECONDS = STAGE_SECONDS.labels(stage="features")
 
 def inference(input_csv):
     """
@@ -13,13 +25,13 @@ def inference(input_csv):
     to produce a prediction JSON file without generating intermediate CSV files.
     """
     # Check if input file exists
-    if not os.path.isfile(input_csv):
+    if not os.path.isfile(input_csv) and not is_recording(input_csv):
         print(f"Error: The input file '{input_csv}' does not exist.")
         return
 
     base_name, ext = os.path.splitext(input_csv)
-    if ext.lower() != '.csv':
-        print("Error: The input file must be a CSV file with a '.csv' extension.")
+    if ext.lower() != '.csv' and not is_recording(input_csv):
+        print("Error: The input file must be a CSV file with a '.csv' extension or a binary recording.")
         return
 
     output_json = f"{base_name}_predictions.json"
@@ -31,18 +43,17 @@ def inference(input_csv):
 
     try:
         # Step 1: Process the CSV
-        print("\n--- Step 1: Processing CSV ---")
-        step_start_time = time.time()
-        df_processed = process_csv(input_csv)
-        step_duration = time.time() - step_start_time
-        print(f"Step 1 completed in {step_duration:.2f} seconds.")
+        logger.info("Step 1: Processing CSV")
+        with PROCESS_CSV_SECONDS.time() as timer:
+            df_processed = process_csv(input_csv)
+        logger.info("Step 1 completed in %.2f seconds.", timer.duration)
 
         # Step 2: Preprocess Data to Extract Features
-        print("\n--- Step 2: Preprocessing Data ---")
-        step_start_time = time.time()
-        feature_vector, feature_names = extract_features_from_df(df_processed, period)
-        step_duration = time.time() - step_start_time
-        print(f"Step 2 completed in {step_duration:.2f} seconds.")
+        logger.info("Step 2: Preprocessing Data")
+        with FEATURES_SECONDS.time() as timer:
+            feature_vector, feature_names = extract_features_from_df(df_processed, period,
+                                                                     get_predictor().used_features())
+        logger.info("Step 2 completed in %.2f seconds.", timer.duration)
 
         # Check if any features were extracted
         if feature_vector is None or feature_names is None:
@@ -53,23 +64,134 @@ def inference(input_csv):
         features_df = pd.DataFrame([feature_vector], columns=feature_names)
 
         # Step 3: Model Inference to Generate Predictions
-        print("\n--- Step 3: Running Model Inference ---")
+        logger.info("Step 3: Running Model Inference")
         step_start_time = time.time()
         predictions = model_inference(features_df)
         step_duration = time.time() - step_start_time
-        print(f"Step 3 completed in {step_duration:.2f} seconds.")
+        logger.info("Step 3 completed in %.2f seconds.", step_duration)
 
         # Save predictions to JSON
         predictions.to_json(output_json, orient='records', indent=4)
         print(f"Predictions saved to {output_json}")
 
         overall_duration = time.time() - overall_start_time
-        print("\nAll steps completed successfully.")
-        print(f"Total time taken: {overall_duration:.2f} seconds.")
+        logger.info("All steps completed successfully in %.2f seconds.", overall_duration)
 
     except Exception as e:
         print(f"\nAn error occurred: {e}")
 
+def features_from_array(samples, timestamps, period=3.0):
+    """
+    Merges duplicate timestamps and extracts the feature vector of one window.
+
+    Parameters:
+    - samples (np.ndarray): (channels x samples) array of EEG samples.
+    - timestamps (np.ndarray): One timestamp per sample.
+    - period (float): Duration of the time window in seconds.
+
+    Returns:
+    - feature_vector (np.ndarray): Extracted features, or None if no features
+      could be extracted.
+    """
+    with PROCESS_CSV_SECONDS.time():
+        signal_data, unique_timestamps = process_samples(samples, timestamps)
+
+    # Only the feature families the model uses are computed
+    with FEATURES_SECONDS.time():
+        feature_vector, feature_names = extract_features_from_array(signal_data, period, unique_timestamps,
+                                                                    get_predictor().used_features())
+    if feature_vector is None or feature_names is None:
+        logger.warning("No features were extracted. Cannot proceed to inference.")
+        return None
+    return feature_vector
+
+def inference_from_array(samples, timestamps, period=3.0, output_json=None):
+    """
+    Runs the inference pipeline on samples taken straight from the acquisition
+    loop, without writing or reading any intermediate file.
+
+    Parameters:
+    - samples (np.ndarray): (channels x samples) array of EEG samples.
+    - timestamps (np.ndarray): One timestamp per sample.
+    - period (float): Duration of the time window in seconds.
+    - output_json (str, optional): If given, the prediction is also saved to
+      this file in the same format as inference().
+
+    Returns:
+    - prediction (dict): Predicted label and per-label probabilities, or None
+      if no features could be extracted.
+    """
+    feature_vector = features_from_array(samples, timestamps, period)
+    if feature_vector is None:
+        return None
+
+    prediction = predict_window(feature_vector)
+
+    if output_json is not None:
+        with open(output_json, 'w') as f:
+            json.dump([prediction], f, indent=4)
+
+    return prediction
+
+def inference_batch(windows):
+    """
+    Runs feature extraction and model inference on a stack of windows in one
+    vectorized pass.
+
+    Parameters:
+    - windows (np.ndarray): [W, N, channels] array of signal windows.
+
+    Returns:
+    - predictions (list): One prediction dict per window.
+    """
+    with FEATURES_SECONDS.time():
+        feature_matrix, feature_names = extract_features_batch(windows, used=get_predictor().used_features())
+    if feature_matrix is None:
+        return []
+    return predict_batch(feature_matrix)
+
+def score_session(samples, timestamps, period=3.0, hop=0.5):
+    """
+    Scores a whole recorded session with overlapping windows.
+
+    Duplicate timestamps are merged and all-zero rows removed first, then the
+    signal is cut into windows of `period` seconds every `hop` seconds, using the
+    session's effective sample rate, and all windows are scored in one batch.
+
+    Parameters:
+    - samples (np.ndarray): (channels x samples) array of EEG samples.
+    - timestamps (np.ndarray): One timestamp per sample.
+    - period (float): Window length in seconds.
+    - hop (float): Time between the starts of consecutive windows in seconds.
+
+    Returns:
+    - predictions (list): One prediction dict per window, with the window start
+      time added under "start".
+    """
+    with PROCESS_CSV_SECONDS.time():
+        signal_data, unique_timestamps = process_samples(samples, timestamps)
+    keep = ~(signal_data == 0).all(axis=1)
+    signal_data, unique_timestamps = signal_data[keep], unique_timestamps[keep]
+    if len(unique_timestamps) < 2:
+        logger.warning("Not enough samples to score the session.")
+        return []
+
+    # Effective number of rows per second once duplicates are merged
+    rate = SampleClock(MERGED_SAMPLE_RATE).update(unique_timestamps).rate
+    window = int(round(period * rate))
+    step = max(1, int(round(hop * rate)))
+    if window < 2 or window > len(signal_data):
+        logger.warning("The session is shorter than one window.")
+        return []
+
+    windows = np.lib.stride_tricks.sliding_window_view(signal_data, window, axis=0)[::step]
+    windows = windows.transpose(0, 2, 1)  # [W, window, channels]
+    predictions = inference_batch(windows)
+    starts = unique_timestamps[::step][:len(predictions)]
+    for prediction, start in zip(predictions, starts):
+        prediction["start"] = float(start)
+    return predictions
+
 # Example usage
 if __name__ == "__main__":
     # Replace 'your_input_file.csv' with your actual input CSV file path
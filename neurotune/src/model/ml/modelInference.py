@@ -6,8 +6,21 @@ import os
 import json
 import joblib
 import sys
+import time
+import hashlib
+import threading
 import xgboost as xgb
 
+from metrics import STAGE_SECONDS
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SCALER_PATH = os.path.join(SCRIPT_DIR, 'scaler.save')
+MODEL_PATH = os.path.join(SCRIPT_DIR, 'best_xgb_model.json')
+# Threads used to predict a single row, more only add synchronisation
+ROW_PREDICT_THREADS = 1
+
+PREDICT_SECONDS = STAGE_SECONDS.labels(stage="predict")
+
 def model_inference(features_df):
     """
     Runs model inference on the extracted features DataFrame and returns predictions.
@@ -18,33 +31,18 @@ def model_inference(features_df):
     Returns:
     - predictions (pd.DataFrame): DataFrame containing predictions and probabilities.
     """
-    # Load scaler and model
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    scaler_path = os.path.join(script_dir, 'scaler.save')
-    model_path = os.path.join(script_dir, 'best_xgb_model.json')
-
-    try:
-        scaler = load_scaler(scaler_path)
-    except Exception as e:
-        print(f"Failed to load scaler: {e}", file=sys.stderr)
-        sys.exit(1)
-
-    try:
-        model = load_trained_model(model_path)
-    except Exception as e:
-        print(f"Failed to load model: {e}", file=sys.stderr)
-        sys.exit(1)
+    predictor = get_predictor()
 
     # Preprocess data
     feature_columns = features_df.columns.tolist()
     X = features_df[feature_columns].values
 
-    # Scale features
-    X_scaled = scaler.transform(X)
-
-    # Make predictions
+    # Scale features and make predictions with the cached scaler/model
     try:
-        predicted_indices, probabilities = make_predictions(model, X_scaled)
+        predicted_indices, probabilities = predictor.predict(X)
+    except (FileNotFoundError, RuntimeError) as e:
+        print(f"Failed to load scaler or model: {e}", file=sys.stderr)
+        sys.exit(1)
     except Exception as e:
         print(f"Prediction failed: {e}", file=sys.stderr)
         sys.exit(1)
@@ -63,6 +61,49 @@ def model_inference(features_df):
 
     return predictions
 
+def predict_window(feature_vector):
+    """
+    Runs model inference on the feature vector of a single window.
+
+    Parameters:
+    - feature_vector (np.ndarray): 1-D array of extracted features.
+
+    Returns:
+    - prediction (dict): Predicted label and the probability of each label, in
+      the same shape as one record of model_inference's output.
+    """
+    predicted_index, probabilities = get_predictor().predict_row(feature_vector)
+
+    label_names = ['bad', 'neutral', 'good']
+    prediction = {
+        "index": 0,
+        "prediction": map_predictions([predicted_index])[0],
+    }
+    prediction.update(zip(label_names, probabilities))
+    return prediction
+
+def predict_batch(feature_matrix):
+    """
+    Runs model inference on the features of many windows with a single
+    batched predict_proba call.
+
+    Parameters:
+    - feature_matrix (np.ndarray): [windows, features] array of extracted features.
+
+    Returns:
+    - predictions (list): One dict per window, as returned by predict_window.
+    """
+    predicted_indices, probabilities = get_predictor().predict(np.asarray(feature_matrix, dtype=float))
+    predicted_labels = map_predictions(predicted_indices)
+
+    label_names = ['bad', 'neutral', 'good']
+    predictions = []
+    for index, (label, row) in enumerate(zip(predicted_labels, probabilities.tolist())):
+        prediction = {"index": index, "prediction": label}
+        prediction.update(zip(label_names, row))
+        predictions.append(prediction)
+    return predictions
+
 # Include all necessary helper functions
 
 def load_scaler(scaler_path):
@@ -88,7 +129,212 @@ def make_predictions(model, X):
     predicted_indices = np.argmax(probabilities, axis=1)
     return predicted_indices, probabilities
 
+def model_used_features(model):
+    """
+    Returns the sorted indices of the input features the booster splits on at
+    least once; features with a split count of zero do not affect predictions.
+    """
+    booster = model.get_booster()
+    names = booster.feature_names
+    used = []
+    for feature in booster.get_score(importance_type='weight'):
+        if names is not None:
+            used.append(names.index(feature))
+        else:
+            used.append(int(feature[1:]))  # Unnamed features are 'f0', 'f1', ...
+    return tuple(sorted(used))
+
 def map_predictions(predicted_indices):
     label_mapping = {0: 'bad', 1: 'neutral', 2: 'good'}
     predicted_labels = [label_mapping.get(idx, "unknown") for idx in predicted_indices]
     return predicted_labels
+
+def file_signature(path):
+    """
+    Returns a cheap (mtime, size) signature used to detect changes to a model file.
+    """
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    Returns the SHA-256 digest of a file, read in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ModelPredictor:
+    """
+    Keeps the scaler and XGBoost model loaded in memory across inference calls.
+
+    The files are loaded lazily on first use. Every call compares the files'
+    (mtime, size) signature with the loaded one; only when it changes is the
+    content hashed, and the model is reloaded only if the hash differs too.
+    All loading happens under a lock, so the predictor can be shared by threads.
+    """
+
+    def __init__(self, scaler_path=SCALER_PATH, model_path=MODEL_PATH):
+        self.scaler_path = scaler_path
+        self.model_path = model_path
+        self._lock = threading.Lock()
+        self._scaler = None
+        self._model = None
+        self._signatures = None
+        self._digests = None
+        self._used_features = None
+        self._row_model = None
+        self._stats = {
+            "loads": 0,
+            "load_time": 0.0,
+            "last_load_time": None,
+            "hits": 0,
+            "predictions": 0,
+        }
+
+    def _current_signatures(self):
+        return (file_signature(self.scaler_path), file_signature(self.model_path))
+
+    def _ensure_loaded(self):
+        """
+        Loads (or reloads) the scaler and model if needed and returns them.
+        """
+        try:
+            signatures = self._current_signatures()
+        except FileNotFoundError:
+            # Let the loaders raise their usual error messages
+            signatures = None
+
+        with self._lock:
+            if self._model is not None and signatures == self._signatures:
+                self._stats["hits"] += 1
+                return self._scaler, self._model
+
+            if self._model is not None and signatures is not None:
+                # Files were touched, only reload if their content changed
+                digests = (file_digest(self.scaler_path), file_digest(self.model_path))
+                if digests == self._digests:
+                    self._signatures = signatures
+                    self._stats["hits"] += 1
+                    return self._scaler, self._model
+
+            start_time = time.perf_counter()
+            scaler = load_scaler(self.scaler_path)
+            model = load_trained_model(self.model_path)
+            load_time = time.perf_counter() - start_time
+
+            self._scaler, self._model = scaler, model
+            self._used_features = model_used_features(model)
+            self._row_model = RowPredictor(scaler, model)
+            self._signatures = self._current_signatures()
+            self._digests = (file_digest(self.scaler_path), file_digest(self.model_path))
+            self._stats["loads"] += 1
+            self._stats["load_time"] += load_time
+            self._stats["last_load_time"] = load_time
+            return self._scaler, self._model
+
+    def warm_up(self):
+        """
+        Loads the scaler and model and runs one dummy prediction so that the
+        first live window does not pay for loading or lazy initialisation.
+        """
+        scaler, model = self._ensure_loaded()
+        X = np.zeros((1, scaler.n_features_in_))
+        model.predict_proba(scaler.transform(X))
+        self._row_model.predict(X[0])
+        return self
+
+    def predict(self, X):
+        """
+        Scales the feature matrix and returns (predicted_indices, probabilities).
+        """
+        scaler, model = self._ensure_loaded()
+        with PREDICT_SECONDS.time():
+            X_scaled = scaler.transform(X)
+            predicted_indices, probabilities = make_predictions(model, X_scaled)
+        with self._lock:
+            self._stats["predictions"] += 1
+        return predicted_indices, probabilities
+
+    def predict_row(self, feature_vector):
+        """
+        Returns (predicted_index, probabilities) of a single feature vector
+        through the RowPredictor of the loaded model.
+        """
+        self._ensure_loaded()
+        row_model = self._row_model
+        with PREDICT_SECONDS.time():
+            result = row_model.predict(feature_vector)
+        with self._lock:
+            self._stats["predictions"] += 1
+        return result
+
+    def used_features(self):
+        """
+        Returns the indices of the features the loaded model uses, for
+        FeatureSchema to skip the feature families it never uses, or None if
+        it uses all of them.
+        """
+        scaler, model = self._ensure_loaded()
+        used = self._used_features
+        if len(used) == scaler.n_features_in_:
+            return None
+        return used
+
+    def stats(self):
+        """
+        Returns a copy of the load/hit counters.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats["used_features"] = len(self._used_features) if self._used_features is not None else None
+        return stats
+
+class RowPredictor:
+    """
+    Low-latency prediction of one feature vector at a time, for live windows.
+
+    The scaler is applied with its mean and scale arrays and the row goes
+    straight to the booster's inplace_predict as contiguous float32, on a
+    copy of the booster limited to ROW_PREDICT_THREADS threads. This skips
+    the sklearn wrappers, the DMatrix construction and the thread pool setup
+    of predict_proba, and gives the same probabilities: XGBoost works on
+    float32 inputs either way.
+    """
+
+    def __init__(self, scaler, model, nthread=ROW_PREDICT_THREADS):
+        self.n_features = scaler.n_features_in_
+        self.mean = np.asarray(scaler.mean_ if scaler.with_mean else np.zeros(self.n_features), dtype=float)
+        self.scale = np.asarray(scaler.scale_ if scaler.with_std else np.ones(self.n_features), dtype=float)
+        self.booster = model.get_booster().copy()
+        self.booster.set_param({"nthread": nthread})
+
+    def predict(self, feature_vector):
+        """
+        Returns:
+        - predicted_index (int): Index of the most probable label.
+        - probabilities (tuple): Probability of every label.
+        """
+        x = np.asarray(feature_vector, dtype=float).reshape(-1)
+        if x.shape[0] != self.n_features:
+            raise ValueError(f"Expected {self.n_features} features, got {x.shape[0]}.")
+        # Scaled in float64 like StandardScaler, then handed over as float32
+        row = ((x - self.mean) / self.scale).astype(np.float32).reshape(1, -1)
+        probabilities = self.booster.inplace_predict(row)[0]
+        return int(np.argmax(probabilities)), tuple(probabilities.tolist())
+
+_predictor = None
+_predictor_lock = threading.Lock()
+
+def get_predictor():
+    """
+    Returns the process-wide ModelPredictor, creating it on first use.
+    """
+    global _predictor
+    if _predictor is None:
+        with _predictor_lock:
+            if _predictor is None:
+                _predictor = ModelPredictor()
+    return _predictor
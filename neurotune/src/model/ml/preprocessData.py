@@ -6,97 +6,168 @@ import scipy.fft
 import scipy.stats
 import scipy.linalg  # For logm function
 import warnings
+import functools
 import matplotlib.pyplot as plt
 import sys
 import os
+import logging
 
+from eeg.eeg_clock import MERGED_SAMPLE_RATE
 
-def extract_features_from_df(df, period):
+logger = logging.getLogger(__name__)
+
+
+CHANNEL_COLUMNS = ['ch1 - AF7', 'ch2 - AF8', 'ch3 - TP9', 'ch4 - TP10']
+
+
+@functools.lru_cache(maxsize=32)
+def resample_operator(n_in, n_out):
+    """
+    Returns the (n_out x n_in) matrix M such that M @ x equals
+    scipy.signal.resample(x, n_out, axis=0) for any x with n_in rows.
+
+    The FFT resampling is linear in the signal and does not depend on the
+    sample rate, so the operator is built once per pair of lengths by
+    resampling the identity, and every window of that length is then resampled
+    with one matrix product over all channels. The matrix is shared and
+    read-only.
+    """
+    operator = scipy.signal.resample(np.eye(n_in), n_out, axis=0)
+    operator.flags.writeable = False
+    return operator
+
+
+def resample_windows(windows, nsamples=100):
+    """
+    Resamples a (N x channels) window, or a [W, N, channels] stack of windows,
+    to `nsamples` rows with the cached operator of resample_operator().
+
+    The first row is subtracted before the product and added back after, so a
+    constant (railed) channel comes out exactly constant like it does from
+    scipy.signal.resample, instead of with a rounding residue that the FFT
+    normalisation by the peak-to-peak range would blow up to full scale.
+    """
+    windows = np.asarray(windows, dtype=float)
+    offset = windows[..., :1, :]
+    return np.matmul(resample_operator(windows.shape[-2], nsamples), windows - offset) + offset
+
+
+def extract_features_from_df(df, period, used=None):
     """
     Extracts statistical features from the DataFrame for the entire time window.
 
     Parameters:
     - df (pd.DataFrame): The processed DataFrame.
     - period (float): Duration of the time window in seconds.
+    - used (tuple, optional): Features the model uses, see FeatureSchema.
 
     Returns:
     - feature_vector (np.ndarray): Array of extracted features.
     - feature_names (list): List of feature names.
     """
     # Ensure required columns are present
-    columns_to_check = ['ch1 - AF7', 'ch2 - AF8', 'ch3 - TP9', 'ch4 - TP10']
+    columns_to_check = CHANNEL_COLUMNS
     missing_columns = [col for col in columns_to_check if col not in df.columns]
     if missing_columns:
         print(f"The following required columns are missing from the data: {missing_columns}")
         return None, None
 
+    timestamps = df['timestamp'].values if 'timestamp' in df.columns else None
+    return extract_features_from_array(df[columns_to_check].values, period, timestamps, used)
+
+
+def extract_features_from_array(signal_data, period, timestamps=None, used=None):
+    """
+    Extracts statistical features from a (samples x channels) signal array
+    for the entire time window.
+
+    Parameters:
+    - signal_data (np.ndarray): Signal matrix with one column per channel.
+    - period (float): Duration of the time window in seconds.
+    - timestamps (np.ndarray, optional): Timestamp of every row. Without them the
+      rows are assumed to be MERGED_SAMPLE_RATE apart.
+    - used (tuple, optional): Features the model uses, see FeatureSchema.
+
+    Returns:
+    - feature_vector (np.ndarray): Array of extracted features.
+    - feature_names (list): List of feature names.
+    """
     # Remove rows where all specified channels are zero
-    df = df[~(df[columns_to_check] == 0).all(axis=1)]
+    nonzero = ~(signal_data == 0).all(axis=1)
+    signal_data = signal_data[nonzero]
 
-    if df.empty:
-        print("DataFrame is empty after filtering zero rows.")
+    if signal_data.shape[0] == 0:
+        logger.warning("DataFrame is empty after filtering zero rows.")
         return None, None
 
-    # Reset timestamps to start from zero and increment accordingly
-    sampling_rate = 100  # 100 Hz
-    df['timestamp'] = np.arange(len(df)) / sampling_rate
-
-    # Extract time and signal data
-    time_column = df['timestamp'].values
-    signal_data = df[columns_to_check].values
-    full_matrix = np.column_stack((time_column, signal_data))
+    # Time of every row from the start of the window
+    if timestamps is not None:
+        timestamps = np.asarray(timestamps, dtype=float)[nonzero]
+        time_column = timestamps - timestamps[0]
+    else:
+        time_column = np.arange(signal_data.shape[0]) / MERGED_SAMPLE_RATE
 
     # Check duration
-    duration = full_matrix[-1, 0] - full_matrix[0, 0]
-    print(f"Window duration: {duration:.6f} seconds.")
+    duration = time_column[-1] - time_column[0]
+    logger.debug("Window duration: %.6f seconds.", duration)
     if duration < 0.9 * period:
-        print(f"Duration {duration:.6f} is less than 90% of period {period}. Processing with available data.")
+        logger.warning("Duration %.6f is less than 90%% of period %s. Processing with available data.", duration, period)
 
     # Perform the resampling of the vector
     nsamples = 100  # Number of samples for resampling
     try:
-        ry, rx = scipy.signal.resample(full_matrix[:, 1:], num=nsamples, t=full_matrix[:, 0], axis=0)
+        ry = resample_windows(signal_data, nsamples)
     except Exception as e:
-        print(f"Resampling failed: {e}")
+        logger.error("Resampling failed: %s", e)
         return None, None
 
     # Compute the feature vector
     if ry.size == 0:
-        print("Resampling resulted in empty data. Skipping this window.")
+        logger.warning("Resampling resulted in empty data. Skipping this window.")
         return None, None
 
-    r, headers = calc_feature_vector(ry)
-    if r.size == 0:
-        print("Feature vector is empty. Skipping this window.")
+    schema = get_feature_schema(ry.shape[1], ry.shape[0], used=used)
+    if schema.size == 0:
+        logger.warning("Feature vector is empty. Skipping this window.")
         return None, None
 
-    # Remove redundant features
-    remove_redundant = True
-    if remove_redundant and headers:
-        # Define prefixes of features to remove
-        to_rm = ["mean_q3_", "mean_q4_", "mean_d_q3q4_",
-                 "max_q3_", "max_q4_", "max_d_q3q4_",
-                 "min_q3_", "min_q4_", "min_d_q3q4_"]
-
-        # Identify indices to remove
-        indices_to_remove = []
-        for rm_prefix in to_rm:
-            for i, name in enumerate(headers):
-                if name.startswith(rm_prefix):
-                    indices_to_remove.append(i)
-
-        # Remove duplicates and sort
-        indices_to_remove = sorted(list(set(indices_to_remove)))
-
-        # Remove from feature names and feature vector
-        if indices_to_remove:
-            r = np.delete(r, indices_to_remove)
-            headers = [name for i, name in enumerate(headers) if i not in indices_to_remove]
-            print(f"Removed {len(indices_to_remove)} redundant features.")
+    # Compute the features and drop the redundant ones with the precomputed mask
+    r = schema.select(schema.compute(ry))
+    headers = schema.kept_names
+    logger.debug("Removed %d redundant features.", schema.size - len(headers))
 
     return r, headers
 
 
+def extract_features_batch(windows, nsamples=100, used=None):
+    """
+    Extracts the features of many windows at once, e.g. overlapping live windows
+    or all windows of a recorded session.
+
+    Every window is resampled to `nsamples` samples and all features are then
+    computed in one vectorized pass over the [W, nsamples, channels] stack.
+    Unlike extract_features_from_array, rows where all channels are zero are not
+    removed per window; drop them from the signal before cutting the windows.
+
+    Parameters:
+    - windows (np.ndarray): [W, N, channels] array of signal windows.
+    - nsamples (int): Number of samples every window is resampled to.
+    - used (tuple, optional): Features the model uses, see FeatureSchema.
+
+    Returns:
+    - feature_matrix (np.ndarray): [W, features] array of extracted features.
+    - feature_names (list): List of feature names.
+    """
+    windows = np.asarray(windows, dtype=float)
+    if windows.ndim != 3 or windows.shape[0] == 0 or windows.shape[1] == 0:
+        logger.warning("No windows to extract features from.")
+        return None, None
+
+    resampled = resample_windows(windows, nsamples)
+    schema = get_feature_schema(resampled.shape[2], resampled.shape[1], used=used)
+    return schema.select(schema.compute_batch(resampled)), schema.kept_names
+
+
 def matrix_from_csv_file(file_path):
     """
     Returns the data matrix given the path of a CSV file.
@@ -127,8 +198,7 @@ def matrix_from_csv_file(file_path):
     #print("Signal variances after filtering:", variances.to_dict())
 
     # Reset timestamps to start from zero and increment accordingly
-    sampling_rate = 100  # 100 Hz
-    df['timestamp'] = np.arange(len(df)) / sampling_rate
+    df['timestamp'] = np.arange(len(df)) / MERGED_SAMPLE_RATE
 
     # Extract the timestamp and signal data
     # Assuming 'timestamp' is the time column and signals are 'ch1 - AF7', 'ch2 - AF8', 'ch3 - TP9', 'ch4 - TP10'
@@ -440,59 +510,297 @@ def feature_fft(matrix, period=2.0, mains_f=50.,
 
     return ret, names
 
-def calc_feature_vector(matrix):
+# Prefixes of the features that are computed but not fed to the model
+REDUNDANT_FEATURE_PREFIXES = ("mean_q3_", "mean_q4_", "mean_d_q3q4_",
+                              "max_q3_", "max_q4_", "max_d_q3q4_",
+                              "min_q3_", "min_q4_", "min_d_q3q4_")
+
+
+def _channel_names(prefix, n_channels):
+    return [prefix + str(i+1) for i in range(n_channels)]
+
+
+def _quarter_names(prefix, n_channels):
+    names = []
+    for i in range(4):  # for all quarter-windows
+        names.extend([prefix + '_q' + str(i + 1) + "_" + str(j+1) for j in range(n_channels)])
+
+    for i in range(3):  # for quarter-windows 1-3
+        for j in range((i + 1), 4):  # and quarter-windows (i+1)-4
+            names.extend([prefix + '_d_q' + str(i + 1) + 'q' + str(j + 1) + "_" + str(k+1)
+                          for k in range(n_channels)])
+    return names
+
+
+def _fill_quarters(out, reduce, windows):
     """
-    Calculates all features and concatenates them into a single feature vector.
+    Writes the quarter-window statistics of a [W, N, C] stack and their pairwise
+    differences, in the same order as feature_mean_q / feature_max_q / feature_min_q.
     """
-    var_names = []
-    var_values = np.array([])
-
-    # Feature extraction steps
-    features = [
-        (feature_mean, [matrix]),
-        (feature_mean_d, [matrix]),
-        (feature_mean_q, [matrix]),
-        (feature_stddev, [matrix]),
-        (feature_stddev_d, [matrix]),
-        (feature_moments, [matrix]),
-        (feature_max, [matrix]),
-        (feature_max_d, [matrix]),
-        (feature_max_q, [matrix]),
-        (feature_min, [matrix]),
-        (feature_min_d, [matrix]),
-        (feature_min_q, [matrix]),
-        (feature_covariance_matrix, [matrix]),
-    ]
-
-    # Calculate features up to covariance matrix
-    covM = None  # Initialize covM
-    for func, args in features:
-        result = func(*args)
-        if func == feature_covariance_matrix:
-            x, v, covM = result
-        else:
-            x, v = result
-        var_names += v
-        var_values = np.hstack([var_values, x])
+    n_channels = windows.shape[2]
+    quarter = windows.shape[1] // 4
+    if quarter == 0:
+        # Handle cases with very few samples
+        quarters = [windows] * 4
+    else:
+        quarters = np.split(windows, [quarter, 2*quarter, 3*quarter], axis=1)
 
-    if covM is None:
-        raise ValueError("Covariance matrix was not computed.")
+    values = out[:, :4 * n_channels].reshape(-1, 4, n_channels)
+    for i, q in enumerate(quarters):
+        values[:, i] = reduce(q, axis=1)
 
-    # Continue with features that depend on covariance matrix
-    eigenvals, eigen_names = feature_eigenvalues(covM)
-    var_names += eigen_names
-    var_values = np.hstack([var_values, eigenvals])
+    position = 4 * n_channels
+    for i in range(3):
+        for j in range((i + 1), 4):
+            np.subtract(values[:, i], values[:, j], out=out[:, position:position + n_channels])
+            position += n_channels
 
-    logcov, logcov_names, _ = feature_logcov(covM)
-    var_names += logcov_names
-    var_values = np.hstack([var_values, logcov])
 
-    # FFT features
-    fft_vals, fft_names = feature_fft(matrix)
-    var_names += fft_names
-    var_values = np.hstack([var_values, fft_vals])
+class FeatureSchema:
+    """
+    Layout of the feature vector for one (channels, nsamples, FFT settings) combination.
+
+    Everything that does not depend on the signal values is worked out once when
+    the schema is compiled: the feature names, the slot of every feature family
+    in the output vector, the FFT frequencies kept after DC/mains removal and
+    the mask of redundant features. compute() then only does the numeric work,
+    writing every feature into a single preallocated array.
 
-    return var_values, var_names
+    A model can declare the features it actually uses (see
+    ModelPredictor.used_features): feature families none of them belong to are
+    then not computed at all and their slots are left at zero.
+
+    Use get_feature_schema() to get a cached, compiled schema.
+    """
+
+    def __init__(self, n_channels, nsamples, period=2.0, mains_f=50.,
+                 filter_mains=True, filter_DC=True, normalise_signals=True,
+                 ntop=10, get_power_spectrum=True, used=None):
+        """
+        Parameters:
+            used (tuple, optional): Indices, in kept_names, of the features the model
+                uses. All features are computed if not given.
+        """
+        self.n_channels = n_channels
+        self.nsamples = nsamples
+        self.normalise_signals = normalise_signals
+        C = n_channels
+
+        # FFT frequencies kept after removing DC and mains components
+        N = nsamples
+        T = period / N
+        freqs = np.linspace(0.0, 1.0 / (2.0 * T), N//2)
+        fft_index = np.arange(N//2)
+        if filter_DC:
+            freqs = freqs[1:]
+            fft_index = fft_index[1:]
+        if filter_mains:
+            indx = np.where(np.abs(freqs - mains_f) <= 1)
+            freqs = np.delete(freqs, indx)
+            fft_index = np.delete(fft_index, indx)
+        self.fft_freqs = freqs
+        self.fft_index = fft_index
+
+        if len(freqs) < ntop:
+            ntop = len(freqs)
+            warnings.warn(f"ntop ({ntop}) is greater than available frequencies after filtering. Adjusting ntop to {ntop}.")
+        self.ntop = ntop
+        self.get_power_spectrum = get_power_spectrum and ntop > 0
+
+        # Feature families in the order of calc_feature_vector, with their names
+        cov_pairs = [(i, j) for i in range(C) for j in range(i, C)]
+        families = [
+            ("mean", _channel_names('mean_', C)),
+            ("mean_d", _channel_names('mean_d_h2h1_', C)),
+            ("mean_q", _quarter_names('mean', C)),
+            ("std", _channel_names('std_', C)),
+            ("std_d", _channel_names('std_d_h2h1_', C)),
+            ("moments", _channel_names('skew_', C) + _channel_names('kurt_', C)),
+            ("max", _channel_names('max_', C)),
+            ("max_d", _channel_names('max_d_h2h1_', C)),
+            ("max_q", _quarter_names('max', C)),
+            ("min", _channel_names('min_', C)),
+            ("min_d", _channel_names('min_d_h2h1_', C)),
+            ("min_q", _quarter_names('min', C)),
+            ("covM", [f'covM_{i+1}_{j+1}' for i, j in cov_pairs]),
+            ("eigenval", [f'eigenval_{i+1}' for i in range(C)]),
+            ("logcovM", [f'logcovM_{i+1}_{j+1}' for i, j in cov_pairs]),
+            ("topFreq", [f'topFreq_{j+1}_{i+1}' for i in range(C) for j in range(ntop)]),
+            ("spectrum", [f'freq_{round(freq, 2):.2f}_{i+1}' for i in range(C) for freq in freqs]
+                         if self.get_power_spectrum else []),
+        ]
+
+        names = []
+        self.slots = {}
+        for family, family_names in families:
+            self.slots[family] = slice(len(names), len(names) + len(family_names))
+            names.extend(family_names)
+
+        self.names = tuple(names)
+        self.size = len(names)
+        self.triu = np.triu_indices(C)
+
+        # Features kept for the model
+        self.keep_mask = np.array([not name.startswith(REDUNDANT_FEATURE_PREFIXES) for name in names], dtype=bool)
+        self.keep_indices = np.flatnonzero(self.keep_mask)
+        self.kept_names = [name for name, keep in zip(names, self.keep_mask) if keep]
+
+        # Feature families with at least one feature the model uses
+        if used is None:
+            self.active = frozenset(self.slots)
+        else:
+            used_positions = self.keep_indices[np.asarray(used, dtype=int)]
+            self.active = frozenset(family for family, slot in self.slots.items()
+                                    if np.any((used_positions >= slot.start) & (used_positions < slot.stop)))
+        self.skipped = [family for family, _ in families if family not in self.active]
+
+    def compute(self, matrix, out=None):
+        """
+        Computes the full feature vector of a (nsamples x channels) window.
+
+        Parameters:
+            matrix (numpy.ndarray): Resampled signal window.
+            out (numpy.ndarray, optional): Preallocated array of length `size`.
+
+        Returns:
+            numpy.ndarray: Feature vector, in the order of `names`.
+        """
+        if out is None:
+            out = np.empty(self.size)
+        self.compute_batch(matrix[np.newaxis], out=out[np.newaxis])
+        return out
+
+    def compute_batch(self, windows, out=None):
+        """
+        Computes the feature vectors of a stack of windows in one vectorized pass.
+
+        Parameters:
+            windows (numpy.ndarray): [W, nsamples, channels] array of resampled windows.
+            out (numpy.ndarray, optional): Preallocated [W, size] array.
+
+        Returns:
+            numpy.ndarray: [W, size] feature matrix, columns in the order of `names`.
+        """
+        W, N, C = windows.shape
+        if out is None:
+            out = np.empty((W, self.size))
+        slots = self.slots
+        active = self.active
+        half = N // 2
+        h1, h2 = windows[:, :half, :], windows[:, half:, :]
+
+        # Families the model does not use stay at zero
+        for family in self.skipped:
+            out[:, slots[family]] = 0.0
+
+        # Means, standard deviations, maxima and minima
+        if "mean" in active:
+            np.mean(windows, axis=1, out=out[:, slots["mean"]])
+        if "mean_d" in active:
+            np.subtract(np.mean(h2, axis=1), np.mean(h1, axis=1), out=out[:, slots["mean_d"]])
+        if "mean_q" in active:
+            _fill_quarters(out[:, slots["mean_q"]], np.mean, windows)
+
+        if "std" in active or "moments" in active:
+            stddev = np.std(windows, axis=1, ddof=1)
+        if "std" in active:
+            out[:, slots["std"]] = stddev
+        if "std_d" in active:
+            np.subtract(np.std(h2, axis=1, ddof=1), np.std(h1, axis=1, ddof=1), out=out[:, slots["std_d"]])
+
+        # Skewness and kurtosis, left at zero for (almost) constant signals
+        if "moments" in active:
+            moments = out[:, slots["moments"]].reshape(W, 2, C)
+            moments[:] = 0.0
+            usable = ~(stddev < 1e-6)
+            if np.any(usable):
+                with np.errstate(all='ignore'), warnings.catch_warnings():
+                    warnings.simplefilter('ignore', RuntimeWarning)
+                    skw = scipy.stats.skew(windows, axis=1, bias=False)
+                    krt = scipy.stats.kurtosis(windows, axis=1, bias=False)
+                moments[:, 0][usable] = skw[usable]
+                moments[:, 1][usable] = krt[usable]
+
+        if "max" in active:
+            np.max(windows, axis=1, out=out[:, slots["max"]])
+        if "max_d" in active:
+            np.subtract(np.max(h2, axis=1), np.max(h1, axis=1), out=out[:, slots["max_d"]])
+        if "max_q" in active:
+            _fill_quarters(out[:, slots["max_q"]], np.max, windows)
+
+        if "min" in active:
+            np.min(windows, axis=1, out=out[:, slots["min"]])
+        if "min_d" in active:
+            np.subtract(np.min(h2, axis=1), np.min(h1, axis=1), out=out[:, slots["min_d"]])
+        if "min_q" in active:
+            _fill_quarters(out[:, slots["min_q"]], np.min, windows)
+
+        # Covariance matrices and the features derived from them
+        if active & {"covM", "eigenval", "logcovM"}:
+            centered = windows - np.mean(windows, axis=1, keepdims=True)
+            covM = np.einsum('wnc,wnd->wcd', centered, centered) / (N - 1)
+        if "covM" in active:
+            out[:, slots["covM"]] = covM[:, self.triu[0], self.triu[1]]
+        if "eigenval" in active:
+            out[:, slots["eigenval"]] = np.linalg.eigvals(covM).real
+
+        # Matrix logarithm of the regularized (symmetric) covariance matrices,
+        # through their eigendecomposition so that the whole stack is done at once
+        if "logcovM" in active:
+            covM_reg = covM + 1e-6 * np.eye(C)
+            eigvals, eigvecs = np.linalg.eigh(covM_reg)
+            with np.errstate(all='ignore'):
+                log_cov = np.einsum('wij,wj,wkj->wik', eigvecs, np.log(eigvals), eigvecs)
+            log_cov = np.nan_to_num(log_cov, nan=0.0, posinf=0.0, neginf=0.0)
+            out[:, slots["logcovM"]] = log_cov[:, self.triu[0], self.triu[1]]
+
+        # FFT features
+        if self.ntop > 0 and active & {"topFreq", "spectrum"}:
+            signals = windows
+            if self.normalise_signals:
+                matrix_min = np.min(signals, axis=1, keepdims=True)
+                matrix_ptp = np.ptp(signals, axis=1, keepdims=True) + 1e-8
+                signals = -1 + 2 * (signals - matrix_min) / matrix_ptp
+
+            # The kept bins are all below N/2, the half spectrum of rfft holds them
+            fft_values = np.abs(scipy.fft.rfft(signals, axis=1))[:, self.fft_index] * 2 / N
+
+            # Argsort in descending order, then lay out channel by channel
+            if "topFreq" in active:
+                top = np.argsort(fft_values, axis=1)[:, ::-1][:, :self.ntop, :]
+                out[:, slots["topFreq"]] = self.fft_freqs[top].transpose(0, 2, 1).reshape(W, -1)
+            if self.get_power_spectrum and "spectrum" in active:
+                out[:, slots["spectrum"]] = fft_values.transpose(0, 2, 1).reshape(W, -1)
+
+        return out
+
+    def select(self, features):
+        """
+        Returns the features kept for the model (redundant ones removed).
+        """
+        return features[..., self.keep_indices]
+
+
+@functools.lru_cache(maxsize=16)
+def get_feature_schema(n_channels, nsamples, period=2.0, mains_f=50.,
+                       filter_mains=True, filter_DC=True, normalise_signals=True,
+                       ntop=10, get_power_spectrum=True, used=None):
+    """
+    Returns the compiled FeatureSchema for the given layout, built once and cached.
+    `used` must be hashable (a tuple) or None.
+    """
+    return FeatureSchema(n_channels, nsamples, period=period, mains_f=mains_f,
+                         filter_mains=filter_mains, filter_DC=filter_DC,
+                         normalise_signals=normalise_signals, ntop=ntop,
+                         get_power_spectrum=get_power_spectrum, used=used)
+
+
+def calc_feature_vector(matrix):
+    """
+    Calculates all features and concatenates them into a single feature vector.
+    """
+    schema = get_feature_schema(matrix.shape[1], matrix.shape[0])
+    return schema.compute(matrix), list(schema.names)
 
 def extract_features_from_csv(file_path, period, output_features_path):
     """
@@ -515,7 +823,7 @@ def extract_features_from_csv(file_path, period, output_features_path):
     # Perform the resampling of the vector
     nsamples = 100  # Number of samples for resampling
     try:
-        ry, rx = scipy.signal.resample(full_matrix[:, 1:], num=nsamples, t=full_matrix[:, 0], axis=0)
+        ry = resample_windows(full_matrix[:, 1:], nsamples)
     except Exception as e:
         print(f"Resampling failed: {e}")
         sys.exit(1)
@@ -525,37 +833,15 @@ def extract_features_from_csv(file_path, period, output_features_path):
         print("Resampling resulted in empty data. Skipping this window.")
         sys.exit(1)
 
-    r, headers = calc_feature_vector(ry)
-    if r.size == 0:
+    schema = get_feature_schema(ry.shape[1], ry.shape[0])
+    if schema.size == 0:
         print("Feature vector is empty. Skipping this window.")
         sys.exit(1)
 
-    feature_vector = r
-    feature_names = headers
-
-    # Remove redundant features
-    remove_redundant = True
-    if remove_redundant and feature_names:
-        # Define prefixes of features to remove
-        to_rm = ["mean_q3_", "mean_q4_", "mean_d_q3q4_",
-                 "max_q3_", "max_q4_", "max_d_q3q4_",
-                 "min_q3_", "min_q4_", "min_d_q3q4_"]
-
-        # Identify indices to remove
-        indices_to_remove = []
-        for rm_prefix in to_rm:
-            for i, name in enumerate(feature_names):
-                if name.startswith(rm_prefix):
-                    indices_to_remove.append(i)
-
-        # Remove duplicates and sort
-        indices_to_remove = sorted(list(set(indices_to_remove)))
-
-        # Remove from feature names and feature vector
-        if indices_to_remove:
-            feature_vector = np.delete(feature_vector, indices_to_remove)
-            feature_names = [name for i, name in enumerate(feature_names) if i not in indices_to_remove]
-            print(f"Removed {len(indices_to_remove)} redundant features.")
+    # Compute the features and drop the redundant ones with the precomputed mask
+    feature_vector = schema.select(schema.compute(ry))
+    feature_names = schema.kept_names
+    print(f"Removed {schema.size - len(feature_names)} redundant features.")
 
     # Reshape feature_vector to 2D array (1 x num_features)
     feature_vector = feature_vector.reshape(1, -1)
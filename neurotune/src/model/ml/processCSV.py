@@ -1,30 +1,48 @@
 # processCSV.py
 
+import numpy as np
 import pandas as pd
 import sys
+import logging
+
+from eeg.eeg_recording import Recording, is_recording
+from eeg.eeg_clock import collapse_duplicates
+
+logger = logging.getLogger(__name__)
 
 def process_csv(input_file):
     """
     Processes the CSV file by:
     1. Deleting the first column.
     2. Rounding the 'timestamp' column to seven decimal places.
-    3. Grouping rows with duplicate rounded 'timestamp' values.
-    4. Calculating the mean for numerical columns.
+    3. Averaging the numerical columns of the rows sharing a rounded
+       'timestamp' (see process_samples).
+
+    Binary recordings (see eeg.eeg_recording) are read through a memory map
+    instead of being parsed, and give the same result.
 
     Returns:
     - df_processed (pd.DataFrame): The processed DataFrame.
     """
+    if is_recording(input_file):
+        recording = Recording(input_file)
+        logger.debug("Successfully loaded '%s'.", input_file)
+        signal, unique_timestamps = process_samples(recording.samples.T, recording.timestamps)
+        df_processed = pd.DataFrame(signal, columns=recording.channel_names)
+        df_processed.insert(0, 'timestamp', unique_timestamps)
+        return df_processed
+
     try:
         df = pd.read_csv(input_file)
-        print(f"Successfully loaded '{input_file}'.")
+        logger.debug("Successfully loaded '%s'.", input_file)
     except FileNotFoundError:
-        print(f"Error: The file '{input_file}' does not exist.")
+        logger.error("The file '%s' does not exist.", input_file)
         sys.exit(1)
     except pd.errors.EmptyDataError:
-        print(f"Error: The file '{input_file}' is empty.")
+        logger.error("The file '%s' is empty.", input_file)
         sys.exit(1)
     except pd.errors.ParserError:
-        print(f"Error: The file '{input_file}' does not appear to be in CSV format.")
+        logger.error("The file '%s' does not appear to be in CSV format.", input_file)
         sys.exit(1)
 
     # Delete the first column (assuming it's unnamed or unnecessary)
@@ -33,35 +51,58 @@ def process_csv(input_file):
 
     # Check if 'timestamp' column exists after deletion
     if 'timestamp' not in df.columns:
-        print("Error: The CSV file does not contain a 'timestamp' column after deleting the first column.")
+        logger.error("The CSV file does not contain a 'timestamp' column after deleting the first column.")
         sys.exit(1)
 
     # Ensure 'timestamp' is treated as float
     df['timestamp'] = pd.to_numeric(df['timestamp'], errors='coerce')
     if df['timestamp'].isnull().any():
         num_nulls = df['timestamp'].isnull().sum()
-        print(f"Warning: {num_nulls} 'timestamp' entries could not be converted to numeric and will be dropped.")
+        logger.warning("%d 'timestamp' entries could not be converted to numeric and will be dropped.", num_nulls)
         df = df.dropna(subset=['timestamp'])
-    print("'timestamp' column successfully converted to numeric.")
-
-    # Round 'timestamp' to seven decimal places
-    df['timestamp'] = df['timestamp'].round(7)
+    logger.debug("'timestamp' column successfully converted to numeric.")
 
     # Identify numerical columns (excluding 'timestamp')
     numerical_cols = df.select_dtypes(include=['number']).columns.tolist()
     if 'timestamp' in numerical_cols:
         numerical_cols.remove('timestamp')
-        print("'timestamp' column removed from numerical columns.")
+        logger.debug("'timestamp' column removed from numerical columns.")
 
     if not numerical_cols:
-        print("Warning: No numerical columns found to calculate means.")
+        logger.warning("No numerical columns found to calculate means.")
 
-    # Group by 'timestamp' and calculate mean for numerical columns
-    try:
-        df_processed = df.groupby('timestamp')[numerical_cols].mean().reset_index()
-        print("Grouping and mean calculation successful.")
-    except Exception as e:
-        print(f"Error during grouping and mean calculation: {e}")
-        sys.exit(1)
+    # Average the rows sharing a timestamp rounded to seven decimal places
+    signal, unique_timestamps = process_samples(df[numerical_cols].to_numpy(dtype=float).T,
+                                                df['timestamp'].to_numpy(dtype=float))
+    df_processed = pd.DataFrame(signal, columns=numerical_cols)
+    df_processed.insert(0, 'timestamp', unique_timestamps)
+    logger.debug("Grouping and mean calculation successful.")
 
     return df_processed
+
+
+def process_samples(samples, timestamps):
+    """
+    Array counterpart of process_csv for data coming straight from the board:
+    rounds the timestamps to seven decimal places and averages the samples
+    that share a rounded timestamp, without pandas (see eeg_clock.collapse_duplicates).
+
+    Parameters:
+    - samples (np.ndarray): (channels x samples) array of EEG samples.
+    - timestamps (np.ndarray): One timestamp per sample.
+
+    Returns:
+    - signal (np.ndarray): (unique timestamps x channels) array of averaged samples.
+    - unique_timestamps (np.ndarray): Sorted unique rounded timestamps.
+    """
+    samples = np.asarray(samples, dtype=float)
+    timestamps = np.asarray(timestamps, dtype=float)
+
+    # Drop samples whose timestamp is not a number
+    valid = np.isfinite(timestamps)
+    if not valid.all():
+        logger.warning("%d 'timestamp' entries are not numeric and will be dropped.", np.count_nonzero(~valid))
+        samples = samples[:, valid]
+        timestamps = timestamps[valid]
+
+    return collapse_duplicates(samples, timestamps)
@@ -0,0 +1,188 @@
+import math
+from collections import deque
+import numpy as np
+
+
+class RunningWindowStats:
+    """
+    Mean, standard deviation, skewness, kurtosis, minimum, maximum and
+    covariance of the last `window` rows of a stream, updated as rows enter
+    and leave the window.
+
+    The moments come from power sums of the rows shifted by an anchor: the
+    sums of (x - a)^1..4 per channel and of (x - a)(x - a)^T across channels.
+    Entering rows are added and leaving rows subtracted, so an update costs
+    O(rows added) instead of O(window). Every `reanchor_every` rows the anchor
+    is moved to the current mean and the sums are recomputed from the window,
+    which keeps the shifted values small and clears the accumulated rounding
+    error. Minima and maxima come from monotonic deques of (index, value)
+    per channel. Rows with a NaN or infinite value are skipped, so the window
+    holds the last `window` finite rows.
+
+    The results match, to rounding, the batch functions of preprocessData
+    applied to the same rows: feature_mean, feature_stddev, feature_moments,
+    feature_max, feature_min and feature_covariance_matrix.
+    """
+
+    def __init__(self, n_channels, window, reanchor_every=None):
+        """
+        Parameters:
+        - n_channels (int): Number of channels.
+        - window (int): Number of rows in the window.
+        - reanchor_every (int, optional): Rows between two recomputations of
+          the sums, defaults to one window.
+        """
+        self.n_channels = n_channels
+        self.window = int(window)
+        self.reanchor_every = self.window if reanchor_every is None else int(reanchor_every)
+        self.total = 0  # Rows seen since creation
+
+        self._rows = np.zeros((self.window, n_channels))  # Ring of the rows in the window
+        self._anchor = np.zeros(n_channels)
+        self._sums = np.zeros((4, n_channels))  # Sums of (x - a)^1..4
+        self._cross = np.zeros((n_channels, n_channels))  # Sum of (x - a)(x - a)^T
+        self._since_anchor = 0
+        self._max = [deque() for _ in range(n_channels)]
+        self._min = [deque() for _ in range(n_channels)]
+
+    def __len__(self):
+        return min(self.total, self.window)
+
+    def _add(self, shifted, sign):
+        powers = shifted.copy()
+        for k in range(4):
+            self._sums[k] += sign * powers.sum(axis=0)
+            if k < 3:
+                powers *= shifted
+        self._cross += sign * (shifted.T @ shifted)
+
+    def _reanchor(self):
+        rows = self._rows[:len(self)]
+        self._anchor = rows.mean(axis=0)
+        self._sums[:] = 0.0
+        self._cross[:] = 0.0
+        self._add(rows - self._anchor, 1)
+        self._since_anchor = 0
+
+    def _push_extrema(self, rows, first):
+        # Rows larger than every later row of the chunk are the only candidates for the maximum;
+        # the deques keep decreasing values, the newest of equal values wins. Minima are maxima
+        # of the negated rows, so both are done in one pass over [rows, -rows]
+        values = np.hstack((rows, -rows))
+        later = np.maximum.accumulate(values[::-1], axis=0)[::-1]
+        later = np.vstack((later[1:], np.full((1, values.shape[1]), -np.inf)))
+        channels, index = np.nonzero((values > later).T)
+        splits = np.searchsorted(channels, np.arange(1, values.shape[1]))
+        candidate_values = values[index, channels].tolist()
+        candidate_index = (first + index).tolist()
+        bounds = [0] + splits.tolist() + [len(channels)]
+        for queue, start, stop in zip(self._max + self._min, bounds[:-1], bounds[1:]):
+            if start == stop:
+                continue
+            head = candidate_values[start]
+            while queue and queue[-1][1] <= head:
+                queue.pop()
+            queue.extend(zip(candidate_index[start:stop], candidate_values[start:stop]))
+
+    def update(self, rows):
+        """
+        Adds the next (n x channels) rows of the stream and returns the stats.
+        """
+        rows = np.asarray(rows, dtype=float)
+        # A NaN would poison the sums and the extrema until it leaves the window
+        finite = np.isfinite(rows).all(axis=1)
+        if not finite.all():
+            rows = rows[finite]
+        m = rows.shape[0]
+        if m == 0:
+            return self
+        if m > self.window:
+            # Only the last window of an oversized chunk stays, in ring order
+            self.total += m - self.window
+            rows = rows[-self.window:]
+            m = self.window
+            self._since_anchor = self.reanchor_every
+
+        if self.total == 0:
+            # Anchor the first sums on the first rows, not on zero
+            self._anchor = rows.mean(axis=0)
+        first = self.total
+        positions = (first + np.arange(m)) % self.window
+        leaving = max(0, first + m - self.window) - max(0, first - self.window)
+        if leaving:
+            # The rows about to be overwritten are the ones leaving the window
+            self._add(self._rows[positions[m - leaving:]] - self._anchor, -1)
+        self._rows[positions] = rows
+        self.total += m
+        self._since_anchor += m
+
+        if self._since_anchor >= self.reanchor_every:
+            self._reanchor()
+        else:
+            self._add(rows - self._anchor, 1)
+
+        self._push_extrema(rows, first)
+        oldest = self.total - self.window
+        for queue in self._max + self._min:
+            while queue[0][0] < oldest:
+                queue.popleft()
+        return self
+
+    def _central(self):
+        # Mean and second to fourth central moments (biased) from the shifted sums
+        n = len(self)
+        mu = self._sums[0] / n
+        s2, s3, s4 = self._sums[1] / n, self._sums[2] / n, self._sums[3] / n
+        m2 = s2 - mu ** 2
+        m3 = s3 - 3 * mu * s2 + 2 * mu ** 3
+        m4 = s4 - 4 * mu * s3 + 6 * mu ** 2 * s2 - 3 * mu ** 4
+        return self._anchor + mu, np.maximum(m2, 0.0), m3, m4
+
+    def mean(self):
+        """ Same as feature_mean of the window """
+        return self._central()[0]
+
+    def std(self):
+        """ Same as feature_stddev (ddof=1) of the window """
+        n = len(self)
+        return np.sqrt(self._central()[1] * n / (n - 1))
+
+    def moments(self, epsilon=1e-6):
+        """
+        Same as feature_moments of the window: unbiased skewness and excess
+        kurtosis of every channel, zero for channels whose std is below epsilon.
+
+        Returns:
+        - skew (np.ndarray), kurt (np.ndarray): One value per channel.
+        """
+        n = len(self)
+        _, m2, m3, m4 = self._central()
+        usable = ~(np.sqrt(m2 * n / (n - 1)) < epsilon)
+        skew = np.zeros(self.n_channels)
+        kurt = np.zeros(self.n_channels)
+        m2 = m2[usable]
+        skew[usable] = m3[usable] / m2 ** 1.5 * math.sqrt(n * (n - 1)) / (n - 2)
+        kurt[usable] = ((n * n - 1) * m4[usable] / m2 ** 2 - 3 * (n - 1) ** 2) / ((n - 2) * (n - 3))
+        return skew, kurt
+
+    def max(self):
+        """ Same as feature_max of the window """
+        return np.array([queue[0][1] for queue in self._max])
+
+    def min(self):
+        """ Same as feature_min of the window """
+        return -np.array([queue[0][1] for queue in self._min])
+
+    def cov(self):
+        """ Same as the covariance matrix of feature_covariance_matrix (ddof=1) """
+        n = len(self)
+        return (self._cross - np.outer(self._sums[0], self._sums[0]) / n) / (n - 1)
+
+    def stats(self):
+        """ Per-channel statistics of the window as lists, None before 4 rows """
+        if len(self) < 4:
+            return None
+        skew, kurt = self.moments()
+        return {"rows": len(self), "mean": self.mean().tolist(), "std": self.std().tolist(),
+                "skew": skew.tolist(), "kurt": kurt.tolist(),
+                "min": self.min().tolist(), "max": self.max().tolist()}
@@ -0,0 +1,344 @@
+import time
+import logging
+import threading
+from collections import deque
+import numpy as np
+
+from eeg.eeg_filter import StreamingBandpass
+from eeg.eeg_stft import RollingSTFT
+from eeg.eeg_bandpower import BandPowerStream, BAND_POWER_RATE
+from eeg.eeg_payload import EEG_FORMAT_RECORDS, encode_eeg_frame, encode_band_power, payload_size
+from ml.main import features_from_array
+from ml.modelInference import predict_window
+from inference_scheduler import InferenceScheduler
+from inference_worker import InferenceWorker
+from metrics import STAGE_SECONDS, EMIT_BYTES, EMIT_SECONDS, QUEUE_DROPPED
+
+logger = logging.getLogger(__name__)
+
+# Overflow policies of a BoundedQueue
+DROP_OLDEST = "drop_oldest"  # Discard the oldest item to make room for the new one
+COALESCE = "coalesce"  # Merge the new item into the newest queued item
+BLOCK = "block"  # Make the producer wait for room
+
+# Where features and predictions are computed
+INFERENCE_THREAD = "thread"  # Stages of the server process
+INFERENCE_PROCESS = "process"  # Worker process mapping the shared ring buffer
+
+_CLOSED = object()
+
+
+class BoundedQueue:
+    """
+    Thread-safe FIFO with a fixed capacity and a configurable overflow policy.
+
+    Counters (items put, dropped, coalesced, highest depth) are kept so the
+    depth of every queue in the pipeline can be observed while it runs.
+    """
+
+    def __init__(self, name, maxsize, policy=DROP_OLDEST, merge=None):
+        """
+        Parameters:
+        - name (str): Name used in the stats.
+        - maxsize (int): Capacity of the queue.
+        - policy (str): DROP_OLDEST, COALESCE or BLOCK.
+        - merge (callable): merge(queued_item, new_item) -> item, required for COALESCE.
+        """
+        if policy == COALESCE and merge is None:
+            raise ValueError("A merge function is required for the coalesce policy.")
+        self.name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self.merge = merge
+        self._items = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+
+        self._dropped_metric = QUEUE_DROPPED.labels(queue=name)
+
+        self.put_count = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item):
+        """
+        Adds an item, applying the overflow policy if the queue is full.
+
+        Returns:
+            bool: False if the queue was closed and the item discarded.
+        """
+        with self._condition:
+            if self._closed:
+                return False
+            self.put_count += 1
+            if len(self._items) >= self.maxsize:
+                if self.policy == COALESCE:
+                    self._items[-1] = self.merge(self._items[-1], item)
+                    self.coalesced += 1
+                    self._condition.notify()
+                    return True
+                elif self.policy == DROP_OLDEST:
+                    self._items.popleft()
+                    self.dropped += 1
+                    self._dropped_metric.inc()
+                else:
+                    while len(self._items) >= self.maxsize and not self._closed:
+                        self._condition.wait()
+                    if self._closed:
+                        return False
+            self._items.append(item)
+            self.max_depth = max(self.max_depth, len(self._items))
+            self._condition.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        """
+        Removes and returns the oldest item. Returns _CLOSED once the queue is
+        closed and drained, or None if the timeout expires.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._items or self._closed, timeout):
+                return None
+            if not self._items:
+                return _CLOSED
+            item = self._items.popleft()
+            self._condition.notify_all()
+            return item
+
+    def close(self):
+        """ Wakes up all producers and consumers; queued items can still be drained """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {
+                "depth": len(self._items),
+                "maxsize": self.maxsize,
+                "policy": self.policy,
+                "put": self.put_count,
+                "dropped": self.dropped,
+                "coalesced": self.coalesced,
+                "max_depth": self.max_depth,
+            }
+
+
+class Stage(threading.Thread):
+    """
+    Worker thread that takes items from its inbox, applies `fn` and puts every
+    non-None result into its outbox.
+    """
+
+    def __init__(self, name, fn, inbox, outbox=None):
+        super().__init__(name=name, daemon=True)
+        self.fn = fn
+        self.inbox = inbox
+        self.outbox = outbox
+
+        self.processed = 0
+        self.errors = 0
+        self.busy_time = 0.0
+        self.last_duration = None
+
+    def run(self):
+        while True:
+            item = self.inbox.get()
+            if item is _CLOSED:
+                break
+            if item is None:
+                continue
+
+            start_time = time.perf_counter()
+            try:
+                result = self.fn(item)
+            except Exception as e:
+                self.errors += 1
+                logger.error("Stage '%s' failed: %s", self.name, e)
+                continue
+            finally:
+                self.last_duration = time.perf_counter() - start_time
+                self.busy_time += self.last_duration
+            self.processed += 1
+
+            if result is not None and self.outbox is not None:
+                self.outbox.put(result)
+
+    def stats(self):
+        return {
+            "processed": self.processed,
+            "errors": self.errors,
+            "busy_time": self.busy_time,
+            "last_duration": self.last_duration,
+        }
+
+
+def _merge_chunks(queued, new):
+    # Coalesce two (samples, timestamps) chunks into one continuous chunk
+    return (np.concatenate((queued[0], new[0]), axis=1),
+            np.concatenate((queued[1], new[1])))
+
+
+class EEGPipeline:
+    """
+    Live processing of one EEG board as explicit stages joined by bounded queues:
+
+        acquisition -> [raw] -> filtering (-> STFT -> band power) -> [emit] -> emission
+             |                                                          ^
+        ring buffer -> windows -> [windows] -> features -> [features] -> inference
+
+    Raw chunks are coalesced when filtering falls behind, so the stateful filter
+    still sees a continuous signal. Windows and feature vectors keep only the
+    newest item, and the emit queue drops the oldest events when sockets are
+    slow. A slow stage therefore never stalls acquisition or the other stages.
+
+    With the process inference mode, the features and inference stages are
+    replaced by one stage handing window end marks to an InferenceWorker, which
+    requires the EEG to write into a SharedEEGRingBuffer.
+    """
+
+    def __init__(self, eeg, emit, eeg_format=EEG_FORMAT_RECORDS, chunk_seconds=0.5,
+                 window_seconds=3.0, hop_seconds=0.5, raw_queue_size=4,
+                 window_queue_size=1, feature_queue_size=1, emit_queue_size=16,
+                 emit_policy=DROP_OLDEST, inference_mode=INFERENCE_THREAD,
+                 band_power_rate=BAND_POWER_RATE):
+        """
+        Parameters:
+        - eeg (EEG): Initialized and streaming EEG board.
+        - emit (callable): emit(event, payload), e.g. SocketIO.emit.
+        - eeg_format (int): Payload version of the eeg_data event.
+        - chunk_seconds (float): Length of the chunks sent to the EEG graph.
+        - window_seconds (float): Length of the window the model sees.
+        - hop_seconds (float): Time between two predictions.
+        - *_queue_size (int): Capacity of each queue.
+        - emit_policy (str): Overflow policy of the emit queue.
+        - inference_mode (str): INFERENCE_THREAD or INFERENCE_PROCESS.
+        - band_power_rate (float): band_power events per second of signal, 0 for none.
+        """
+        self.eeg = eeg
+        self.emit = emit
+        self.eeg_format = eeg_format
+        self.chunk_seconds = chunk_seconds
+        self.window_seconds = window_seconds
+
+        self.raw_queue = BoundedQueue("raw", raw_queue_size, COALESCE, merge=_merge_chunks)
+        self.window_queue = BoundedQueue("windows", window_queue_size, DROP_OLDEST)
+        self.feature_queue = BoundedQueue("features", feature_queue_size, DROP_OLDEST)
+        self.emit_queue = BoundedQueue("emit", emit_queue_size, emit_policy)
+        self.queues = [self.raw_queue, self.window_queue, self.feature_queue, self.emit_queue]
+
+        self.bandpass = StreamingBandpass(len(eeg.eeg_channels), sampling_rate=eeg.sampling_rate)
+        # Frame-by-frame spectra of the filtered signal, read by the live spectral views
+        self.stft = RollingSTFT(len(eeg.eeg_channels), sampling_rate=eeg.sampling_rate)
+        self.band_power = BandPowerStream(self.stft, rate=band_power_rate)
+        self.inference_mode = inference_mode
+        self.worker = None
+        if inference_mode == INFERENCE_PROCESS:
+            self.worker = InferenceWorker(eeg.buffer, window_seconds=window_seconds)
+            inference_stages = [Stage("inference", self._infer_remote, self.window_queue, self.emit_queue)]
+        elif inference_mode == INFERENCE_THREAD:
+            inference_stages = [
+                Stage("features", self._features, self.window_queue, self.feature_queue),
+                Stage("inference", self._infer, self.feature_queue, self.emit_queue),
+            ]
+        else:
+            raise ValueError(f"Unknown inference mode '{inference_mode}'.")
+        self.scheduler = InferenceScheduler(eeg.buffer, self.window_queue,
+                                            window_seconds=window_seconds, hop_seconds=hop_seconds,
+                                            marks_only=self.worker is not None)
+        # Upstream to downstream, so stop() drains them in order
+        self.stages = [Stage("filtering", self._filter, self.raw_queue, self.emit_queue)] \
+            + inference_stages + [Stage("emission", self._emit, self.emit_queue)]
+
+        self._stop = threading.Event()
+        self._acquisition = threading.Thread(target=self._acquire, name="acquisition", daemon=True)
+        self.chunks_acquired = 0
+        self.samples_acquired = 0
+
+    def start(self):
+        if self.worker is not None:
+            self.worker.start()
+        for stage in self.stages:
+            stage.start()
+        self._acquisition.start()
+        self.scheduler.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        """ Stop acquiring, then drain and stop the stages from upstream to downstream """
+        self._stop.set()
+        self._acquisition.join(timeout)
+        self.scheduler.stop(timeout)
+        for stage in self.stages:
+            stage.inbox.close()
+            stage.join(timeout)
+        if self.worker is not None:
+            self.worker.stop(timeout)
+
+    # Stage functions
+
+    def _acquire(self):
+        while not self._stop.is_set():
+            chunk = self.eeg.start_streaming(self.chunk_seconds)
+            if chunk is None:
+                continue
+            samples, timestamps = chunk
+            self.chunks_acquired += 1
+            self.samples_acquired += samples.shape[1]
+            # The chunk is a view of the ring buffer, queue a copy
+            self.raw_queue.put((samples.copy(), timestamps.copy()))
+
+    def _filter(self, chunk):
+        samples, timestamps = chunk
+        with STAGE_SECONDS.labels(stage="filter").time():
+            filtered = self.bandpass.process(samples)
+        # Filtered chunks arrive here in order, so the STFT sees a continuous stream
+        with STAGE_SECONDS.labels(stage="stft").time():
+            self.stft.process(filtered)
+        powers = self.band_power.update()
+        if powers is not None:
+            self.emit_queue.put(('band_power', encode_band_power(powers, timestamps[-1], self.band_power.bands,
+                                                                 self.eeg.col_names[:-1])))
+        payload = encode_eeg_frame(self.eeg_format, filtered, timestamps,
+                                   self.eeg.sampling_rate, self.eeg.col_names)
+        return ('eeg_data', payload)
+
+    def _features(self, window):
+        samples, timestamps = window
+        return features_from_array(samples, timestamps, self.window_seconds)
+
+    def _infer(self, feature_vector):
+        # Emitted as a list of records, like the predictions JSON file
+        return ('output_data', [predict_window(feature_vector)])
+
+    def _infer_remote(self, end):
+        # Features and prediction in the worker process, timed from here
+        with STAGE_SECONDS.labels(stage="remote_inference").time():
+            prediction = self.worker.predict(end)
+        if prediction is None:
+            return None
+        return ('output_data', [prediction])
+
+    def _emit(self, event):
+        name, payload = event
+        EMIT_BYTES.labels(event=name).observe(payload_size(payload))
+        with EMIT_SECONDS.labels(event=name).time():
+            self.emit(name, payload)
+
+    def stats(self):
+        """ Per-queue depth and drop counters and per-stage timings """
+        return {
+            "acquisition": {"chunks": self.chunks_acquired, "samples": self.samples_acquired},
+            "clock": self.eeg.clock.stats() if self.eeg.clock is not None else None,
+            "stft_frames": self.stft.frames_total,
+            "band_power_updates": self.band_power.updates,
+            "windows_scheduled": self.scheduler.submitted,
+            "inference_mode": self.inference_mode,
+            "worker": self.worker.stats() if self.worker is not None else None,
+            "queues": {queue.name: queue.stats() for queue in self.queues},
+            "stages": {stage.name: stage.stats() for stage in self.stages},
+        }
@@ -0,0 +1,252 @@
+import os
+import re
+import time
+import logging
+import shutil
+import threading
+from brainflow.board_shim import BoardIds
+
+from eeg.eeg import EEG
+from eeg.eeg_analysis import run_anlaysis
+from eeg.eeg_recording import remove_recording
+from eeg.eeg_payload import EEG_FORMAT_RECORDS
+from eeg.eeg_bandpower import BAND_POWER_RATE
+from pipeline import EEGPipeline, INFERENCE_THREAD, INFERENCE_PROCESS
+
+logger = logging.getLogger(__name__)
+
+# Boards a session can be opened on
+BOARDS = {
+    "ganglion": BoardIds.GANGLION_BOARD.value,
+    "synthetic": BoardIds.SYNTHETIC_BOARD.value,
+}
+
+# Figures written by run_anlaysis
+ANALYSIS_FIGURES = ("tfr_fig.png", "avgpsd.png", "analysis.png", "session_tfr.png")
+
+
+def publish_figures(source_dir, directory):
+    """ Copies the analysis figures found in source_dir to directory """
+    for name in ANALYSIS_FIGURES:
+        path = os.path.join(source_dir, name)
+        if os.path.isfile(path):
+            shutil.copyfile(path, os.path.join(directory, name))
+
+
+def safe_name(value, default="anonymous"):
+    """ Returns `value` reduced to characters that are safe in a directory name """
+    # Only dots are stripped, to rule out "." and "..", so socket ids differing by an underscore stay distinct
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", str(value or "").strip()).strip(".")
+    return name or default
+
+
+class Session:
+    """
+    One recording: a client connection, its patient, board, ring buffer,
+    pipeline and artifact directory.
+
+    All events of the session are emitted to its room (the client's socket id),
+    and every file it writes goes to `<artifact_root>/<patient>/<sid>/`, so
+    any number of sessions can run side by side in one server process.
+    """
+
+    def __init__(self, sid, patient, emit, artifact_root="sessions", board="ganglion",
+                 serial_port="COM6", eeg_format=EEG_FORMAT_RECORDS, chunk_seconds=0.5,
+                 window_seconds=3.0, hop_seconds=0.5, inference_mode=INFERENCE_THREAD,
+                 analysis_jobs=None, on_finished=None, band_power_rate=BAND_POWER_RATE):
+        """
+        Parameters:
+        - sid (str): Socket.IO session id of the client.
+        - patient (str): Patient the recording belongs to.
+        - emit (callable): emit(event, payload, to=room), e.g. SocketIO.emit.
+        - artifact_root (str): Directory holding the artifacts of all sessions.
+        - board (str): Key of BOARDS.
+        - serial_port (str): Serial port of the board.
+        - eeg_format (int): Payload version of the eeg_data event.
+        - inference_mode (str): Run features and predictions on pipeline threads or in a
+          worker process mapping the session's ring buffer (INFERENCE_PROCESS).
+        - analysis_jobs (AnalysisJobQueue, optional): Queue the end-of-session analysis
+          runs on; it runs on the session's thread if not given.
+        - on_finished (callable): on_finished(session), called when the recording thread ends.
+        - band_power_rate (float): band_power events per second, 0 for none.
+        """
+        if board not in BOARDS:
+            raise ValueError(f"Unknown board '{board}', expected one of {list(BOARDS)}.")
+        self.sid = sid
+        self.patient = safe_name(patient)
+        self.room = sid
+        self.board = board
+        self.serial_port = serial_port
+        self.eeg_format = eeg_format
+        self.chunk_seconds = chunk_seconds
+        self.window_seconds = window_seconds
+        self.hop_seconds = hop_seconds
+        self.inference_mode = inference_mode
+        self.band_power_rate = band_power_rate
+        self.artifact_dir = os.path.join(artifact_root, self.patient, safe_name(sid))
+        self._emit = emit
+        self.analysis_jobs = analysis_jobs
+        self.on_finished = on_finished
+
+        self.eeg = None
+        self.pipeline = None
+        self.thread = None
+        self.created_at = time.time()
+        self.stopped = threading.Event()
+        self.is_done = False  # Set once the recording is analysed or its analysis queued
+        self.analysis_job = None  # Job of the end-of-session analysis, when queued
+
+    def emit(self, event, payload):
+        """ Emits an event to the clients in the session's room """
+        self._emit(event, payload, to=self.room)
+
+    def set_eeg_format(self, eeg_format):
+        self.eeg_format = eeg_format
+        if self.pipeline is not None:
+            self.pipeline.eeg_format = eeg_format
+
+    def start(self):
+        """ Starts the recording thread of the session """
+        if self.thread is None or not self.thread.is_alive():
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self.run, name=f"session-{self.sid}", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        """ Asks the recording thread to stop; the analysis then runs on that thread """
+        self.stopped.set()
+
+    def join(self, timeout=None):
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+
+    def run(self):
+        try:
+            self._record()
+        finally:
+            if self.on_finished is not None:
+                self.on_finished(self)
+
+    def _record(self):
+        os.makedirs(self.artifact_dir, exist_ok=True)
+
+        self.eeg = EEG()
+        self.eeg.output_dir = self.artifact_dir
+        self.eeg.shared_buffer = self.inference_mode == INFERENCE_PROCESS
+        self.eeg.init_params(serial_port=self.serial_port, board_id=BOARDS[self.board])
+        if self.board == "synthetic":
+            # BrainFlow allows one board per (id, params) pair, tell the synthetic boards apart
+            self.eeg.params.other_info = self.sid
+        self.eeg.init_board()
+        try:
+            self.eeg.init_stream()
+        except Exception as e:
+            logger.error("Session %s: could not start the board: %s", self.sid, e)
+            self.eeg.stop_board()
+            self.emit('disconnected', "error")
+            return
+
+        # Acquisition, filtering, features, inference and emission run as separate
+        # stages, so a slow model or slow clients never stall acquisition
+        self.pipeline = EEGPipeline(self.eeg, self.emit, eeg_format=self.eeg_format,
+                                    chunk_seconds=self.chunk_seconds,
+                                    window_seconds=self.window_seconds,
+                                    hop_seconds=self.hop_seconds,
+                                    inference_mode=self.inference_mode,
+                                    band_power_rate=self.band_power_rate)
+        try:
+            self.pipeline.start()
+        except RuntimeError as e:
+            logger.error("Session %s: could not start the pipeline: %s", self.sid, e)
+            self.eeg.stop_board()
+            self.emit('disconnected', "error")
+            return
+
+        self.stopped.wait()
+
+        self.pipeline.stop()
+        logger.info("Session %s pipeline stats: %s", self.sid, self.pipeline.stats()['queues'])
+        self.eeg.stop_board()
+
+        final_file_path = self.eeg.final_file_path()
+        if os.path.exists(final_file_path) and self.analysis_jobs is not None:
+            # The analysis runs in a worker process, the session closes right away
+            self.analysis_job = self.analysis_jobs.submit(final_file_path, self.artifact_dir,
+                                                          room=self.room, session=self.sid,
+                                                          patient=self.patient, delete_input=True)
+            self.emit('analysis_queued', {'job_id': self.analysis_job.job_id})
+        elif os.path.exists(final_file_path):
+            try:
+                run_anlaysis(final_file_path, output_dir=self.artifact_dir)
+            except Exception as e:
+                # e.g. a recording too short for the analysis, the session still ends cleanly
+                logger.error("Session %s: analysis failed: %s", self.sid, e)
+            finally:
+                remove_recording(final_file_path)
+        self.is_done = True
+        self.emit('disconnected', "done")
+
+    def artifact_path(self, name):
+        """ Returns the path of an artifact of the session, or None if it does not exist """
+        path = os.path.join(self.artifact_dir, os.path.basename(name))
+        return path if os.path.isfile(path) else None
+
+    def stats(self, pipeline=True):
+        """ Session summary, with the pipeline stats unless `pipeline` is False """
+        stats = {
+            "sid": self.sid,
+            "patient": self.patient,
+            "board": self.board,
+            "created_at": self.created_at,
+            "running": self.thread is not None and self.thread.is_alive(),
+            "done": self.is_done,
+            "artifact_dir": self.artifact_dir,
+            "analysis_job": self.analysis_job.job_id if self.analysis_job is not None else None,
+        }
+        if pipeline:
+            stats["pipeline"] = self.pipeline.stats() if self.pipeline is not None else {}
+        return stats
+
+
+class SessionRegistry:
+    """
+    Thread-safe registry of the live sessions, keyed by socket session id and
+    indexed by patient.
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def add(self, session):
+        with self._lock:
+            if session.sid in self._sessions:
+                raise ValueError(f"Session {session.sid} is already registered.")
+            self._sessions[session.sid] = session
+        return session
+
+    def get(self, sid):
+        with self._lock:
+            return self._sessions.get(sid)
+
+    def remove(self, sid):
+        """ Removes and returns the session, or None if it is not registered """
+        with self._lock:
+            return self._sessions.pop(sid, None)
+
+    def by_patient(self, patient):
+        patient = safe_name(patient)
+        with self._lock:
+            return [session for session in self._sessions.values() if session.patient == patient]
+
+    def sessions(self):
+        with self._lock:
+            return list(self._sessions.values())
+
+    def stats(self, pipeline=True):
+        return {session.sid: session.stats(pipeline) for session in self.sessions()}